@@ -1,5 +1,6 @@
 from .config import settings
 from .models import SessionLocal, Request
+from .spend_tracker import spend_tracker
 from sqlalchemy.orm import Session
 from datetime import datetime, timedelta
 from typing import Dict, Optional
@@ -48,22 +49,11 @@ def should_trigger_cooldown(project_id: str) -> bool:
     """
     Check if the project should be rate limited based on recent spending
     """
-    db = SessionLocal()
-    try:
-        # Get requests from the last hour
-        one_hour_ago = datetime.utcnow() - timedelta(hours=1)
-        recent_requests = db.query(Request).filter(
-            Request.project_id == project_id,
-            Request.timestamp > one_hour_ago
-        ).all()
-        
-        # Calculate total cost in the last hour
-        total_cost = sum(req.total_cost_usd for req in recent_requests)
-        
-        # Check if it exceeds the threshold
-        return total_cost > settings.advisor.max_cost_per_hour_usd
-    finally:
-        db.close()
+    # Total cost in the last hour, from the in-memory sliding window
+    total_cost = spend_tracker.get_spend(project_id)
+    
+    # Check if it exceeds the threshold
+    return total_cost > settings.advisor.max_cost_per_hour_usd
 
 def generate_message(level: int, cost_usd: float, similarity: float = 0.0, model: str = "gpt-4o", 
                     repeat_count: int = 1, time_spent: int = 1) -> str:
@@ -0,0 +1,203 @@
+"""
+Aggregation queries shared by the stats endpoints.
+Everything here is computed with GROUP BY and conditional SUM/COUNT in SQL,
+mostly over the rollup tables, so no request rows are materialized in Python.
+"""
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Set, Tuple
+from sqlalchemy import and_, case, func, literal, select
+from sqlalchemy.orm import Session
+from .models import Request, RequestRollupHourly, RequestRollupDaily
+from .rollups import COUNTER_COLUMNS, PROGRESS_COLUMNS, floor_hour, floor_day, ceil_to
+
+
+class RequestSummary:
+    """Counters for a time range, broken down by project and model"""
+    
+    def __init__(self):
+        self.totals: Dict[str, float] = dict.fromkeys(COUNTER_COLUMNS, 0)
+        self.models: Dict[str, Dict[str, float]] = {}
+        self.projects: Set[str] = set()
+    
+    def add(self, project_id: str, model: str, counters: Dict[str, Any]):
+        if not counters.get("request_count"):
+            return
+        for column in COUNTER_COLUMNS:
+            self.totals[column] += counters.get(column) or 0
+        stats = self.models.setdefault(model, {"requests": 0, "cost": 0.0})
+        stats["requests"] += counters["request_count"]
+        stats["cost"] += counters.get("total_cost_usd") or 0.0
+        self.projects.add(project_id)
+    
+    @property
+    def request_count(self) -> int:
+        return int(self.totals["request_count"])
+    
+    @property
+    def total_cost_usd(self) -> float:
+        return float(self.totals["total_cost_usd"])
+    
+    def level_count(self, min_level: int) -> int:
+        """Requests with advisor_level >= min_level"""
+        return int(sum(self.totals[f"level_{level}"] for level in range(max(min_level, 0), 5)))
+
+
+def _count_if(condition):
+    return func.sum(case((condition, 1), else_=0))
+
+
+def _raw_counter_columns() -> List:
+    """Conditional aggregates over raw requests, mirroring rollups.record_counters"""
+    level = func.coalesce(Request.advisor_level, 0)
+    progress = Request.progress_indicator
+    columns = [
+        func.count().label("request_count"),
+        func.sum(func.coalesce(Request.prompt_tokens, 0)).label("prompt_tokens"),
+        func.sum(func.coalesce(Request.completion_tokens, 0)).label("completion_tokens"),
+        func.sum(func.coalesce(Request.total_cost_usd, 0.0)).label("total_cost_usd"),
+        _count_if(level <= 0).label("level_0"),
+        _count_if(level == 1).label("level_1"),
+        _count_if(level == 2).label("level_2"),
+        _count_if(level == 3).label("level_3"),
+        _count_if(level >= 4).label("level_4"),
+    ]
+    for indicator, column in PROGRESS_COLUMNS.items():
+        columns.append(_count_if(progress == indicator).label(column))
+    columns.append(_count_if(func.coalesce(progress, "").notin_(list(PROGRESS_COLUMNS))).label("progress_other"))
+    columns.append(_count_if(Request.pattern_score >= 3).label("debug_pattern_count"))
+    columns.append(_count_if(and_(
+        Request.pattern_score != 0,
+        Request.pattern_score < 3,
+        Request.similarity_score < 0.5
+    )).label("development_pattern_count"))
+    return columns
+
+
+def _add_rollup_range(db: Session, summary: RequestSummary, table_model, start: datetime, end: datetime, project_id: Optional[str]):
+    table = table_model.__table__
+    query = select(
+        table.c.project_id,
+        table.c.model,
+        *[func.sum(table.c[column]).label(column) for column in COUNTER_COLUMNS]
+    ).where(table.c.bucket_start >= start, table.c.bucket_start < end)
+    if project_id is not None:
+        query = query.where(table.c.project_id == project_id)
+    query = query.group_by(table.c.project_id, table.c.model)
+    for row in db.execute(query).mappings():
+        summary.add(row["project_id"], row["model"], row)
+
+
+def _add_raw_range(db: Session, summary: RequestSummary, start: datetime, end: Optional[datetime], project_id: Optional[str]):
+    project = func.coalesce(Request.project_id, literal("default")).label("project_id")
+    model = func.coalesce(Request.model, literal("unknown")).label("model")
+    query = select(project, model, *_raw_counter_columns()).where(Request.timestamp >= start)
+    if end is not None:
+        query = query.where(Request.timestamp < end)
+    if project_id is not None:
+        query = query.where(Request.project_id == project_id)
+    query = query.group_by(project, model)
+    for row in db.execute(query).mappings():
+        summary.add(row["project_id"], row["model"], row)
+
+
+def summarize_requests(db: Session, start: datetime, end: Optional[datetime] = None, project_id: Optional[str] = None) -> RequestSummary:
+    """
+    Summarize requests with start <= timestamp < end (end=None means up to now).
+    Whole days come from the daily rollup, whole hours from the hourly rollup and
+    only the partial hours at the edges from grouped raw requests.
+    """
+    summary = RequestSummary()
+    first_hour = ceil_to(start, floor_hour, timedelta(hours=1))
+    # An open range includes the current hour's bucket as it stands
+    last_hour = floor_hour(end) if end is not None else floor_hour(datetime.utcnow()) + timedelta(hours=1)
+    
+    if first_hour >= last_hour:
+        _add_raw_range(db, summary, start, end, project_id)
+        return summary
+    
+    _add_raw_range(db, summary, start, first_hour, project_id)
+    first_day = ceil_to(first_hour, floor_day, timedelta(days=1))
+    last_day = floor_day(last_hour)
+    if first_day < last_day:
+        _add_rollup_range(db, summary, RequestRollupHourly, first_hour, first_day, project_id)
+        _add_rollup_range(db, summary, RequestRollupDaily, first_day, last_day, project_id)
+        _add_rollup_range(db, summary, RequestRollupHourly, last_day, last_hour, project_id)
+    else:
+        _add_rollup_range(db, summary, RequestRollupHourly, first_hour, last_hour, project_id)
+    if end is not None and last_hour < end:
+        _add_raw_range(db, summary, last_hour, end, project_id)
+    return summary
+
+
+def daily_costs(db: Session, first_day: datetime, end_day: Optional[datetime] = None, project_id: Optional[str] = None) -> Dict[datetime, float]:
+    """
+    Cost per day bucket, one GROUP BY over the daily rollup.
+    The bucket is a precomputed column, so the query is the same on SQLite and Postgres.
+    """
+    table = RequestRollupDaily.__table__
+    query = select(table.c.bucket_start, func.sum(table.c.total_cost_usd)).where(table.c.bucket_start >= first_day)
+    if end_day is not None:
+        query = query.where(table.c.bucket_start < end_day)
+    if project_id is not None:
+        query = query.where(table.c.project_id == project_id)
+    query = query.group_by(table.c.bucket_start)
+    return {bucket_start: cost or 0.0 for bucket_start, cost in db.execute(query)}
+
+
+def daily_cost_series(db: Session, num_days: int, project_id: Optional[str] = None) -> List[Dict[str, object]]:
+    """
+    Daily trend for the last num_days days including today, oldest first.
+    Days without requests are filled in with zero cost.
+    """
+    today = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+    first_day = today - timedelta(days=num_days - 1)
+    costs = daily_costs(db, first_day, today + timedelta(days=1), project_id=project_id)
+    
+    series = []
+    for i in range(num_days):
+        day_start = first_day + timedelta(days=i)
+        series.append({
+            "date": day_start.strftime("%m-%d"),
+            "cost": round(costs.get(day_start, 0.0), 2)
+        })
+    return series
+
+
+# Sort keys accepted by project_summaries
+PROJECT_SORT_KEYS = ("last_activity", "cost", "requests", "name")
+
+
+def project_summaries(
+    db: Session,
+    sort: str = "last_activity",
+    descending: bool = True,
+    limit: Optional[int] = None,
+    offset: int = 0
+) -> Tuple[List[Dict[str, Any]], int]:
+    """
+    Total cost, request count and last activity for every project in one GROUP BY.
+    Returns (page of projects, total number of projects).
+    """
+    table = RequestRollupDaily.__table__
+    total_cost = func.sum(table.c.total_cost_usd).label("total_cost_usd")
+    request_count = func.sum(table.c.request_count).label("request_count")
+    last_request_at = func.max(table.c.last_request_at).label("last_request_at")
+    sort_column = {
+        "last_activity": last_request_at,
+        "cost": total_cost,
+        "requests": request_count,
+        "name": table.c.project_id,
+    }.get(sort, last_request_at)
+    
+    query = (
+        select(table.c.project_id, total_cost, request_count, last_request_at)
+        .group_by(table.c.project_id)
+        .order_by(sort_column.desc() if descending else sort_column.asc(), table.c.project_id)
+        .offset(offset)
+    )
+    if limit is not None:
+        query = query.limit(limit)
+    
+    projects = [dict(row) for row in db.execute(query).mappings()]
+    total = db.execute(select(func.count(func.distinct(table.c.project_id)))).scalar() or 0
+    return projects, total
@@ -0,0 +1,189 @@
+"""
+Runs analyze_behavior in a bounded thread pool so the blocking history query
+and similarity scoring never stall the event loop, and batches of analyses
+(log replays) in a process pool.
+"""
+import asyncio
+import multiprocessing
+import threading
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Deque, Dict, Iterable, Iterator, List, Optional
+from .analyzer import analyze_behavior
+from .config import settings
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+_batch_executor: Optional[ProcessPoolExecutor] = None
+
+# Analyses submitted but not finished, including ones abandoned after a timeout
+_inflight = 0
+_inflight_lock = threading.Lock()
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=max(1, settings.analyzer.max_concurrency),
+                thread_name_prefix="analyzer"
+            )
+        return _executor
+
+
+def _release(_future):
+    global _inflight
+    with _inflight_lock:
+        _inflight -= 1
+
+
+def degraded_analysis(reason: str) -> Dict:
+    """
+    Neutral analysis result used when the real analysis could not run in time
+    """
+    return {
+        "level": 0,
+        "confidence": 0.0,
+        "reasons": [],
+        "details": {
+            "similarity": 0.0,
+            "topic_drift": 0.0,
+            "emotion_score": 0,
+            "progress": "unknown",
+            "task_type": "unknown",
+            "repeat_count": 0,
+            "degraded": True,
+            "degraded_reason": reason
+        }
+    }
+
+
+async def run_analysis(project_id: str, messages: List[Dict[str, str]], model: str = "gpt-4o") -> Dict:
+    """
+    Run analyze_behavior off the event loop within the configured time budget.
+    Returns a degraded result instead of blocking when the pool is saturated,
+    the budget is exceeded or the analysis fails.
+    """
+    global _inflight
+    with _inflight_lock:
+        if _inflight >= settings.analyzer.max_pending:
+            return degraded_analysis("overloaded")
+        _inflight += 1
+    
+    future = _get_executor().submit(analyze_behavior, project_id, messages, model)
+    future.add_done_callback(_release)
+    
+    try:
+        return await asyncio.wait_for(
+            asyncio.wrap_future(future),
+            timeout=settings.analyzer.time_budget_ms / 1000
+        )
+    except asyncio.TimeoutError:
+        # Cancelling only drops analyses still queued; a running one finishes in the background
+        future.cancel()
+        print(f"[Analyzer] Analysis for project {project_id} exceeded {settings.analyzer.time_budget_ms}ms, forwarding with degraded analysis")
+        return degraded_analysis("timeout")
+    except Exception as e:
+        print(f"[Analyzer] Analysis for project {project_id} failed: {str(e)}")
+        return degraded_analysis("error")
+
+
+def _analyze_chunk(items: List[Dict], use_history: bool) -> List[Dict]:
+    """
+    Analyze consecutive batch items in one worker. Items of a chunk share the
+    worker's text memo, so a conversation replayed turn by turn tokenizes and
+    fingerprints each message once.
+    """
+    results = []
+    for index, item in items:
+        try:
+            result = analyze_behavior(
+                item["project_id"], item["messages"], item.get("model") or "gpt-4o",
+                use_history=use_history
+            )
+        except Exception as e:
+            result = degraded_analysis("error")
+            result["error"] = str(e)
+        result["index"] = index
+        result["project_id"] = item["project_id"]
+        results.append(result)
+    return results
+
+
+def _get_batch_executor() -> ProcessPoolExecutor:
+    """
+    The batch process pool, sized by analyzer.batch.workers. It is created once and
+    shared by every batch request; a request's own worker count only limits how many
+    of its chunks run at the same time, so no request ever replaces a pool in use.
+    """
+    global _batch_executor
+    with _executor_lock:
+        if _batch_executor is None:
+            # spawn: forking a process that runs server threads can deadlock the children
+            _batch_executor = ProcessPoolExecutor(
+                max_workers=max(1, settings.analyzer.batch_workers),
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return _batch_executor
+
+
+def analyze_batch(items: Iterable[Dict], use_history: bool = False, workers: Optional[int] = None,
+                  chunk_size: Optional[int] = None) -> Iterator[Dict]:
+    """
+    Analyze many {"project_id", "messages", "model"} items, yielding results in
+    input order as soon as they are ready. Each result carries the item's
+    "index" and "project_id".
+    use_history=False (the default) analyzes every item on its own messages,
+    so replays neither depend on nor disturb the live per-project history.
+    workers is capped at analyzer.batch.workers; workers <= 1 runs in the calling process.
+    """
+    limit = settings.analyzer.batch_workers
+    workers = limit if workers is None else min(workers, limit)
+    chunk_size = max(1, chunk_size or settings.analyzer.batch_chunk_size)
+    
+    chunks: List[List] = []
+    current: List = []
+    for index, item in enumerate(items):
+        current.append((index, item))
+        if len(current) >= chunk_size:
+            chunks.append(current)
+            current = []
+    if current:
+        chunks.append(current)
+    
+    if workers <= 1 or use_history:
+        # The live history only exists in this process, so history-aware batches run here
+        for chunk in chunks:
+            yield from _analyze_chunk(chunk, use_history)
+        return
+    
+    executor = _get_batch_executor()
+    # At most `workers` chunks of this request are submitted at a time, so concurrent
+    # requests share the pool instead of one request queueing all of its chunks first
+    pending: Deque[Future] = deque()
+    next_chunk = 0
+    try:
+        while pending or next_chunk < len(chunks):
+            while next_chunk < len(chunks) and len(pending) < workers:
+                pending.append(executor.submit(_analyze_chunk, chunks[next_chunk], False))
+                next_chunk += 1
+            yield from pending.popleft().result()
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+def shutdown_analysis_pool():
+    """
+    Stop the analysis pools (called on app shutdown)
+    """
+    global _executor, _batch_executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False, cancel_futures=True)
+            _executor = None
+        if _batch_executor is not None:
+            _batch_executor.shutdown(wait=False, cancel_futures=True)
+            _batch_executor = None
@@ -1,69 +1,247 @@
 import difflib
+import heapq
 import re
+import threading
 import time
-from typing import List, Dict, Tuple, Optional
+from collections import Counter, OrderedDict
+from functools import lru_cache
+from typing import Callable, List, Dict, Tuple, Optional
 from .models import Request, SessionLocal
 from sqlalchemy.orm import Session
 from .config import settings
+from .history import HistoryEntry, ProjectHistoryCache, project_history
+from .near_duplicates import NearDuplicateIndex, minhash_signature, near_duplicate_index
+from .worker_sync import request_log_follower
+from .events import ProjectChange, project_events
+from .shared_state import MemoryBackend, SharedState, shared_state
+from .keyword_matcher import KeywordHits, KeywordMatcher, build_matcher
 from datetime import datetime, timedelta
 import hashlib
 
 # 缓存系统
-class EfficiencyCache:
-    """效率分析缓存系统"""
+class _InFlight:
+    """一次正在进行的计算，同键的并发请求等待其结果"""
     
     def __init__(self):
-        self._cache = {}
-        self._default_ttl = 300  # 5分钟缓存时间
+        self.done = threading.Event()
+        self.result = None
+        self.error: Optional[BaseException] = None
+
+
+class EfficiencyCache:
+    """
+    效率分析缓存系统：进程内有界LRU（L1）+ 跨进程共享状态（L2）
+    失效通过共享的代数计数器实现：任一进程失效某项目后，所有进程的旧条目都不再命中
+    """
+    
+    def __init__(self, ttl_seconds: int = 300, max_entries: int = 512, sweep_interval_seconds: int = 60,
+                 shared: Optional[SharedState] = None):
+        self._cache: "OrderedDict[str, Tuple[Dict, float, list]]" = OrderedDict()  # key -> (data, expires_at, generation)
+        self._inflight: Dict[str, _InFlight] = {}
+        self._lock = threading.Lock()
+        self._default_ttl = ttl_seconds
+        self.max_entries = max_entries
+        self.sweep_interval_seconds = sweep_interval_seconds
+        self._shared = shared or SharedState(MemoryBackend())
+        self._sweeper: Optional[threading.Thread] = None
+        self._stop_sweeper = threading.Event()
+        self._stats = {
+            "hits": 0,
+            "shared_hits": 0,  # L1未命中但其他进程已计算过的次数
+            "misses": 0,
+            "evictions": 0,  # 超出容量被LRU淘汰
+            "expirations": 0,  # 过期被删除（读取时或后台清理）
+            "invalidations": 0,
+            "coalesced": 0,  # 等待其他请求计算结果而未重复计算的次数
+        }
     
     def _generate_key(self, project_id: str, time_range: str) -> str:
         """生成缓存键"""
         return f"efficiency:{project_id}:{time_range}"
     
+    def _generation(self, project_id: str) -> list:
+        """当前的 [全局代数, 项目代数]，失效时递增"""
+        return [self._shared.get("efficiency_gen", 0), self._shared.get(f"efficiency_gen:{project_id}", 0)]
+    
+    def _get_locked(self, key: str, generation: list) -> Optional[Dict]:
+        entry = self._cache.get(key)
+        if entry is None:
+            return None
+        data, expires_at, entry_generation = entry
+        if time.time() >= expires_at:
+            # 过期数据，删除
+            del self._cache[key]
+            self._stats["expirations"] += 1
+            return None
+        if entry_generation != generation:
+            # 其他进程已失效该项目
+            del self._cache[key]
+            return None
+        self._cache.move_to_end(key)
+        return data
+    
+    def _set_locked(self, key: str, data: Dict, generation: list, expires_at: Optional[float] = None):
+        self._cache[key] = (data, expires_at or time.time() + self._default_ttl, generation)
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.max_entries:
+            self._cache.popitem(last=False)
+            self._stats["evictions"] += 1
+    
+    def _lookup(self, key: str, generation: list) -> Optional[Dict]:
+        """先查L1，再查L2；调用方持有锁"""
+        data = self._get_locked(key, generation)
+        if data is not None:
+            self._stats["hits"] += 1
+            return data
+        if self._shared.is_shared:
+            shared_entry = self._shared.get(key)
+            if shared_entry and shared_entry.get("generation") == generation:
+                self._stats["shared_hits"] += 1
+                self._set_locked(key, shared_entry["data"], generation, shared_entry.get("expires_at"))
+                return shared_entry["data"]
+        self._stats["misses"] += 1
+        return None
+    
+    def _store(self, key: str, data: Dict, generation: list):
+        """写入L1和L2；调用方持有锁"""
+        self._set_locked(key, data, generation)
+        if self._shared.is_shared:
+            try:
+                self._shared.set(key, {
+                    "data": data,
+                    "generation": generation,
+                    "expires_at": time.time() + self._default_ttl
+                }, ttl_seconds=self._default_ttl)
+            except (TypeError, ValueError) as e:
+                print(f"[EfficiencyCache] Result for {key} not shareable: {e}")
+    
     def get(self, project_id: str, time_range: str) -> Optional[Dict]:
         """获取缓存数据"""
         key = self._generate_key(project_id, time_range)
-        if key in self._cache:
-            cached_data, timestamp = self._cache[key]
-            # 检查是否过期
-            if time.time() - timestamp < self._default_ttl:
-                return cached_data
-            else:
-                # 过期数据，删除
-                del self._cache[key]
-        return None
+        generation = self._generation(project_id)
+        with self._lock:
+            return self._lookup(key, generation)
     
     def set(self, project_id: str, time_range: str, data: Dict):
         """设置缓存数据"""
         key = self._generate_key(project_id, time_range)
-        self._cache[key] = (data, time.time())
+        generation = self._generation(project_id)
+        with self._lock:
+            self._store(key, data, generation)
+    
+    def get_or_compute(self, project_id: str, time_range: str, compute: Callable[[], Dict],
+                       cache_if: Optional[Callable[[Dict], bool]] = None) -> Tuple[Dict, bool]:
+        """
+        读取缓存，未命中时计算并写入；同一键的并发未命中只计算一次
+        返回 (结果, 是否来自缓存或其他请求的计算)
+        """
+        key = self._generate_key(project_id, time_range)
+        generation = self._generation(project_id)
+        with self._lock:
+            data = self._lookup(key, generation)
+            if data is not None:
+                return data, True
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._inflight[key] = _InFlight()
+            else:
+                self._stats["coalesced"] += 1
+        
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result, True
+        
+        try:
+            flight.result = compute()
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            # 计算期间被失效（代数变化）的结果可能基于旧数据，不写入缓存
+            still_current = flight.error is None and self._generation(project_id) == generation
+            with self._lock:
+                self._inflight.pop(key, None)
+                if still_current and (cache_if is None or cache_if(flight.result)):
+                    self._store(key, flight.result, generation)
+            flight.done.set()
+        return flight.result, False
     
     def invalidate(self, project_id: str = None, time_range: str = None):
-        """失效缓存"""
+        """失效缓存（对所有进程生效）"""
         if project_id is None:
             # 失效所有缓存
-            self._cache.clear()
+            self._shared.incr("efficiency_gen")
+            prefix = "efficiency:"
         else:
-            if time_range is None:
-                # 失效该项目的所有缓存
-                keys_to_remove = [k for k in self._cache.keys() if k.startswith(f"efficiency:{project_id}:")]
-                for key in keys_to_remove:
-                    del self._cache[key]
-            else:
-                # 失效特定缓存
-                key = self._generate_key(project_id, time_range)
-                if key in self._cache:
-                    del self._cache[key]
+            # 失效该项目的缓存；指定 time_range 时也会使该项目其他时间范围的缓存一并失效
+            self._shared.incr(f"efficiency_gen:{project_id}")
+            prefix = self._generate_key(project_id, time_range) if time_range else f"efficiency:{project_id}:"
+        with self._lock:
+            keys_to_remove = [k for k in self._cache.keys() if k.startswith(prefix)]
+            for key in keys_to_remove:
+                del self._cache[key]
+            self._stats["invalidations"] += len(keys_to_remove)
+    
+    def sweep_expired(self) -> int:
+        """删除所有过期条目，返回删除数量"""
+        now = time.time()
+        with self._lock:
+            expired = [k for k, (_, expires_at, _) in self._cache.items() if now >= expires_at]
+            for key in expired:
+                del self._cache[key]
+            self._stats["expirations"] += len(expired)
+        return len(expired)
+    
+    def _sweep_loop(self):
+        while not self._stop_sweeper.wait(self.sweep_interval_seconds):
+            self.sweep_expired()
+    
+    def start_sweeper(self):
+        """启动后台过期清理线程（应用启动时调用）"""
+        if self._sweeper is not None and self._sweeper.is_alive():
+            return
+        self._stop_sweeper.clear()
+        self._sweeper = threading.Thread(target=self._sweep_loop, name="efficiency-cache-sweeper", daemon=True)
+        self._sweeper.start()
+    
+    def stop_sweeper(self):
+        """停止后台过期清理线程（应用关闭时调用）"""
+        self._stop_sweeper.set()
+        if self._sweeper is not None:
+            self._sweeper.join(timeout=5)
+            self._sweeper = None
     
     def get_stats(self) -> Dict:
         """获取缓存统计信息"""
-        return {
-            "total_cached": len(self._cache),
-            "cache_keys": list(self._cache.keys())
-        }
+        with self._lock:
+            stats = dict(self._stats)
+            stats["size"] = len(self._cache)
+            stats["inflight"] = len(self._inflight)
+        lookups = stats["hits"] + stats["shared_hits"] + stats["misses"]
+        stats["hit_rate"] = round((stats["hits"] + stats["shared_hits"]) / lookups, 4) if lookups else 0.0
+        stats["max_entries"] = self.max_entries
+        stats["ttl_seconds"] = self._default_ttl
+        stats["shared"] = self._shared.is_shared
+        return stats
 
 # 全局缓存实例
-efficiency_cache = EfficiencyCache()
+efficiency_cache = EfficiencyCache(
+    ttl_seconds=settings.analyzer.efficiency_cache_ttl_seconds,
+    max_entries=settings.analyzer.efficiency_cache_max_entries,
+    sweep_interval_seconds=settings.analyzer.efficiency_cache_sweep_interval_seconds,
+    shared=shared_state
+)
+
+
+def _invalidate_on_project_change(event: ProjectChange):
+    """项目有新请求写入或被删除时，失效该项目的效率分析缓存"""
+    efficiency_cache.invalidate(event.project_id)
+
+
+project_events.subscribe(_invalidate_on_project_change)
 
 
 # Emotion keywords for analysis
@@ -108,99 +286,418 @@ TASK_PATTERNS = {
 }
 
 
-def calculate_similarity(text1: str, text2: str) -> float:
+# Precompiled patterns shared by the similarity functions
+# Rough per-text overhead (objects, sets, dicts, the lazily built sketch and signature) for the memo's size cap
+_FEATURES_OVERHEAD_BYTES = 4000
+_WORD_RE = re.compile(r"\b\w+\b")
+_EXCEPTION_RE = re.compile(r"\b[a-zA-Z_]*?(?:error|exception)\b", re.IGNORECASE)
+
+# Include common exception names so debugging loops are detected more reliably.
+SIMILARITY_DEBUG_KEYWORDS = (
+    "error", "bug", "fix", "修复", "报错", "exception", "traceback",
+    "typeerror", "valueerror", "keyerror", "attributeerror", "indexerror",
+    "nullpointer", "segfault",
+)
+
+# Keywords checked against the current message in analyze_behavior
+DEBUG_CONTEXT_KEYWORDS = ["error", "bug", "exception", "traceback", "报错", "修复"]
+DEBUG_ATTEMPT_KEYWORDS = ["error", "bug", "fix", "修复", "报错"]
+
+_keyword_matcher: Optional[KeywordMatcher] = None
+_keyword_matcher_key = None
+_keyword_matcher_lock = threading.Lock()
+
+
+def _pattern_keywords_key() -> tuple:
+    return tuple((name, tuple(keywords)) for name, keywords in (settings.analyzer.pattern_keywords or {}).items())
+
+
+def get_keyword_matcher() -> KeywordMatcher:
     """
-    Calculate enhanced similarity between two texts using multiple methods
+    One matcher over every analyzer keyword group, rebuilt when
+    settings.analyzer.pattern_keywords changes. Group names:
+    emotion:<category>, task:<type>, pattern:<name>, similarity:debug,
+    behavior:debug_context, behavior:debug_attempt
     """
-    if not text1 or not text2:
-        return 0.0
+    global _keyword_matcher, _keyword_matcher_key
+    key = _pattern_keywords_key()
+    matcher = _keyword_matcher
+    if matcher is not None and key == _keyword_matcher_key:
+        return matcher
+    with _keyword_matcher_lock:
+        if _keyword_matcher is None or key != _keyword_matcher_key:
+            _keyword_matcher = build_matcher(
+                {f"emotion:{category}": config["keywords"] for category, config in EMOTION_KEYWORDS.items()},
+                {f"task:{task_type}": config["indicators"] for task_type, config in TASK_PATTERNS.items()},
+                {f"pattern:{name}": keywords for name, keywords in key},
+                {
+                    "similarity:debug": SIMILARITY_DEBUG_KEYWORDS,
+                    "behavior:debug_context": DEBUG_CONTEXT_KEYWORDS,
+                    "behavior:debug_attempt": DEBUG_ATTEMPT_KEYWORDS,
+                },
+            )
+            _keyword_matcher_key = key
+        return _keyword_matcher
+
+
+class TextFeatures:
+    """Per-text values shared by the analyzer functions, computed once per distinct text"""
     
-    # Method 1: SequenceMatcher (character-level similarity)
-    char_similarity = difflib.SequenceMatcher(None, text1.lower(), text2.lower()).ratio()
+    __slots__ = ("key", "length", "lower", "token_counts", "words", "exceptions", "has_same", "has_still", "char_counts",
+                 "_sketch", "_hits", "_simhash", "_signature")
     
-    # Method 2: Word overlap (semantic similarity)
-    words1 = set(re.findall(r'\b\w+\b', text1.lower()))
-    words2 = set(re.findall(r'\b\w+\b', text2.lower()))
+    def __init__(self, text: str):
+        lower = text.lower()
+        self.key: Optional[bytes] = None  # Content digest, set by the memo
+        self.length = len(text)
+        self.lower = lower
+        self.token_counts = Counter(_WORD_RE.findall(lower))
+        self.words = frozenset(self.token_counts)
+        self.exceptions = frozenset(m.group(0).lower() for m in _EXCEPTION_RE.finditer(text))
+        self.has_same = "same" in lower
+        self.has_still = "still" in lower
+        self.char_counts = Counter(lower)
+        self._sketch = None
+        self._hits = None  # (matcher, hits)
+        self._simhash = None
+        self._signature = None  # (num_bins, shingle_size, near-duplicate MinHash signature)
+    
+    def size_bytes(self) -> int:
+        """Rough memory footprint, used for the memo's size cap"""
+        return _FEATURES_OVERHEAD_BYTES + 2 * len(self.lower) + 100 * (len(self.token_counts) + len(self.char_counts))
+    
+    @property
+    def simhash_hex(self) -> str:
+        """64-bit SimHash fingerprint of the text (see compute_simhash_hex)"""
+        if self._simhash is None:
+            self._simhash = _simhash_hex(self.token_counts, 64)
+        return self._simhash
+    
+    @property
+    def keyword_hits(self) -> KeywordHits:
+        """Hits for every analyzer keyword group, recomputed if the matcher was rebuilt"""
+        matcher = get_keyword_matcher()
+        if self._hits is None or self._hits[0] is not matcher:
+            self._hits = (matcher, matcher.match(self.lower, lowered=True))
+        return self._hits[1]
+    
+    @property
+    def debug_keywords(self) -> frozenset:
+        return self.keyword_hits.keywords("similarity:debug")
+    
+    @property
+    def sketch(self) -> frozenset:
+        """Bottom-k MinHash sketch of the character shingles, built on first use"""
+        if self._sketch is None:
+            size = settings.analyzer.minhash_shingle_size
+            text = self.lower
+            shingles = {text[i:i + size] for i in range(max(1, len(text) - size + 1))}
+            hashes = {hash(shingle) & 0xFFFFFFFFFFFFFFFF for shingle in shingles}
+            self._sketch = frozenset(heapq.nsmallest(settings.analyzer.minhash_sketch_size, hashes))
+        return self._sketch
+    
+    def minhash_signature(self, num_bins: int, shingle_size: int) -> Tuple[int, ...]:
+        """Near-duplicate index signature (see near_duplicates.minhash_signature), built on first use"""
+        if self._signature is None or self._signature[:2] != (num_bins, shingle_size):
+            self._signature = (num_bins, shingle_size, minhash_signature(self.lower, num_bins, shingle_size))
+        return self._signature[2]
+
+
+class TextFeatureMemo:
+    """
+    Bounded LRU memo of TextFeatures keyed by a BLAKE2b digest of the text, so each
+    distinct prompt is lowercased, tokenized and fingerprinted once per process no
+    matter which analyzer function (or which copy of the string) asks for it
+    """
+    
+    def __init__(self, max_entries: int = 2048, max_bytes: int = 64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[bytes, TextFeatures]" = OrderedDict()
+        self._bytes = 0
+        self._hits = 0
+        self._misses = 0
+        self._lock = threading.Lock()
+    
+    @staticmethod
+    def key(text: str) -> bytes:
+        return hashlib.blake2b(text.encode("utf-8", "surrogatepass"), digest_size=16).digest()
+    
+    def get(self, text: str) -> TextFeatures:
+        key = self.key(text)
+        with self._lock:
+            features = self._entries.get(key)
+            if features is not None:
+                self._entries.move_to_end(key)
+                self._hits += 1
+                return features
+            self._misses += 1
+        
+        # Computed outside the lock; a concurrent miss for the same text just computes it twice
+        features = TextFeatures(text)
+        features.key = key
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = features
+                self._bytes += features.size_bytes()
+                while len(self._entries) > 1 and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+                    _, evicted = self._entries.popitem(last=False)
+                    self._bytes -= evicted.size_bytes()
+        return features
     
-    if words1 and words2:
-        word_overlap = len(words1 & words2) / len(words1 | words2)
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+    
+    def get_stats(self) -> Dict:
+        with self._lock:
+            total = self._hits + self._misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": self._hits / total if total else 0.0
+            }
+
+
+# Global memo shared by the similarity, fingerprint, keyword and drift functions
+text_memo = TextFeatureMemo(
+    max_entries=settings.analyzer.text_memo_max_entries,
+    max_bytes=settings.analyzer.text_memo_max_bytes
+)
+
+
+def get_text_features(text: str) -> TextFeatures:
+    return text_memo.get(text)
+
+
+def _char_similarity_upper_bound(f1: TextFeatures, f2: TextFeatures) -> float:
+    """
+    Upper bound on SequenceMatcher.ratio(): matched characters can never exceed
+    the shared character multiset (the same bound as SequenceMatcher.quick_ratio).
+    """
+    total = len(f1.lower) + len(f2.lower)
+    if not total:
+        return 1.0
+    small, large = (f1.char_counts, f2.char_counts) if len(f1.char_counts) <= len(f2.char_counts) else (f2.char_counts, f1.char_counts)
+    matches = sum(min(count, large[ch]) for ch, count in small.items() if ch in large)
+    return 2.0 * matches / total
+
+
+def minhash_char_similarity(f1: TextFeatures, f2: TextFeatures) -> float:
+    """
+    Estimate of the character similarity from bottom-k sketches in O(k): the
+    Jaccard similarity of the texts' character shingles. With 8-character
+    shingles it tracks SequenceMatcher.ratio() closely for edited copies and
+    partial overlaps of long texts.
+    """
+    sketch1, sketch2 = f1.sketch, f2.sketch
+    union = heapq.nsmallest(settings.analyzer.minhash_sketch_size, sketch1 | sketch2)
+    if not union:
+        return 0.0
+    both = sketch1 & sketch2
+    return sum(1 for h in union if h in both) / len(union)
+
+
+def similarity_mode(text1: str, text2: str) -> str:
+    """Which character similarity calculate_similarity uses for this pair: "exact" or "minhash" """
+    if max(len(text1 or ""), len(text2 or "")) > settings.analyzer.similarity_exact_max_chars:
+        return "minhash"
+    return "exact"
+
+
+def _similarity_combiner(f1: TextFeatures, f2: TextFeatures) -> Callable[[float], float]:
+    """Combined similarity of two texts as a function of the character similarity term"""
+    # Method 2: Word overlap (semantic similarity)
+    if f1.words and f2.words:
+        word_overlap = len(f1.words & f2.words) / len(f1.words | f2.words)
     else:
         word_overlap = 0.0
     
     # Method 3: Keyword matching (for debugging/error scenarios)
-    # Include common exception names so debugging loops are detected more reliably.
-    debug_keywords = [
-        "error", "bug", "fix", "修复", "报错", "exception", "traceback",
-        "typeerror", "valueerror", "keyerror", "attributeerror", "indexerror",
-        "nullpointer", "segfault",
-    ]
-    keyword_match = 0.0
-    
-    if any(keyword in text1.lower() and keyword in text2.lower() for keyword in debug_keywords):
-        keyword_match = 0.3  # Boost similarity for debugging scenarios
+    keyword_match = 0.3 if f1.debug_keywords & f2.debug_keywords else 0.0  # Boost similarity for debugging scenarios
     
     # Method 4: Length similarity (similar length texts are more likely to be similar)
-    len1, len2 = len(text1), len(text2)
-    if max(len1, len2) > 0:
-        length_similarity = 1 - abs(len1 - len2) / max(len1, len2)
-    else:
-        length_similarity = 0.0
-    
-    # Combined similarity with weighted average
-    combined_similarity = (
-        char_similarity * 0.3 + 
-        word_overlap * 0.4 + 
-        keyword_match * 0.2 + 
-        length_similarity * 0.1
-    )
-
+    len1, len2 = f1.length, f2.length
+    length_similarity = 1 - abs(len1 - len2) / max(len1, len2)
+    
+    # Boosts applied after the weighted average
     # Method 5: Exception-name overlap (strong signal for debugging loops)
     # Example: "TypeError" repeated across attempts should raise similarity.
-    exc_pattern = re.compile(r"\b[a-zA-Z_]*?(?:error|exception)\b", re.IGNORECASE)
-    exc1 = set(m.group(0).lower() for m in exc_pattern.finditer(text1))
-    exc2 = set(m.group(0).lower() for m in exc_pattern.finditer(text2))
-    if exc1 and exc2 and (exc1 & exc2):
-        combined_similarity = min(1.0, combined_similarity + 0.35)
+    exception_boost = 0.35 if f1.exceptions & f2.exceptions else 0.0
+    repeat_boosts = (0.2 if f1.has_same and f2.has_same else 0.0, 0.15 if f1.has_still and f2.has_still else 0.0)
+    
+    def combine(char_similarity: float) -> float:
+        # Combined similarity with weighted average
+        combined_similarity = (
+            char_similarity * 0.3 + 
+            word_overlap * 0.4 + 
+            keyword_match * 0.2 + 
+            length_similarity * 0.1
+        )
+        if exception_boost:
+            combined_similarity = min(1.0, combined_similarity + exception_boost)
+        # Boost similarity for highly repetitive patterns
+        for repeat_boost in repeat_boosts:
+            if repeat_boost:
+                combined_similarity = min(1.0, combined_similarity + repeat_boost)
+        return combined_similarity
+    
+    return combine
+
+
+def calculate_similarity(text1: str, text2: str, reject_below: Optional[float] = None) -> float:
+    """
+    Calculate enhanced similarity between two texts using multiple methods
+    
+    reject_below: callers that only act on scores >= reject_below may pass it to skip
+    the character diff; pairs that cannot reach it return an upper bound (< reject_below)
+    instead of the exact score.
+    Texts longer than settings.analyzer.similarity_exact_max_chars use the MinHash
+    estimate for the character term, which bounds the cost of every comparison.
+    """
+    if not text1 or not text2:
+        return 0.0
+    
+    f1 = get_text_features(text1)
+    f2 = get_text_features(text2)
+    combine = _similarity_combiner(f1, f2)
     
-    # Boost similarity for highly repetitive patterns
-    if "same" in text1.lower() and "same" in text2.lower():
-        combined_similarity = min(1.0, combined_similarity + 0.2)
+    if similarity_mode(text1, text2) == "minhash":
+        return float(combine(minhash_char_similarity(f1, f2)))
     
-    if "still" in text1.lower() and "still" in text2.lower():
-        combined_similarity = min(1.0, combined_similarity + 0.15)
+    # Quick reject: bound the character term by length, then by shared characters
+    if reject_below is not None:
+        upper_bound = combine(2.0 * min(len(f1.lower), len(f2.lower)) / (len(f1.lower) + len(f2.lower)))
+        if upper_bound < reject_below:
+            return float(upper_bound)
+        upper_bound = combine(_char_similarity_upper_bound(f1, f2))
+        if upper_bound < reject_below:
+            return float(upper_bound)
     
-    return float(combined_similarity)
+    # Method 1: SequenceMatcher (character-level similarity)
+    char_similarity = _char_ratio(f1, f2)
+    return float(combine(char_similarity))
 
 
-def compute_simhash_hex(text: str, bits: int = 64) -> str:
+def similarity_bounds(text1: str, text2: str) -> Tuple[float, float]:
     """
-    Compute a lightweight SimHash fingerprint (hex string).
-    Used when privacy settings disallow storing raw prompt content.
+    Lower and upper bound of calculate_similarity(text1, text2) without the character
+    diff: the character term taken as 0 and as its shared-characters bound.
+    Pairs that need no diff (empty, identical or MinHash mode) get their exact score twice.
     """
-    if not text:
-        return "0" * (bits // 4)
+    if not text1 or not text2:
+        return 0.0, 0.0
+    f1 = get_text_features(text1)
+    f2 = get_text_features(text2)
+    if similarity_mode(text1, text2) == "minhash" or (f1.key is not None and f1.key == f2.key):
+        score = calculate_similarity(text1, text2)
+        return score, score
+    combine = _similarity_combiner(f1, f2)
+    return float(combine(0.0)), float(combine(_char_similarity_upper_bound(f1, f2)))
 
-    # Basic tokenization; keeps it dependency-free.
-    tokens = re.findall(r"\b\w+\b", text.lower())
-    if not tokens:
-        return "0" * (bits // 4)
 
-    v = [0] * bits
-    for tok in tokens:
-        # Stable 64-bit token hash
-        h = int.from_bytes(hashlib.md5(tok.encode("utf-8")).digest()[:8], "big", signed=False)
-        for i in range(bits):
-            bit = (h >> i) & 1
-            v[i] += 1 if bit else -1
+_char_ratios: "OrderedDict[Tuple[bytes, bytes], float]" = OrderedDict()
+_char_ratios_lock = threading.Lock()
+_CHAR_RATIO_MEMO_SIZE = 8192
+
 
-    fp = 0
-    for i, score in enumerate(v):
-        if score > 0:
-            fp |= (1 << i)
+def _char_ratio(f1: TextFeatures, f2: TextFeatures) -> float:
+    """
+    SequenceMatcher ratio of the lowercased texts, memoized per ordered pair of
+    texts: consecutive analyses of a project compare the same stored prompts
+    again (count_similar_requests, history replays)
+    """
+    if f1.key is not None and f1.key == f2.key:
+        return 1.0  # Identical texts
+    pair = (f1.key, f2.key)
+    with _char_ratios_lock:
+        ratio = _char_ratios.get(pair)
+        if ratio is not None:
+            _char_ratios.move_to_end(pair)
+            return ratio
+    ratio = difflib.SequenceMatcher(None, f1.lower, f2.lower).ratio()
+    if f1.key is not None and f2.key is not None:
+        with _char_ratios_lock:
+            _char_ratios[pair] = ratio
+            while len(_char_ratios) > _CHAR_RATIO_MEMO_SIZE:
+                _char_ratios.popitem(last=False)
+    return ratio
 
+
+@lru_cache(maxsize=65536)
+def _token_hash(token: str) -> int:
+    """Stable 64-bit token hash (first 8 bytes of MD5, big-endian); stored fingerprints depend on it"""
+    return int.from_bytes(hashlib.md5(token.encode("utf-8")).digest()[:8], "big", signed=False)
+
+
+def _majority_bits(weighted_hashes, total: int, bits: int) -> int:
+    """
+    Bit-sliced SimHash vote: returns the mask of bit positions set in more than
+    half of the (weighted) hashes.
+    The 64 per-bit counters are kept "vertically": planes[j] holds bit j of every
+    counter, so adding a hash is a ripple-carry add over whole ints (amortized
+    ~2 big-int operations instead of 64 per-bit updates).
+    """
+    mask = (1 << bits) - 1
+    planes: List[int] = []
+    for h, weight in weighted_hashes:
+        h &= mask
+        level = 0
+        # Adding weight*h = adding h at every set bit of weight
+        while weight:
+            if weight & 1:
+                carry = h
+                j = level
+                while carry:
+                    if j >= len(planes):
+                        planes.extend([0] * (j + 1 - len(planes)))
+                    plane = planes[j]
+                    planes[j] = plane ^ carry
+                    carry &= plane
+                    j += 1
+            weight >>= 1
+            level += 1
+    
+    # Bit-sliced comparison count > total // 2 (i.e. 2 * count > total), most significant plane first
+    threshold = total // 2
+    greater = 0
+    equal = mask
+    for j in range(max(len(planes), threshold.bit_length()) - 1, -1, -1):
+        plane = planes[j] if j < len(planes) else 0
+        if (threshold >> j) & 1:
+            equal &= plane
+        else:
+            greater |= equal & plane
+            equal &= ~plane
+    return greater
+
+
+def _simhash_hex(token_counts: Counter, bits: int) -> str:
+    total = sum(token_counts.values())
+    if not total:
+        return "0" * (bits // 4)
+    # Repeated tokens vote with their multiplicity
+    fp = _majority_bits(((_token_hash(tok), n) for tok, n in token_counts.items()), total, bits)
     return f"{fp:0{bits // 4}x}"
 
 
+def compute_simhash_hex(text: str, bits: int = 64) -> str:
+    """
+    Compute a lightweight SimHash fingerprint (hex string).
+    Used when privacy settings disallow storing raw prompt content.
+    64-bit fingerprints come from the shared text memo: privacy-aware comparisons
+    hash the same prompt once, not once per stored fingerprint.
+    """
+    if not text:
+        return "0" * (bits // 4)
+    if bits == 64:
+        return get_text_features(text).simhash_hex
+    return _simhash_hex(Counter(_WORD_RE.findall(text.lower())), bits)
+
+
 def simhash_similarity(simhash_hex_a: str, simhash_hex_b: str, bits: int = 64) -> float:
     """
     Similarity based on Hamming distance of two simhash hex strings.
@@ -218,20 +715,41 @@ def simhash_similarity(simhash_hex_a: str, simhash_hex_b: str, bits: int = 64) -
     return max(0.0, min(1.0, 1.0 - (dist / bits)))
 
 
-def calculate_similarity_privacy_aware(plain_text: str, stored_fingerprint_or_text: str) -> float:
+_SIMHASH_RE = re.compile(r"[0-9a-f]{16}")
+
+
+def comparison_mode(plain_text: str, stored_fingerprint_or_text: str) -> str:
+    """Mode calculate_similarity_privacy_aware uses for this pair: "simhash", "minhash" or "exact" """
+    if _SIMHASH_RE.fullmatch((stored_fingerprint_or_text or "").strip().lower()):
+        return "simhash"
+    return similarity_mode(plain_text, stored_fingerprint_or_text)
+
+
+def calculate_similarity_privacy_aware(plain_text: str, stored_fingerprint_or_text: str, reject_below: Optional[float] = None) -> float:
     """
     If stored value looks like a simhash fingerprint, compare via hamming similarity.
-    Otherwise fall back to normal text similarity.
+    Otherwise fall back to normal text similarity (see calculate_similarity for reject_below).
     """
     if not plain_text or not stored_fingerprint_or_text:
         return 0.0
 
     stored = stored_fingerprint_or_text.strip().lower()
     # 64-bit simhash hex
-    if re.fullmatch(r"[0-9a-f]{16}", stored):
-        return simhash_similarity(compute_simhash_hex(plain_text), stored, bits=64)
+    if _SIMHASH_RE.fullmatch(stored):
+        plain = plain_text.strip().lower()
+        # Both sides may be stored fingerprints (re-analyzing stored requests)
+        fingerprint = plain if _SIMHASH_RE.fullmatch(plain) else compute_simhash_hex(plain_text)
+        return simhash_similarity(fingerprint, stored, bits=64)
+
+    return calculate_similarity(plain_text, stored_fingerprint_or_text, reject_below=reject_below)
+
 
-    return calculate_similarity(plain_text, stored_fingerprint_or_text)
+def similarity_bounds_privacy_aware(plain_text: str, stored_fingerprint_or_text: str) -> Tuple[float, float]:
+    """Bounds of calculate_similarity_privacy_aware (see similarity_bounds); fingerprints are compared exactly"""
+    if _SIMHASH_RE.fullmatch((stored_fingerprint_or_text or "").strip().lower()):
+        score = calculate_similarity_privacy_aware(plain_text, stored_fingerprint_or_text)
+        return score, score
+    return similarity_bounds(plain_text, stored_fingerprint_or_text)
 
 
 def calculate_topic_drift(messages: List[str]) -> float:
@@ -254,17 +772,39 @@ def calculate_topic_drift(messages: List[str]) -> float:
     return min(topic_drift, 1.0)  # Cap at 1.0
 
 
+def incremental_topic_drift(project_id: str, recent_requests: List[HistoryEntry], pair_similarity: Optional[float],
+                            history: Optional[ProjectHistoryCache] = None) -> float:
+    """
+    Topic drift from the project's running average of consecutive-prompt similarity
+    (kept in the history), updated with the current prompt's similarity to the previous one.
+    Only that one new pair is computed per request; the running value itself is
+    committed when the request is stored.
+    """
+    history = project_history if history is None else history
+    running = history.get_pair_similarity(project_id)
+    if running is None:
+        # No running value yet (new project, or after a restart): seed it once from the stored prompts
+        texts = [req.prompt_text for req in reversed(recent_requests) if req.prompt_text]
+        if len(texts) >= 2:
+            running = 1 - calculate_topic_drift(texts)
+            history.seed_pair_similarity(project_id, running)
+    
+    if pair_similarity is not None:
+        running = history.blend_pair_similarity(running, pair_similarity)
+    if running is None:
+        return 0.0
+    return min(1 - running, 1.0)  # Cap at 1.0
+
+
 def detect_emotion(text: str) -> int:
     """
     Detect emotion in text and return a score
     """
     score = 0
-    text_lower = text.lower()
+    hits = get_text_features(text).keyword_hits
     
     for category, config in EMOTION_KEYWORDS.items():
-        for keyword in config["keywords"]:
-            if keyword.lower() in text_lower:
-                score += config["weight"]
+        score += hits.count(f"emotion:{category}") * config["weight"]
     return score
 
 
@@ -273,12 +813,11 @@ def detect_task_type(messages: List[Dict[str, str]]) -> str:
     Detect task type based on messages content
     """
     text = " ".join([m["content"] for m in messages if "content" in m])
-    text_lower = text.lower()
+    hits = get_keyword_matcher().match(text)
     
     scores = {}
-    for task_type, config in TASK_PATTERNS.items():
-        score = sum(1 for indicator in config["indicators"] if indicator.lower() in text_lower)
-        scores[task_type] = score
+    for task_type in TASK_PATTERNS:
+        scores[task_type] = hits.count(f"task:{task_type}")
     
     # Return the task type with highest score, default to 'coding'
     detected_task = max(scores, key=scores.get) if scores else 'coding'
@@ -290,7 +829,7 @@ def detect_task_type(messages: List[Dict[str, str]]) -> str:
     return detected_task
 
 
-def assess_progress(current_request: Request, previous_requests: List[Request]) -> str:
+def assess_progress(current_request: Request, previous_requests: List[HistoryEntry]) -> str:
     """
     Assess if there's progress in the conversation
     """
@@ -320,7 +859,7 @@ def assess_progress(current_request: Request, previous_requests: List[Request])
     return "exploring"
 
 
-def count_similar_requests(recent_requests: List[Request], similarity_threshold: float = 0.75) -> int:
+def count_similar_requests(recent_requests: List[HistoryEntry], similarity_threshold: float = 0.75) -> int:
     """
     Count consecutive similar requests
     """
@@ -329,12 +868,13 @@ def count_similar_requests(recent_requests: List[Request], similarity_threshold:
     
     similar_count = 0
     for i in range(1, len(recent_requests)):
-        # Compare current with previous
-        current_content = getattr(recent_requests[i], 'prompt_text', '')
-        prev_content = getattr(recent_requests[i-1], 'prompt_text', '')
+        # Compare each prompt with the one before it (newest first), in the same order as the
+        # analysis scored that pair when the newer prompt arrived, so the pair's ratio is reused
+        current_content = getattr(recent_requests[i-1], 'prompt_text', '')
+        prev_content = getattr(recent_requests[i], 'prompt_text', '')
         
         if current_content and prev_content:
-            similarity = calculate_similarity_privacy_aware(current_content, prev_content)
+            similarity = calculate_similarity_privacy_aware(current_content, prev_content, reject_below=similarity_threshold)
             if similarity >= similarity_threshold:
                 similar_count += 1
             else:
@@ -345,40 +885,40 @@ def count_similar_requests(recent_requests: List[Request], similarity_threshold:
     return similar_count
 
 
-def get_recent_requests(project_id: str, limit: int = 5) -> List[Request]:
+def get_recent_requests(project_id: str, limit: int = 5) -> List[HistoryEntry]:
     """
-    Get recent requests for a project with enhanced isolation
+    Get recent requests for a project, newest first.
+    Served from the in-process history (including requests stored by other workers,
+    see worker_sync), so only this project's requests are considered.
     """
-    db = SessionLocal()
-    try:
-        # Enhanced project isolation: only consider requests from the same project
-        recent_requests = db.query(Request).filter(
-            Request.project_id == project_id
-        ).order_by(Request.timestamp.desc()).limit(limit).all()
-        
-        # Log isolation info for debugging
-        if recent_requests:
-            print(f"[Project Isolation] Found {len(recent_requests)} recent requests for project: {project_id}")
-            
-            # Verify all requests belong to the same project
-            project_ids = set(req.project_id for req in recent_requests)
-            if len(project_ids) > 1:
-                print(f"[WARNING] Multiple project IDs detected: {project_ids}")
-            else:
-                print(f"[Project Isolation] All requests belong to project: {list(project_ids)[0]}")
-        
-        return recent_requests
-    finally:
-        db.close()
+    request_log_follower.sync()
+    return project_history.get_recent(project_id, limit)
 
 
-def analyze_behavior(project_id: str, messages: List[Dict[str, str]], model: str = "gpt-4o") -> Dict:
+def analyze_behavior(project_id: str, messages: List[Dict[str, str]], model: str = "gpt-4o", *,
+                     use_history: bool = True, history: Optional[ProjectHistoryCache] = None,
+                     duplicates: Optional[NearDuplicateIndex] = None, current: Optional[HistoryEntry] = None,
+                     previous_similarity: Optional[float] = None, emotion_score: Optional[int] = None) -> Dict:
     """
     Multi-dimensional analysis of behavior
     Returns comprehensive analysis results
+    use_history=False analyzes the messages alone (stateless mode), ignoring the
+    project's stored requests, e.g. when replaying logs.
+    history / duplicates replace the live request history and near-duplicate index, and
+    current describes the request being analyzed (tokens, timestamp); the backfill job
+    uses them to re-analyze stored requests as of the time they were made.
+    previous_similarity is the prompt's similarity to the previous stored prompt when the
+    caller already computed it, and emotion_score replaces the score detected in the text
+    (the backfill passes the stored one for privacy-mode rows, whose text is a fingerprint).
     """
+    if history is None and use_history:
+        # Pick up requests other server workers stored since the last analysis
+        request_log_follower.sync()
+    history = project_history if history is None else history
+    duplicates = near_duplicate_index if duplicates is None else duplicates
+    
     # Get recent requests for this project
-    recent_requests = get_recent_requests(project_id, limit=5)
+    recent_requests = history.get_recent(project_id, limit=5) if use_history else []
     
     # Extract the last user message from current request
     current_user_msg = ""
@@ -395,17 +935,23 @@ def analyze_behavior(project_id: str, messages: List[Dict[str, str]], model: str
     ]
     stateless_repeat_count: Optional[int] = None
     
-    # Get recent messages for topic drift analysis
-    if recent_requests:
-        recent_messages = [getattr(req, 'prompt_text', '') for req in recent_requests if hasattr(req, 'prompt_text')]
-        recent_messages.append(current_user_msg)
-    else:
+    # Get recent messages for topic drift analysis (with history, the project's running drift is used instead)
+    recent_messages: List[str] = []
+    if not recent_requests:
         # When there is no DB history, topic drift should be computed across the provided sequence.
         recent_messages = stateless_user_texts[:] if stateless_user_texts else [current_user_msg]
     
+    # === Dimension 6: Model profile with adjusted thresholds ===
+    model_config = settings.analyzer.model_profiles.get(model, 
+        settings.analyzer.model_profiles.get("gpt-4o", 
+            {"similarity_threshold": 0.65, "max_retries": 3}))  # Lower threshold for better sensitivity
+    model_threshold = model_config["similarity_threshold"]
+    
     # === Dimension 1: Enhanced similarity analysis ===
     max_similarity = 0.0
     similar_requests_count = 0
+    similarity_modes = set()  # How pairs were compared, reported in details
+    pair_similarity: Optional[float] = None  # Similarity to the previous prompt, feeds the running topic drift
 
     # Prefer DB history when available; otherwise fall back to the provided message sequence.
     # This makes the analyzer testable and allows stateless callers to still get meaningful results.
@@ -413,22 +959,50 @@ def analyze_behavior(project_id: str, messages: List[Dict[str, str]], model: str
     stateless_sim_threshold = 0.55
 
     if recent_requests:
-        for req in recent_requests:
+        older_prompts = []
+        for i, req in enumerate(recent_requests):
             if hasattr(req, 'prompt_text') and req.prompt_text:
-                similarity = calculate_similarity_privacy_aware(current_user_msg, req.prompt_text)
+                similarity_modes.add(comparison_mode(current_user_msg, req.prompt_text))
+                if i == 0 and current_user_msg:
+                    # The pair with the previous prompt is scored fully: it also feeds topic drift
+                    similarity = previous_similarity
+                    if similarity is None:
+                        similarity = calculate_similarity_privacy_aware(current_user_msg, req.prompt_text)
+                    pair_similarity = similarity
+                    max_similarity = similarity
+                    if similarity > 0.6:  # Lower threshold for counting
+                        similar_requests_count += 1
+                else:
+                    older_prompts.append(req.prompt_text)
+        
+        # The older prompts only need an exact score when it could raise max_similarity or
+        # when their bounds straddle the counting threshold; the most promising go first.
+        # Decisions and max_similarity are the same as scoring every pair exactly.
+        bounded = sorted(
+            (similarity_bounds_privacy_aware(current_user_msg, prompt) + (prompt,) for prompt in older_prompts),
+            key=lambda bounds: -bounds[1]
+        )
+        for lower, upper, prompt in bounded:
+            if upper > max_similarity or lower <= 0.6 < upper:
+                similarity = calculate_similarity_privacy_aware(current_user_msg, prompt)
                 max_similarity = max(max_similarity, similarity)
-
-                # Count requests with moderate similarity (lower threshold for better sensitivity)
-                if similarity > 0.6:  # Lower threshold for counting
-                    similar_requests_count += 1
+                is_similar = similarity > 0.6
+            else:
+                is_similar = lower > 0.6
+            # Count requests with moderate similarity (lower threshold for better sensitivity)
+            if is_similar:
+                similar_requests_count += 1
     else:
         # Stateless mode: use messages passed in (treat as a conversation/request sequence)
         user_texts = stateless_user_texts
         if len(user_texts) >= 2:
             last_text = user_texts[-1]
             previous_texts = user_texts[:-1]
+            reject_below = min(stateless_sim_threshold, model_threshold)
             for prev in previous_texts:
-                similarity = calculate_similarity(last_text, prev)
+                similarity_modes.add(similarity_mode(last_text, prev))
+                # Bounded scores stay below max_similarity, which therefore remains exact
+                similarity = calculate_similarity(last_text, prev, reject_below=min(reject_below, max_similarity))
                 max_similarity = max(max_similarity, similarity)
                 if similarity > stateless_sim_threshold:
                     similar_requests_count += 1
@@ -436,29 +1010,41 @@ def analyze_behavior(project_id: str, messages: List[Dict[str, str]], model: str
             # Count consecutive repeats within the provided messages (from the end backwards)
             consecutive = 0
             for i in range(len(user_texts) - 1, 0, -1):
-                sim = calculate_similarity(user_texts[i], user_texts[i - 1])
+                sim = calculate_similarity(user_texts[i], user_texts[i - 1], reject_below=stateless_sim_threshold)
                 if sim >= stateless_sim_threshold:
                     consecutive += 1
                 else:
                     break
             stateless_repeat_count = consecutive
     
+    # Near-duplicates of the current prompt across the whole indexed window, including
+    # loops that alternate between prompts or return after unrelated requests
+    near_duplicates = (
+        duplicates.count(project_id, current_user_msg, now=current.timestamp if current else None)
+        if use_history else 0
+    )
+    
     # === Dimension 2: Topic drift ===
-    topic_drift = calculate_topic_drift(recent_messages)
+    if recent_requests:
+        topic_drift = incremental_topic_drift(project_id, recent_requests, pair_similarity, history)
+    else:
+        topic_drift = calculate_topic_drift(recent_messages)
     
     # === Dimension 3: Enhanced emotion score ===
-    emotion_score = detect_emotion(current_user_msg)
+    if emotion_score is None:
+        emotion_score = detect_emotion(current_user_msg)
+    current_hits = get_text_features(current_user_msg).keyword_hits  # Every keyword group, matched once
     
     # === Dimension 4: Progress status ===
     if recent_requests:
         progress = assess_progress(
-            type('', (), {'prompt_tokens': 100, 'completion_tokens': 200, 'timestamp': datetime.now()})(),
+            current or type('', (), {'prompt_tokens': 100, 'completion_tokens': 200, 'timestamp': datetime.now()})(),
             recent_requests
         )  # Mock object for current request assessment
     else:
         # Stateless mode: infer progress from repetition within the provided sequence
         # For debugging flows, even 1 repeat can indicate being stuck.
-        looks_like_debug = any(k in current_user_msg.lower() for k in ["error", "bug", "exception", "traceback", "报错", "修复"])
+        looks_like_debug = current_hits.any("behavior:debug_context")
         if (stateless_repeat_count or 0) >= 2 or similar_requests_count >= 2 or ((stateless_repeat_count or 0) >= 1 and looks_like_debug):
             progress = "stuck"
         else:
@@ -468,12 +1054,6 @@ def analyze_behavior(project_id: str, messages: List[Dict[str, str]], model: str
     task_type = detect_task_type(messages)
     task_config = TASK_PATTERNS.get(task_type, TASK_PATTERNS['coding'])
     
-    # === Dimension 6: Model profile with adjusted thresholds ===
-    model_config = settings.analyzer.model_profiles.get(model, 
-        settings.analyzer.model_profiles.get("gpt-4o", 
-            {"similarity_threshold": 0.65, "max_retries": 3}))  # Lower threshold for better sensitivity
-    model_threshold = model_config["similarity_threshold"]
-    
     # === Enhanced similarity counting with progressive thresholds ===
     if recent_requests:
         repeat_count = count_similar_requests(recent_requests, similarity_threshold=0.6)  # Lower threshold
@@ -523,8 +1103,13 @@ def analyze_behavior(project_id: str, messages: List[Dict[str, str]], model: str
         score += 25 * (repeat_count - max_allowed_repeats)  # Increased weight
         reasons.append(f"Exceeded {model} model iteration limit ({max_allowed_repeats})")
     
+    # Recurring prompt that the last few requests do not show
+    if near_duplicates >= settings.analyzer.near_duplicate_min_count and near_duplicates > similar_requests_count:
+        score += min(10 * (near_duplicates - similar_requests_count), 30)
+        reasons.append(f"Recurring prompt ({near_duplicates} near-duplicates in {settings.analyzer.near_duplicate_window_hours:g}h)")
+    
     # Additional penalty for debugging scenarios
-    if any(keyword in current_user_msg.lower() for keyword in ["error", "bug", "fix", "修复", "报错"]):
+    if current_hits.any("behavior:debug_attempt"):
         if repeat_count >= 2:
             score += 20  # Extra penalty for repeated debugging
             reasons.append("Repeated debugging attempts")
@@ -551,7 +1136,11 @@ def analyze_behavior(project_id: str, messages: List[Dict[str, str]], model: str
             "emotion_score": emotion_score,
             "progress": progress,
             "task_type": task_type,
-            "repeat_count": repeat_count
+            "repeat_count": repeat_count,
+            "similarity_mode": "+".join(sorted(similarity_modes)) if similarity_modes else "exact",
+            "near_duplicates": near_duplicates,
+            "pair_similarity": pair_similarity,
+            "pattern_hits": [name.split(":", 1)[1] for name in current_hits.groups("pattern:")]
         }
     }
 
@@ -560,15 +1149,25 @@ def analyze_efficiency(project_id: str, time_range: str = "7d", use_cache: bool
     """
     分析项目的API使用效率
     """
-    # 检查缓存
-    if use_cache:
-        cached_result = efficiency_cache.get(project_id, time_range)
-        if cached_result:
-            # 添加缓存标记
-            cached_result["_cached"] = True
-            cached_result["_cache_timestamp"] = time.time()
-            return cached_result
+    if not use_cache:
+        return _compute_efficiency(project_id, time_range, language)
     
+    # 检查缓存，并发未命中时只计算一次；无数据的结果不缓存
+    result, cached = efficiency_cache.get_or_compute(
+        project_id, time_range,
+        lambda: _compute_efficiency(project_id, time_range, language),
+        cache_if=lambda data: "metrics" in data
+    )
+    if cached:
+        # 添加缓存标记（复制一份，不修改共享的缓存数据）
+        result = dict(result)
+        result["_cached"] = True
+        result["_cache_timestamp"] = time.time()
+    return result
+
+
+def _compute_efficiency(project_id: str, time_range: str, language: str) -> Dict:
+    """计算项目的API使用效率（不经过缓存）"""
     db = SessionLocal()
     try:
         # 计算时间范围
@@ -699,10 +1298,6 @@ def analyze_efficiency(project_id: str, time_range: str = "7d", use_cache: bool
             }
         }
         
-        # 存入缓存
-        if use_cache:
-            efficiency_cache.set(project_id, time_range, result)
-        
         return result
         
     finally:
@@ -0,0 +1,475 @@
+"""
+Offline backfill of the stored analysis columns (similarity_score, pattern_score,
+advisor_level, progress_indicator) after analyzer thresholds or model_profiles change.
+
+Requests are read in keyset-paged chunks ordered by (project_id, timestamp, id) and
+cut into segments of one project. Worker processes score every request against the
+previous one (the topic-drift pair) in a first pass; the running drift value is
+folded from those scores in order, and a second pass re-runs the analysis of each
+segment with a history and near-duplicate index rebuilt from the rows before it, so
+every request is scored against what the proxy would have seen when it arrived and
+one large project still uses every worker. Results are written back in batched
+UPDATEs, and a checkpoint file records the last written request (and the running
+drift value), so an interrupted run resumes there, also in the middle of a project.
+
+Usage:
+    python -m app.backfill [--workers N] [--chunk-size 5000] [--segment-size N] [--project ID]
+                           [--checkpoint data/backfill_checkpoint.json] [--restart] [--skip-rollups]
+"""
+import json
+import multiprocessing
+import os
+import re
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional, Tuple
+from sqlalchemy import func, select, tuple_, update
+from .config import settings
+from .models import Request, SessionLocal, WriteSessionLocal
+
+# Columns read per request: enough to rebuild the history and re-run the analysis
+READ_COLUMNS = (
+    Request.id, Request.project_id, Request.timestamp, Request.model,
+    Request.prompt_text, Request.prompt_tokens, Request.completion_tokens, Request.pattern_score
+)
+
+DEFAULT_CHECKPOINT = os.path.join("data", "backfill_checkpoint.json")
+
+# Privacy mode stores a 64-bit simhash or a sha256 digest instead of the prompt
+_FINGERPRINT_RE = re.compile(r"[0-9a-f]{16}|[0-9a-f]{64}")
+
+
+def is_fingerprint(prompt_text: Optional[str]) -> bool:
+    return bool(prompt_text) and _FINGERPRINT_RE.fullmatch(prompt_text.strip().lower()) is not None
+
+
+class Segment:
+    """
+    Consecutive requests of one project (oldest first), with the requests before them
+    that the analysis of the first one needs: the history and near-duplicate window
+    """
+
+    __slots__ = ("project_id", "context", "rows")
+
+    def __init__(self, project_id: str, context: List[Tuple], rows: List[Tuple]):
+        self.project_id = project_id
+        self.context = context
+        self.rows = rows
+
+    @property
+    def last_key(self) -> List:
+        request_id, timestamp = self.rows[-1][0], self.rows[-1][1]
+        return [self.project_id, timestamp.isoformat(), request_id]
+
+
+def _context_size() -> int:
+    return max(settings.analyzer.history_size, settings.analyzer.near_duplicate_max_entries)
+
+
+def pair_similarities(previous_text: Optional[str], rows: List[Tuple]) -> List[Optional[float]]:
+    """
+    First pass: each request's similarity to the request before it (the pair that
+    feeds topic drift), None where either prompt is missing. The pairs are
+    independent, so segments of one project run on all workers at once.
+    """
+    from .analyzer import calculate_similarity_privacy_aware
+
+    pairs = []
+    for row in rows:
+        prompt_text = row[3]
+        pairs.append(
+            calculate_similarity_privacy_aware(prompt_text, previous_text) if prompt_text and previous_text else None
+        )
+        previous_text = prompt_text
+    return pairs
+
+
+def _new_history():
+    from .history import ProjectHistoryCache
+    return ProjectHistoryCache(
+        entries_per_project=settings.analyzer.history_size,
+        max_projects=1,
+        max_bytes=1 << 62,  # One project only; the entry count bounds it
+        drift_alpha=settings.analyzer.topic_drift_alpha
+    )
+
+
+def fold_pair_similarity(history, project_id: str, rows: List[Tuple], pairs: List[Optional[float]]) -> Optional[float]:
+    """
+    Advance the project's running consecutive-prompt similarity over a segment exactly as
+    the analysis does (seeding it from the recent prompts while it is unset), using the
+    first-pass pairs; returns the value after the segment. Cheap, so it runs in order.
+    """
+    from .analyzer import incremental_topic_drift
+
+    for (request_id, timestamp, model, prompt_text, prompt_tokens, completion_tokens, pattern_score), pair \
+            in zip(rows, pairs):
+        recent = history.get_recent(project_id, limit=5)
+        if recent and history.get_pair_similarity(project_id) is None:
+            incremental_topic_drift(project_id, recent, None, history)
+        history.record(project_id, prompt_text, timestamp, prompt_tokens, completion_tokens, pair)
+    return history.get_pair_similarity(project_id)
+
+
+def analyze_segment(project_id: str, context: List[Tuple], running: Optional[float], rows: List[Tuple],
+                    pairs: List[Optional[float]]) -> List[Dict]:
+    """
+    Second pass: re-run the analysis for a segment's requests and return the recomputed
+    columns keyed by request id. The history and near-duplicate index are rebuilt from
+    the context rows and the running drift value, so every request is scored against
+    what the proxy would have seen when it arrived. Runs in a worker process.
+
+    Privacy-mode rows store a fingerprint instead of the prompt, so the emotion score
+    cannot be recomputed: the stored pattern_score is kept and fed into the scoring,
+    and only the similarity-derived columns change. Keyword-based signals of the prompt
+    (debugging terms, task type) are not available for these rows either.
+    """
+    from .analyzer import analyze_behavior
+    from .history import HistoryEntry
+    from .near_duplicates import NearDuplicateIndex
+
+    history = _new_history()
+    duplicates = NearDuplicateIndex(
+        window_hours=settings.analyzer.near_duplicate_window_hours,
+        max_entries_per_project=settings.analyzer.near_duplicate_max_entries,
+        max_projects=1,
+        minhash_bands=settings.analyzer.near_duplicate_minhash_bands,
+        minhash_rows=settings.analyzer.near_duplicate_minhash_rows,
+        simhash_bands=settings.analyzer.near_duplicate_simhash_bands,
+        jaccard_threshold=settings.analyzer.near_duplicate_jaccard_threshold,
+        simhash_threshold=settings.analyzer.near_duplicate_simhash_threshold,
+        max_bytes=1 << 62
+    )
+    for request_id, timestamp, model, prompt_text, prompt_tokens, completion_tokens, pattern_score in context:
+        history.record(project_id, prompt_text, timestamp, prompt_tokens, completion_tokens)
+        duplicates.add(project_id, prompt_text, timestamp, now=timestamp)
+    if running is not None:
+        history.seed_pair_similarity(project_id, running)
+
+    results = []
+    for (request_id, timestamp, model, prompt_text, prompt_tokens, completion_tokens, pattern_score), pair \
+            in zip(rows, pairs):
+        current = HistoryEntry(project_id, prompt_text, timestamp, prompt_tokens, completion_tokens)
+        messages = [{"role": "user", "content": prompt_text}] if prompt_text else []
+        stored_emotion = pattern_score if is_fingerprint(prompt_text) and pattern_score is not None else None
+        analysis = analyze_behavior(
+            project_id, messages, model or "gpt-4o",
+            history=history, duplicates=duplicates, current=current,
+            previous_similarity=pair, emotion_score=stored_emotion
+        )
+        details = analysis["details"]
+        results.append({
+            "id": request_id,
+            "similarity_score": details["similarity"],
+            "pattern_score": details["emotion_score"],
+            "advisor_level": analysis["level"],
+            "progress_indicator": details.get("progress", "unknown")
+        })
+        # Then "store" it, as the proxy does after the analysis
+        history.record(project_id, prompt_text, timestamp, prompt_tokens, completion_tokens,
+                       details.get("pair_similarity"))
+        duplicates.add(project_id, prompt_text, timestamp, now=timestamp)
+    return results
+
+
+def analyze_project_rows(project_id: str, rows: List[Tuple]) -> List[Dict]:
+    """Both passes in this process for one project's requests (oldest first)"""
+    return analyze_segment(project_id, [], None, rows, pair_similarities(None, rows))
+
+
+def iter_segments(chunk_size: int, after_key: Optional[List] = None, project_id: Optional[str] = None,
+                  segment_size: Optional[int] = None) -> Iterator[Segment]:
+    """
+    Yield segments of at most segment_size rows, in (project_id, timestamp, id) order,
+    after the checkpointed key. Rows are read with keyset pagination, so each chunk is
+    an index range scan on (project_id, timestamp) no matter how far the backfill has
+    progressed. Each segment carries the rows before it that its analysis needs.
+    """
+    segment_size = segment_size or chunk_size
+    filters = [Request.timestamp.isnot(None)]
+    if project_id is not None:
+        filters.append(Request.project_id == project_id)
+
+    last_key = None
+    context: "deque[Tuple]" = deque(maxlen=_context_size())
+    if after_key is not None:
+        resumed_project, timestamp, request_id = after_key[0], datetime.fromisoformat(after_key[1]), after_key[2]
+        last_key = tuple_(resumed_project, timestamp, request_id)
+        # The resumed project's requests up to the checkpoint, for the history and near-duplicate window
+        db = SessionLocal()
+        try:
+            previous = db.execute(
+                select(*READ_COLUMNS).where(
+                    Request.timestamp.isnot(None), Request.project_id == resumed_project,
+                    tuple_(Request.project_id, Request.timestamp, Request.id) <= last_key
+                ).order_by(Request.timestamp.desc(), Request.id.desc()).limit(context.maxlen)
+            ).all()
+        finally:
+            db.close()
+        context.extend(_row(row) for row in reversed(previous))
+
+    current_project = after_key[0] if after_key is not None else None
+    rows: List[Tuple] = []
+    while True:
+        query = select(*READ_COLUMNS).where(*filters)
+        if last_key is not None:
+            query = query.where(tuple_(Request.project_id, Request.timestamp, Request.id) > last_key)
+        query = query.order_by(Request.project_id, Request.timestamp, Request.id).limit(chunk_size)
+
+        db = SessionLocal()
+        try:
+            chunk = db.execute(query).all()
+        finally:
+            db.close()
+        if not chunk:
+            break
+
+        for row in chunk:
+            if row.project_id != current_project or len(rows) >= segment_size:
+                if rows:
+                    yield Segment(current_project, list(context), rows)
+                    context.extend(rows)
+                if row.project_id != current_project:
+                    context.clear()
+                current_project, rows = row.project_id, []
+            rows.append(_row(row))
+        last = chunk[-1]
+        last_key = tuple_(last.project_id, last.timestamp, last.id)
+        if len(chunk) < chunk_size:
+            break
+
+    if rows:
+        yield Segment(current_project, list(context), rows)
+
+
+def _row(row) -> Tuple:
+    return (row.id, row.timestamp, row.model, row.prompt_text, row.prompt_tokens or 0, row.completion_tokens or 0,
+            row.pattern_score)
+
+
+def write_results(results: List[Dict], batch_size: int = 5000):
+    """Write recomputed columns back with bulk UPDATEs by primary key"""
+    db = WriteSessionLocal()
+    try:
+        for i in range(0, len(results), batch_size):
+            db.execute(update(Request), results[i:i + batch_size])
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+def load_checkpoint(path: str) -> Dict:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def save_checkpoint(path: str, state: Dict):
+    """Write the checkpoint atomically, so a crash never leaves a partial file"""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(state, f)
+    os.replace(tmp_path, path)
+
+
+class _Progress:
+    """Prints rows done, throughput and ETA at most every interval seconds"""
+
+    def __init__(self, total_rows: int, interval: float = 2.0):
+        self.total_rows = total_rows
+        self.interval = interval
+        self.rows = 0
+        self.projects = 0
+        self._last_project = None
+        self.started = time.monotonic()
+        self._last_report = 0.0
+
+    def add(self, project_id: str, rows: int):
+        self.rows += rows
+        if project_id != self._last_project:
+            self._last_project = project_id
+            self.projects += 1
+        now = time.monotonic()
+        if now - self._last_report >= self.interval:
+            self._last_report = now
+            self.report()
+
+    def rate(self) -> float:
+        elapsed = time.monotonic() - self.started
+        return self.rows / elapsed if elapsed > 0 else 0.0
+
+    def report(self, final: bool = False):
+        rate = self.rate()
+        line = f"[Backfill] {self.rows}/{self.total_rows} rows, {self.projects} projects, {rate:.0f} rows/s"
+        if not final and rate > 0 and self.total_rows > self.rows:
+            line += f", ETA {(self.total_rows - self.rows) / rate:.0f}s"
+        print(line, flush=True)
+
+
+class _RunningDrift:
+    """The first-pass fold of each project's running drift value, in segment order"""
+
+    def __init__(self, after_key: Optional[List], running: Optional[float]):
+        self._project_id = after_key[0] if after_key is not None else None
+        self._resume_running = running
+        self._history = None
+
+    def advance(self, segment: Segment, pairs: List[Optional[float]]) -> Tuple[Optional[float], Optional[float]]:
+        """Running value before and after the segment"""
+        if self._history is None or segment.project_id != self._project_id:
+            self._history = _new_history()
+            for request_id, timestamp, model, prompt_text, prompt_tokens, completion_tokens, _ in segment.context:
+                self._history.record(segment.project_id, prompt_text, timestamp, prompt_tokens, completion_tokens)
+            if segment.project_id == self._project_id and self._resume_running is not None:
+                self._history.seed_pair_similarity(segment.project_id, self._resume_running)
+            self._project_id = segment.project_id
+        before = self._history.get_pair_similarity(segment.project_id)
+        after = fold_pair_similarity(self._history, segment.project_id, segment.rows, pairs)
+        return before, after
+
+
+def run_backfill(workers: Optional[int] = None, chunk_size: int = 5000, checkpoint_path: str = DEFAULT_CHECKPOINT,
+                 project_id: Optional[str] = None, restart: bool = False, rebuild_rollups: bool = True,
+                 segment_size: Optional[int] = None) -> Dict:
+    """
+    Recompute the analysis columns of all stored requests (or one project's).
+    Every project is cut into segments of segment_size rows (default: chunk_size), so a
+    single large project still keeps all workers busy: the first pass scores each
+    request against the previous one, the running drift value is folded in order from
+    those scores, and the second pass analyzes each segment from its context rows and
+    that value. The checkpoint advances after every written segment.
+    Returns counts and throughput.
+    """
+    workers = workers or os.cpu_count() or 1
+    # A single-project run does not move the whole-table checkpoint
+    use_checkpoint = project_id is None
+    state = {} if restart or not use_checkpoint else load_checkpoint(checkpoint_path)
+    after_key = state.get("last_key")
+    if after_key is not None:
+        print(f"[Backfill] Resuming after request {after_key[2]} of project {after_key[0]!r} "
+              f"({state.get('rows', 0)} rows done earlier)")
+
+    db = SessionLocal()
+    try:
+        count_query = select(func.count()).select_from(Request).where(Request.timestamp.isnot(None))
+        if project_id is not None:
+            count_query = count_query.where(Request.project_id == project_id)
+        elif after_key is not None:
+            count_query = count_query.where(
+                tuple_(Request.project_id, Request.timestamp, Request.id)
+                > tuple_(after_key[0], datetime.fromisoformat(after_key[1]), after_key[2])
+            )
+        total_rows = db.execute(count_query).scalar() or 0
+    finally:
+        db.close()
+
+    progress = _Progress(total_rows)
+    rows_done = state.get("rows", 0)
+    drift = _RunningDrift(after_key, state.get("running_pair_similarity"))
+
+    def finish(segment: Segment, running: Optional[float], results: List[Dict]):
+        nonlocal rows_done
+        write_results(results)
+        rows_done += len(results)
+        progress.add(segment.project_id, len(results))
+        if use_checkpoint:
+            # Segments finish in submission (= key) order, so everything up to here is written
+            save_checkpoint(checkpoint_path, {"last_key": segment.last_key, "running_pair_similarity": running,
+                                              "rows": rows_done})
+
+    segments = iter_segments(chunk_size, after_key, project_id, segment_size)
+    if workers <= 1:
+        for segment in segments:
+            pairs = pair_similarities(segment.context[-1][3] if segment.context else None, segment.rows)
+            before, after = drift.advance(segment, pairs)
+            finish(segment, after, analyze_segment(segment.project_id, segment.context, before, segment.rows, pairs))
+    else:
+        # spawn: fresh interpreters, no inherited database connections or locks
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+            first_pass: "deque[Tuple[Segment, Future]]" = deque()
+            second_pass: "deque[Tuple[Segment, Optional[float], Future]]" = deque()
+
+            def step():
+                # Fold finished first passes in order and queue their second pass
+                while first_pass and first_pass[0][1].done():
+                    segment, future = first_pass.popleft()
+                    pairs = future.result()
+                    before, after = drift.advance(segment, pairs)
+                    second_pass.append((segment, after, executor.submit(
+                        analyze_segment, segment.project_id, segment.context, before, segment.rows, pairs
+                    )))
+                # Write finished second passes in order
+                while second_pass and second_pass[0][2].done():
+                    segment, after, future = second_pass.popleft()
+                    finish(segment, after, future.result())
+
+            def wait_oldest():
+                (second_pass[0][2] if second_pass else first_pass[0][1]).result()
+                step()
+
+            for segment in segments:
+                previous_text = segment.context[-1][3] if segment.context else None
+                first_pass.append((segment, executor.submit(pair_similarities, previous_text, segment.rows)))
+                step()
+                # Bounded look-ahead keeps memory flat
+                while len(first_pass) + len(second_pass) >= workers * 4:
+                    wait_oldest()
+            while first_pass or second_pass:
+                wait_oldest()
+
+    progress.report(final=True)
+    if use_checkpoint and os.path.exists(checkpoint_path):
+        # Completed: the next run starts from the beginning
+        os.remove(checkpoint_path)
+
+    if rebuild_rollups and progress.rows:
+        # Level and progress counters in the rollups are derived from the rewritten columns
+        from .models import write_engine
+        from .rollups import rebuild_rollups as rebuild
+        with write_engine.begin() as conn:
+            rebuild(conn)
+        print("[Backfill] Rebuilt hourly and daily rollups")
+    if progress.rows:
+        from .analyzer import efficiency_cache
+        efficiency_cache.invalidate()
+
+    return {"rows": progress.rows, "projects": progress.projects, "rows_per_second": progress.rate()}
+
+
+if __name__ == "__main__":
+    import argparse
+    from .models import init_db
+
+    parser = argparse.ArgumentParser(description="Recompute stored analysis results for historical requests")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: CPU count, 1 = in-process)")
+    parser.add_argument("--chunk-size", type=int, default=5000, help="Rows read per query")
+    parser.add_argument("--segment-size", type=int, default=None,
+                        help="Rows per worker task and checkpoint (default: chunk size)")
+    parser.add_argument("--project", default=None, help="Only backfill this project")
+    parser.add_argument("--checkpoint", default=DEFAULT_CHECKPOINT, help="Resume file")
+    parser.add_argument("--restart", action="store_true", help="Ignore an existing checkpoint")
+    parser.add_argument("--skip-rollups", action="store_true", help="Do not rebuild rollup tables afterwards")
+    args = parser.parse_args()
+
+    init_db()
+    stats = run_backfill(
+        workers=args.workers,
+        chunk_size=args.chunk_size,
+        segment_size=args.segment_size,
+        checkpoint_path=args.checkpoint,
+        project_id=args.project,
+        restart=args.restart,
+        rebuild_rollups=not args.skip_rollups
+    )
+    print(f"[Backfill] Recomputed {stats['rows']} requests in {stats['projects']} projects "
+          f"({stats['rows_per_second']:.0f} rows/s)")
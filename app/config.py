@@ -9,12 +9,27 @@ class ServerConfig(BaseSettings):
     port: int = 8000
     debug: bool = False
 
+class UpstreamPoolConfig(BaseSettings):
+    """Connection pool settings for one upstream provider's shared client"""
+    timeout: int = 120
+    max_connections: int = 100
+    max_keepalive_connections: int = 20
+    keepalive_expiry: float = 30.0
+    http2: bool = False  # Requires the optional `h2` package (pip install httpx[http2])
+
 class UpstreamConfig(BaseSettings):
     openai: str = "https://api.openai.com"
     anthropic: str = "https://api.anthropic.com"
     openrouter: str = "https://openrouter.ai/api"
     custom: str = ""
     timeout: int = 120
+    # Per-provider pool settings, keyed by provider name
+    pools: Dict[str, UpstreamPoolConfig] = {
+        "openai": UpstreamPoolConfig(),
+        "anthropic": UpstreamPoolConfig(),
+        "openrouter": UpstreamPoolConfig(),
+        "custom": UpstreamPoolConfig(timeout=60),
+    }
 
 class PricingConfig(BaseSettings):
     exchange_rate_usd_to_cny: float = 7.3
@@ -45,6 +60,43 @@ class AnalyzerConfig(BaseSettings):
         "debug": ["error", "bug", "fix", "修复", "报错"],
         "repeat": ["same", "still", "一样", "还是"]
     }
+    # Analysis runs in a bounded thread pool with a per-request time budget
+    max_concurrency: int = 4  # Worker threads running analyze_behavior
+    max_pending: int = 64  # Analyses queued or running before new ones are degraded
+    time_budget_ms: int = 500  # Forward with a degraded analysis when exceeded
+    # "concurrent" overlaps the analysis with the upstream call, "sequential" finishes it first
+    execution_mode: str = "concurrent"
+    # Batch analysis (log replays via analyze_batch / POST /api/analyzer/batch)
+    batch_workers: int = 4  # Worker processes; 1 runs in the server process
+    batch_chunk_size: int = 64  # Consecutive items analyzed together in one worker
+    batch_max_items: int = 10000  # Per HTTP request
+    # In-process per-project request history read by the analyzer
+    history_size: int = 10  # Requests kept per project
+    history_max_projects: int = 1000  # Least recently used projects are evicted beyond this
+    history_max_bytes: int = 32 * 1024 * 1024  # Memory cap across all projects
+    history_sync_interval_ms: int = 100  # How often requests stored by other workers are picked up; 0 disables
+    topic_drift_alpha: float = 0.33  # EWMA weight of the newest consecutive-prompt similarity (~ last 5 pairs)
+    # Texts longer than this use a MinHash estimate of the character similarity instead of difflib
+    similarity_exact_max_chars: int = 2000
+    minhash_shingle_size: int = 8  # Characters per shingle
+    minhash_sketch_size: int = 256  # Smallest shingle hashes kept per text
+    # Per-text memo (lowercased text, tokens, exception names, simhash) shared by the analyzer functions
+    text_memo_max_entries: int = 2048
+    text_memo_max_bytes: int = 64 * 1024 * 1024
+    # Per-project LSH index of recent prompts for counting near-duplicates
+    near_duplicate_window_hours: float = 24  # Prompts older than this are dropped from the index
+    near_duplicate_max_entries: int = 2000  # Per project, oldest dropped first
+    near_duplicate_max_bytes: int = 64 * 1024 * 1024  # Memory cap across all projects, least recently used evicted
+    near_duplicate_minhash_bands: int = 16  # Raw prompts: signature of bands * rows MinHash bins
+    near_duplicate_minhash_rows: int = 4
+    near_duplicate_simhash_bands: int = 8  # Fingerprints differing in fewer bits always share a band
+    near_duplicate_jaccard_threshold: float = 0.7  # Estimated shingle Jaccard to count as near-duplicate
+    near_duplicate_simhash_threshold: float = 0.89  # Hamming similarity (0.89 = at most 7 of 64 bits differ)
+    near_duplicate_min_count: int = 3  # Near-duplicates needed before the analyzer adds to the score
+    # Efficiency analysis cache
+    efficiency_cache_ttl_seconds: int = 3600  # Entries are also invalidated when the project gets new requests
+    efficiency_cache_max_entries: int = 512  # Least recently used entries are evicted beyond this
+    efficiency_cache_sweep_interval_seconds: int = 60  # Background removal of expired entries
     # Model-specific profiles for different behaviors
     model_profiles: Dict[str, Dict[str, float]] = {
         "claude-opus-4": {
@@ -89,6 +141,34 @@ class AdvisorConfig(BaseSettings):
     cooldown_minutes: int = 20
     webhook_url: Optional[str] = ""
 
+class DatabaseConfig(BaseSettings):
+    # Write-behind: request records are queued and bulk inserted by a background thread
+    write_behind: bool = True
+    write_batch_size: int = 200  # Flush when this many records are queued
+    write_flush_interval_ms: int = 250  # ...or when the oldest queued record is this old
+    write_queue_max_size: int = 10000  # Beyond this, records are written inline
+    write_retry_attempts: int = 5  # Attempts per batch before its records are dropped
+    write_retry_backoff_ms: int = 100  # Wait before the first retry, doubled after each one
+    # SQLite engine profile: "default" (driver defaults) or "production" (tuned PRAGMAs,
+    # reader pool plus a single writer connection). Only applies to file databases.
+    sqlite_profile: str = "default"
+    sqlite_journal_mode: str = "WAL"
+    sqlite_synchronous: str = "NORMAL"  # Safe with WAL; only the last commits can be lost on power failure
+    sqlite_busy_timeout_ms: int = 5000
+    sqlite_mmap_size: int = 268435456  # 256 MB
+    sqlite_cache_size: int = -65536  # Negative values are KiB, i.e. 64 MB per connection
+    sqlite_temp_store: str = "MEMORY"
+    sqlite_reader_pool_size: int = 8
+
+class SharedStateConfig(BaseSettings):
+    # State shared by all worker processes: efficiency cache, settings, rate-limit buckets
+    backend: str = "memory"  # "memory" (single process), "sqlite" or "redis"
+    sqlite_file: str = "data/shared_state.db"
+    redis_dsn: str = "redis://localhost:6379/0"
+    key_prefix: str = "watchdog:"
+    config_refresh_interval_ms: int = 1000  # How often workers pick up settings changed elsewhere
+    spend_sync_interval_ms: int = 500  # How often workers exchange hourly spend (rate-limit lag between workers)
+
 class Settings(BaseSettings):
     server: ServerConfig = ServerConfig()
     upstream: UpstreamConfig = UpstreamConfig()
@@ -96,6 +176,8 @@ class Settings(BaseSettings):
     analyzer: AnalyzerConfig = AnalyzerConfig()
     privacy: PrivacyConfig = PrivacyConfig()
     advisor: AdvisorConfig = AdvisorConfig()
+    database: DatabaseConfig = DatabaseConfig()
+    shared_state: SharedStateConfig = SharedStateConfig()
 
 # Global settings instance
 settings = Settings()
@@ -134,6 +216,72 @@ if os.path.exists(config_file):
                     settings.analyzer.similarity_threshold_critical = analyzer_config['similarity_threshold_critical']
                 if 'pattern_keywords' in analyzer_config:
                     settings.analyzer.pattern_keywords = analyzer_config['pattern_keywords']
+                if 'max_concurrency' in analyzer_config:
+                    settings.analyzer.max_concurrency = analyzer_config['max_concurrency']
+                if 'max_pending' in analyzer_config:
+                    settings.analyzer.max_pending = analyzer_config['max_pending']
+                if 'time_budget_ms' in analyzer_config:
+                    settings.analyzer.time_budget_ms = analyzer_config['time_budget_ms']
+                if 'execution_mode' in analyzer_config:
+                    settings.analyzer.execution_mode = analyzer_config['execution_mode']
+                if 'batch' in analyzer_config:
+                    batch_config = analyzer_config['batch']
+                    if 'workers' in batch_config:
+                        settings.analyzer.batch_workers = batch_config['workers']
+                    if 'chunk_size' in batch_config:
+                        settings.analyzer.batch_chunk_size = batch_config['chunk_size']
+                    if 'max_items' in batch_config:
+                        settings.analyzer.batch_max_items = batch_config['max_items']
+                if 'history_size' in analyzer_config:
+                    settings.analyzer.history_size = analyzer_config['history_size']
+                if 'history_max_projects' in analyzer_config:
+                    settings.analyzer.history_max_projects = analyzer_config['history_max_projects']
+                if 'history_max_bytes' in analyzer_config:
+                    settings.analyzer.history_max_bytes = analyzer_config['history_max_bytes']
+                if 'history_sync_interval_ms' in analyzer_config:
+                    settings.analyzer.history_sync_interval_ms = analyzer_config['history_sync_interval_ms']
+                if 'topic_drift_alpha' in analyzer_config:
+                    settings.analyzer.topic_drift_alpha = analyzer_config['topic_drift_alpha']
+                if 'similarity_exact_max_chars' in analyzer_config:
+                    settings.analyzer.similarity_exact_max_chars = analyzer_config['similarity_exact_max_chars']
+                if 'minhash_shingle_size' in analyzer_config:
+                    settings.analyzer.minhash_shingle_size = analyzer_config['minhash_shingle_size']
+                if 'minhash_sketch_size' in analyzer_config:
+                    settings.analyzer.minhash_sketch_size = analyzer_config['minhash_sketch_size']
+                if 'text_memo' in analyzer_config:
+                    memo_config = analyzer_config['text_memo']
+                    if 'max_entries' in memo_config:
+                        settings.analyzer.text_memo_max_entries = memo_config['max_entries']
+                    if 'max_bytes' in memo_config:
+                        settings.analyzer.text_memo_max_bytes = memo_config['max_bytes']
+                if 'near_duplicates' in analyzer_config:
+                    lsh_config = analyzer_config['near_duplicates']
+                    if 'window_hours' in lsh_config:
+                        settings.analyzer.near_duplicate_window_hours = lsh_config['window_hours']
+                    if 'max_entries' in lsh_config:
+                        settings.analyzer.near_duplicate_max_entries = lsh_config['max_entries']
+                    if 'max_bytes' in lsh_config:
+                        settings.analyzer.near_duplicate_max_bytes = lsh_config['max_bytes']
+                    if 'minhash_bands' in lsh_config:
+                        settings.analyzer.near_duplicate_minhash_bands = lsh_config['minhash_bands']
+                    if 'minhash_rows' in lsh_config:
+                        settings.analyzer.near_duplicate_minhash_rows = lsh_config['minhash_rows']
+                    if 'simhash_bands' in lsh_config:
+                        settings.analyzer.near_duplicate_simhash_bands = lsh_config['simhash_bands']
+                    if 'jaccard_threshold' in lsh_config:
+                        settings.analyzer.near_duplicate_jaccard_threshold = lsh_config['jaccard_threshold']
+                    if 'simhash_threshold' in lsh_config:
+                        settings.analyzer.near_duplicate_simhash_threshold = lsh_config['simhash_threshold']
+                    if 'min_count' in lsh_config:
+                        settings.analyzer.near_duplicate_min_count = lsh_config['min_count']
+                if 'efficiency_cache' in analyzer_config:
+                    cache_config = analyzer_config['efficiency_cache']
+                    if 'ttl_seconds' in cache_config:
+                        settings.analyzer.efficiency_cache_ttl_seconds = cache_config['ttl_seconds']
+                    if 'max_entries' in cache_config:
+                        settings.analyzer.efficiency_cache_max_entries = cache_config['max_entries']
+                    if 'sweep_interval_seconds' in cache_config:
+                        settings.analyzer.efficiency_cache_sweep_interval_seconds = cache_config['sweep_interval_seconds']
             
             # Update advisor settings
             if 'advisor' in yaml_config:
@@ -147,28 +295,64 @@ if os.path.exists(config_file):
                 if 'webhook_url' in advisor_config:
                     settings.advisor.webhook_url = advisor_config['webhook_url']
             
+            # Update database settings
+            if 'database' in yaml_config:
+                database_config = yaml_config['database']
+                if 'write_behind' in database_config:
+                    settings.database.write_behind = database_config['write_behind']
+                if 'write_batch_size' in database_config:
+                    settings.database.write_batch_size = database_config['write_batch_size']
+                if 'write_flush_interval_ms' in database_config:
+                    settings.database.write_flush_interval_ms = database_config['write_flush_interval_ms']
+                if 'write_queue_max_size' in database_config:
+                    settings.database.write_queue_max_size = database_config['write_queue_max_size']
+                if 'write_retry_attempts' in database_config:
+                    settings.database.write_retry_attempts = database_config['write_retry_attempts']
+                if 'write_retry_backoff_ms' in database_config:
+                    settings.database.write_retry_backoff_ms = database_config['write_retry_backoff_ms']
+                sqlite_config = database_config.get('sqlite') or {}
+                if 'profile' in sqlite_config:
+                    settings.database.sqlite_profile = sqlite_config['profile']
+                for key in ('journal_mode', 'synchronous', 'busy_timeout_ms', 'mmap_size',
+                            'cache_size', 'temp_store', 'reader_pool_size'):
+                    if key in sqlite_config:
+                        setattr(settings.database, f'sqlite_{key}', sqlite_config[key])
+            
+            # Update shared state settings
+            if 'shared_state' in yaml_config:
+                shared_state_config = yaml_config['shared_state']
+                if 'backend' in shared_state_config:
+                    settings.shared_state.backend = shared_state_config['backend']
+                if 'sqlite_file' in shared_state_config:
+                    settings.shared_state.sqlite_file = shared_state_config['sqlite_file']
+                if 'redis_dsn' in shared_state_config:
+                    settings.shared_state.redis_dsn = shared_state_config['redis_dsn']
+                if 'key_prefix' in shared_state_config:
+                    settings.shared_state.key_prefix = shared_state_config['key_prefix']
+                if 'config_refresh_interval_ms' in shared_state_config:
+                    settings.shared_state.config_refresh_interval_ms = shared_state_config['config_refresh_interval_ms']
+                if 'spend_sync_interval_ms' in shared_state_config:
+                    settings.shared_state.spend_sync_interval_ms = shared_state_config['spend_sync_interval_ms']
+            
             # Update upstream settings
             if 'upstream' in yaml_config:
                 upstream_config = yaml_config['upstream']
-                if 'openai' in upstream_config:
-                    openai_config = upstream_config['openai']
-                    if isinstance(openai_config, str):
-                        settings.upstream.openai = openai_config
-                    elif isinstance(openai_config, dict) and 'base_url' in openai_config:
-                        settings.upstream.openai = openai_config['base_url']
-                if 'anthropic' in upstream_config:
-                    anth_config = upstream_config['anthropic']
-                    if isinstance(anth_config, str):
-                        settings.upstream.anthropic = anth_config
-                    elif isinstance(anth_config, dict) and 'base_url' in anth_config:
-                        settings.upstream.anthropic = anth_config['base_url']
-                if 'openrouter' in upstream_config:
-                    or_config = upstream_config['openrouter']
-                    if isinstance(or_config, str):
-                        settings.upstream.openrouter = or_config
-                    elif isinstance(or_config, dict) and 'base_url' in or_config:
-                        settings.upstream.openrouter = or_config['base_url']
-                if 'custom' in upstream_config:
-                    custom_config = upstream_config['custom']
-                    if isinstance(custom_config, dict) and 'base_url' in custom_config:
-                        settings.upstream.custom = custom_config['base_url']
\ No newline at end of file
+                for provider in ('openai', 'anthropic', 'openrouter', 'custom'):
+                    if provider not in upstream_config:
+                        continue
+                    provider_config = upstream_config[provider]
+                    if isinstance(provider_config, str):
+                        if provider != 'custom':
+                            setattr(settings.upstream, provider, provider_config)
+                        continue
+                    if not isinstance(provider_config, dict):
+                        continue
+                    if 'base_url' in provider_config:
+                        setattr(settings.upstream, provider, provider_config['base_url'])
+                    pool_config = settings.upstream.pools.setdefault(provider, UpstreamPoolConfig())
+                    if 'timeout' in provider_config:
+                        pool_config.timeout = provider_config['timeout']
+                    pool_overrides = provider_config.get('pool') or {}
+                    for key in ('max_connections', 'max_keepalive_connections', 'keepalive_expiry', 'http2'):
+                        if key in pool_overrides:
+                            setattr(pool_config, key, pool_overrides[key])
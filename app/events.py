@@ -0,0 +1,83 @@
+"""
+In-process project change events.
+The request write path publishes one event per project after new records are
+committed; caches subscribe and drop what the new data makes stale.
+"""
+import threading
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+
+class ProjectChange:
+    """Requests for a project were stored ("stored") or removed ("deleted")"""
+    
+    __slots__ = ("project_id", "kind", "request_count", "total_cost_usd", "last_request_at")
+    
+    def __init__(self, project_id: str, kind: str = "stored", request_count: int = 0,
+                 total_cost_usd: float = 0.0, last_request_at: Optional[datetime] = None):
+        self.project_id = project_id
+        self.kind = kind
+        self.request_count = request_count
+        self.total_cost_usd = total_cost_usd
+        self.last_request_at = last_request_at
+    
+    def __repr__(self) -> str:
+        return f"ProjectChange({self.project_id!r}, {self.kind!r}, requests={self.request_count})"
+
+
+class ProjectEventBus:
+    """Synchronous publish/subscribe; subscribers run on the publishing thread and must be quick"""
+    
+    def __init__(self):
+        self._subscribers: List[Callable[[ProjectChange], None]] = []
+        self._lock = threading.Lock()
+        self._stats = {"published": 0, "subscriber_errors": 0}
+    
+    def subscribe(self, callback: Callable[[ProjectChange], None]):
+        with self._lock:
+            if callback not in self._subscribers:
+                self._subscribers.append(callback)
+    
+    def unsubscribe(self, callback: Callable[[ProjectChange], None]):
+        with self._lock:
+            if callback in self._subscribers:
+                self._subscribers.remove(callback)
+    
+    def publish(self, event: ProjectChange):
+        with self._lock:
+            subscribers = list(self._subscribers)
+            self._stats["published"] += 1
+        for callback in subscribers:
+            try:
+                callback(event)
+            except Exception as e:
+                # A failing subscriber must not break the write path
+                with self._lock:
+                    self._stats["subscriber_errors"] += 1
+                print(f"[Events] Subscriber {getattr(callback, '__name__', callback)} failed for {event}: {e}")
+    
+    def publish_stored(self, records: Iterable[Dict[str, Any]]):
+        """Publish one "stored" event per project for a batch of committed request records"""
+        changes: Dict[str, ProjectChange] = {}
+        for record in records:
+            project_id = record.get("project_id") or "default"
+            change = changes.get(project_id)
+            if change is None:
+                change = changes[project_id] = ProjectChange(project_id)
+            change.request_count += 1
+            change.total_cost_usd += record.get("total_cost_usd") or 0.0
+            timestamp = record.get("timestamp")
+            if timestamp is not None and (change.last_request_at is None or timestamp > change.last_request_at):
+                change.last_request_at = timestamp
+        for change in changes.values():
+            self.publish(change)
+    
+    def get_stats(self) -> Dict[str, int]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["subscribers"] = len(self._subscribers)
+        return stats
+
+
+# Global event bus for project data changes
+project_events = ProjectEventBus()
@@ -0,0 +1,181 @@
+"""
+In-process history of each project's most recent requests.
+Filled when requests are stored (by this worker, or by other workers via
+worker_sync) and read by the analyzer, so analysis needs no per-request
+history query.
+"""
+import threading
+from collections import OrderedDict, deque
+from datetime import datetime
+from typing import Deque, Dict, List, Optional
+from .config import settings
+
+# Rough per-entry overhead (object, deque slot, datetime) used for the memory cap
+_ENTRY_OVERHEAD_BYTES = 200
+
+
+class HistoryEntry:
+    """The fields of a stored Request the analyzer looks at"""
+    
+    __slots__ = ("project_id", "prompt_text", "timestamp", "prompt_tokens", "completion_tokens")
+    
+    def __init__(self, project_id: str, prompt_text: Optional[str], timestamp: datetime,
+                 prompt_tokens: int = 0, completion_tokens: int = 0):
+        self.project_id = project_id
+        self.prompt_text = prompt_text
+        self.timestamp = timestamp
+        self.prompt_tokens = prompt_tokens or 0
+        self.completion_tokens = completion_tokens or 0
+    
+    def size_bytes(self) -> int:
+        return _ENTRY_OVERHEAD_BYTES + len(self.prompt_text or "")
+
+
+class ProjectHistoryCache:
+    """
+    Last N requests per project, with LRU eviction over projects
+    once the project count or the memory cap is exceeded
+    """
+    
+    def __init__(self, entries_per_project: int = 10, max_projects: int = 1000, max_bytes: int = 32 * 1024 * 1024,
+                 drift_alpha: float = 0.33):
+        self.entries_per_project = entries_per_project
+        self.max_projects = max_projects
+        self.max_bytes = max_bytes
+        self.drift_alpha = drift_alpha
+        self._projects: "OrderedDict[str, Deque[HistoryEntry]]" = OrderedDict()
+        # Per project: EWMA of the similarity between consecutive stored prompts (topic drift = 1 - value)
+        self._pair_similarity: Dict[str, float] = {}
+        self._bytes = 0
+        self._evictions = 0
+        self._lock = threading.Lock()
+    
+    def record(self, project_id: str, prompt_text: Optional[str], timestamp: datetime,
+               prompt_tokens: int = 0, completion_tokens: int = 0, pair_similarity: Optional[float] = None):
+        """
+        Append a stored request to its project's history.
+        pair_similarity is the prompt's similarity to the previous one, computed during
+        analysis; it is folded into the project's running topic-drift average.
+        """
+        entry = HistoryEntry(project_id, prompt_text, timestamp, prompt_tokens, completion_tokens)
+        with self._lock:
+            if pair_similarity is not None:
+                self._pair_similarity[project_id] = self.blend_pair_similarity(
+                    self._pair_similarity.get(project_id), pair_similarity
+                )
+            history = self._projects.get(project_id)
+            if history is None:
+                history = self._projects[project_id] = deque()
+            else:
+                self._projects.move_to_end(project_id)
+            # Keep entries ordered by timestamp even if records arrive slightly out of order
+            if history and entry.timestamp < history[-1].timestamp:
+                items = sorted(list(history) + [entry], key=lambda e: e.timestamp)
+                history.clear()
+                history.extend(items)
+            else:
+                history.append(entry)
+            self._bytes += entry.size_bytes()
+            while len(history) > self.entries_per_project:
+                self._bytes -= history.popleft().size_bytes()
+            self._evict()
+    
+    def _evict(self):
+        while self._projects and (len(self._projects) > self.max_projects or self._bytes > self.max_bytes):
+            if len(self._projects) == 1:
+                break  # Never evict the project that was just written
+            project_id, history = self._projects.popitem(last=False)
+            self._pair_similarity.pop(project_id, None)
+            self._bytes -= sum(entry.size_bytes() for entry in history)
+            self._evictions += 1
+    
+    def get_recent(self, project_id: str, limit: int = 5) -> List[HistoryEntry]:
+        """Most recent entries for a project, newest first"""
+        with self._lock:
+            history = self._projects.get(project_id)
+            if not history:
+                return []
+            self._projects.move_to_end(project_id)
+            recent = list(history)[-limit:] if limit else list(history)
+        recent.reverse()
+        return recent
+    
+    def blend_pair_similarity(self, running: Optional[float], pair_similarity: float) -> float:
+        """Running average updated with one new consecutive-prompt similarity"""
+        if running is None:
+            return pair_similarity
+        return self.drift_alpha * pair_similarity + (1 - self.drift_alpha) * running
+    
+    def get_pair_similarity(self, project_id: str) -> Optional[float]:
+        """Running average similarity of consecutive prompts, None until one pair was recorded"""
+        with self._lock:
+            return self._pair_similarity.get(project_id)
+    
+    def seed_pair_similarity(self, project_id: str, value: float):
+        """Set the running average if the project has none yet (e.g. after a restart)"""
+        with self._lock:
+            if project_id in self._projects:
+                self._pair_similarity.setdefault(project_id, value)
+    
+    def forget(self, project_id: str):
+        with self._lock:
+            self._pair_similarity.pop(project_id, None)
+            history = self._projects.pop(project_id, None)
+            if history:
+                self._bytes -= sum(entry.size_bytes() for entry in history)
+    
+    def clear(self):
+        with self._lock:
+            self._projects.clear()
+            self._pair_similarity.clear()
+            self._bytes = 0
+    
+    def get_stats(self) -> Dict:
+        with self._lock:
+            return {
+                "projects": len(self._projects),
+                "entries": sum(len(history) for history in self._projects.values()),
+                "bytes": self._bytes,
+                "evictions": self._evictions
+            }
+    
+    def seed_from_db(self):
+        """Load each project's most recent requests from the database"""
+        from sqlalchemy import func
+        from .models import SessionLocal, Request
+        
+        db = SessionLocal()
+        try:
+            row_number = func.row_number().over(
+                partition_by=Request.project_id,
+                order_by=Request.timestamp.desc()
+            ).label("rn")
+            ranked = db.query(
+                Request.project_id,
+                Request.prompt_text,
+                Request.timestamp,
+                Request.prompt_tokens,
+                Request.completion_tokens,
+                row_number
+            ).subquery()
+            rows = db.query(ranked).filter(ranked.c.rn <= self.entries_per_project).order_by(ranked.c.timestamp).all()
+        except Exception as e:
+            print(f"[History] Could not seed from database: {str(e)}")
+            rows = []
+        finally:
+            db.close()
+        
+        self.clear()
+        for row in rows:
+            if row.timestamp is not None:
+                self.record(row.project_id, row.prompt_text, row.timestamp, row.prompt_tokens, row.completion_tokens)
+        print(f"[History] Seeded {len(rows)} recent requests")
+
+
+# Global per-project history used by the analyzer
+project_history = ProjectHistoryCache(
+    entries_per_project=settings.analyzer.history_size,
+    max_projects=settings.analyzer.history_max_projects,
+    max_bytes=settings.analyzer.history_max_bytes,
+    drift_alpha=settings.analyzer.topic_drift_alpha
+)
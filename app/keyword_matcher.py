@@ -0,0 +1,79 @@
+"""
+Multi-pattern keyword matching for the analyzer.
+All keyword lists (emotion, task type, debug checks, configured pattern_keywords)
+are compiled into one matcher that reports every group hit for a text in one call.
+
+Implementation note: a pure-Python Aho-Corasick automaton steps through the text
+one character at a time in the interpreter, and a single regex alternation
+(?=(kw1|kw2|...)) tries every alternative at every position; both measured 4-5x
+slower than CPython's C substring search on 20k-character prompts. The matcher
+therefore keeps the single compiled structure but searches each distinct keyword
+once with `in`, shortest first, and skips any keyword containing a shorter keyword
+that was not found.
+"""
+from typing import Dict, FrozenSet, Iterable, List, Sequence
+
+
+class KeywordHits:
+    """Keywords found in one text, queried per group"""
+
+    __slots__ = ("found", "_groups")
+
+    def __init__(self, found: FrozenSet[str], groups: Dict[str, List[str]]):
+        self.found = found
+        self._groups = groups
+
+    def count(self, group: str) -> int:
+        """Number of the group's keyword entries present (duplicate entries count twice, like the list scans)"""
+        return sum(1 for keyword in self._groups.get(group, ()) if keyword in self.found)
+
+    def any(self, group: str) -> bool:
+        return any(keyword in self.found for keyword in self._groups.get(group, ()))
+
+    def keywords(self, group: str) -> FrozenSet[str]:
+        return frozenset(keyword for keyword in self._groups.get(group, ()) if keyword in self.found)
+
+    def groups(self, prefix: str = "") -> List[str]:
+        """Names of groups with at least one hit"""
+        return [name for name in self._groups if name.startswith(prefix) and self.any(name)]
+
+
+class KeywordMatcher:
+    """Matches named keyword groups (case-insensitive substring semantics) against a text"""
+
+    def __init__(self, groups: Dict[str, Sequence[str]]):
+        self._groups: Dict[str, List[str]] = {
+            name: [keyword.lower() for keyword in keywords if keyword]
+            for name, keywords in groups.items()
+        }
+        distinct = sorted({keyword for keywords in self._groups.values() for keyword in keywords}, key=len)
+        # For each keyword, the shorter keywords it contains: if one is absent, so is this keyword
+        self._plan = []
+        for i, keyword in enumerate(distinct):
+            contained = tuple(shorter for shorter in distinct[:i] if len(shorter) < len(keyword) and shorter in keyword)
+            self._plan.append((keyword, contained))
+
+    @property
+    def groups(self) -> Dict[str, List[str]]:
+        return self._groups
+
+    def match(self, text: str, lowered: bool = False) -> KeywordHits:
+        """All keywords present in text; pass lowered=True if text is already lowercase"""
+        text_lower = text if lowered else text.lower()
+        found = set()
+        for keyword, contained in self._plan:
+            # Shorter keywords are decided first, so a missing one rules this keyword out
+            if contained and not found.issuperset(contained):
+                continue
+            if keyword in text_lower:
+                found.add(keyword)
+        return KeywordHits(frozenset(found), self._groups)
+
+
+def build_matcher(*group_sets: Dict[str, Iterable[str]]) -> KeywordMatcher:
+    """Merge several {group: keywords} mappings into one matcher"""
+    groups: Dict[str, List[str]] = {}
+    for group_set in group_sets:
+        for name, keywords in group_set.items():
+            groups.setdefault(name, []).extend(keywords)
+    return KeywordMatcher(groups)
@@ -1,10 +1,17 @@
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 import asyncio
 from .models import init_db
-from .proxy import proxy_request
+from .proxy import proxy_request, stream_proxy_request, start_upstream_clients, close_upstream_clients
 from .analyzer import analyze_behavior
+from .analysis_pool import shutdown_analysis_pool
+from .spend_tracker import spend_tracker
+from .write_queue import request_write_queue
+from .history import project_history
+from .near_duplicates import near_duplicate_index
+from .worker_sync import request_log_follower
+from .analyzer import efficiency_cache
 from .advisor import generate_message
 from .config import settings
 
@@ -23,11 +30,36 @@ app.add_middleware(
 @app.on_event("startup")
 async def startup_event():
     init_db()
+    spend_tracker.seed_from_db()
+    spend_tracker.start_sync()
+    project_history.seed_from_db()
+    near_duplicate_index.seed_from_db()
+    # From here on, requests stored by other workers are read from the table as they arrive
+    request_log_follower.start()
+    if settings.database.write_behind:
+        request_write_queue.start()
+    efficiency_cache.start_sweeper()
+    await start_upstream_clients()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await close_upstream_clients()
+    shutdown_analysis_pool()
+    efficiency_cache.stop_sweeper()
+    spend_tracker.stop_sync()
+    # Drain queued request records before the process exits
+    request_write_queue.stop()
 
 # Import routes after initialization to avoid circular imports
-from .routes import router
+from .routes import router, sync_system_settings
 app.include_router(router)
 
+@app.middleware("http")
+async def sync_shared_settings(request: Request, call_next):
+    """Apply settings changed by other workers (throttled to one shared-state read per interval)"""
+    sync_system_settings()
+    return await call_next(request)
+
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
@@ -46,7 +78,17 @@ async def chat_proxy(request: Request):
     
     # Call proxy function
     try:
-        response_data, status_code = await proxy_request(body, dict(request.headers), provider)
+        if body.get("stream"):
+            # Forward SSE chunks as they arrive; accounting happens after the stream ends
+            response_data, status_code = await stream_proxy_request(body, dict(request.headers), provider)
+            if status_code == 200:
+                return StreamingResponse(
+                    response_data.iter_chunks(),
+                    media_type="text/event-stream",
+                    headers=response_data.headers
+                )
+        else:
+            response_data, status_code = await proxy_request(body, dict(request.headers), provider)
         
         # Handle rate limiting (429) and error responses
         if status_code == 429:
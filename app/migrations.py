@@ -0,0 +1,82 @@
+"""
+Schema migrations for existing databases.
+Base.metadata.create_all only creates missing tables, so changes to existing
+tables (new indexes, columns) are listed here and applied once, in order,
+by init_db. Applied versions are recorded in the schema_migrations table.
+"""
+from datetime import datetime
+from typing import Callable, List, Tuple
+from sqlalchemy.engine import Connection, Engine
+from .models import Base, Request, SchemaMigration
+
+
+def _create_indexes(conn: Connection, table, names: List[str]):
+    for index in table.indexes:
+        if index.name in names:
+            index.create(conn, checkfirst=True)
+    if conn.dialect.name == "sqlite":
+        # Refresh planner statistics so the new indexes are actually chosen
+        conn.exec_driver_sql(f"ANALYZE {table.name}")
+
+
+def add_request_composite_indexes(conn: Connection):
+    """(project_id, timestamp) and (timestamp, advisor_level) covering indexes on requests"""
+    _create_indexes(conn, Request.__table__, [
+        "ix_requests_project_timestamp_cost",
+        "ix_requests_timestamp_level_cost",
+    ])
+
+
+def rebuild_request_rollups(conn: Connection):
+    """Backfill the hourly/daily rollup tables from existing requests"""
+    from .rollups import rebuild_rollups
+    count = rebuild_rollups(conn)
+    print(f"[Migrations] Folded {count} existing requests into rollups")
+
+
+# (version, name, migration) - append new migrations with the next version number
+MIGRATIONS: List[Tuple[int, str, Callable[[Connection], None]]] = [
+    (1, "add_request_composite_indexes", add_request_composite_indexes),
+    (2, "rebuild_request_rollups", rebuild_request_rollups),
+]
+
+
+# Arbitrary application-wide key for the PostgreSQL advisory lock
+MIGRATION_LOCK_ID = 7310294
+
+
+def _lock_migrations(conn: Connection):
+    """
+    Serialize concurrent runs (every server worker calls init_db at startup):
+    the first worker to get the lock applies the migrations, the others wait
+    for it and then find nothing left to do.
+    """
+    if conn.dialect.name == "sqlite":
+        dbapi_connection = conn.connection.dbapi_connection
+        # The production writer already opened the transaction with BEGIN IMMEDIATE
+        if not dbapi_connection.in_transaction:
+            conn.exec_driver_sql("BEGIN IMMEDIATE")
+    elif conn.dialect.name == "postgresql":
+        # Transaction-scoped advisory lock; works before any table exists
+        conn.exec_driver_sql(f"SELECT pg_advisory_xact_lock({MIGRATION_LOCK_ID})")
+
+
+def run_migrations(engine: Engine):
+    """Create missing tables, then apply every migration not yet recorded in schema_migrations"""
+    # Lock, create tables, re-read the applied versions and apply the rest in one
+    # transaction, so a migration and its bookkeeping row always commit together
+    with engine.begin() as conn:
+        _lock_migrations(conn)
+        Base.metadata.create_all(bind=conn)
+        applied = {row[0] for row in conn.execute(SchemaMigration.__table__.select().with_only_columns(SchemaMigration.version))}
+        
+        for version, name, migration in MIGRATIONS:
+            if version in applied:
+                continue
+            migration(conn)
+            conn.execute(SchemaMigration.__table__.insert().values(
+                version=version,
+                name=name,
+                applied_at=datetime.utcnow()
+            ))
+            print(f"[Migrations] Applied {version}: {name}")
@@ -1,7 +1,10 @@
-from sqlalchemy import create_engine, Column, String, Integer, Float, DateTime
+from sqlalchemy import create_engine, event, Column, String, Integer, Float, DateTime, Index
+from sqlalchemy.engine import Engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from datetime import datetime
+from typing import Tuple
+from .config import settings
 import os
 
 Base = declarative_base()
@@ -23,6 +26,14 @@ class Request(Base):
     prompt_text = Column(String)  # Added to store the prompt for similarity analysis (when privacy allows)
     progress_indicator = Column(String)  # "stuck", "exploring", "refining", "resolved"
     token_efficiency = Column(Float)  # output_tokens / input_tokens
+    
+    __table_args__ = (
+        # Project + time range filters (hourly spend, project stats, history);
+        # total_cost_usd is included so cost sums are answered from the index alone
+        Index("ix_requests_project_timestamp_cost", "project_id", "timestamp", "total_cost_usd"),
+        # Time range + warning level filters across all projects (dashboard, warnings)
+        Index("ix_requests_timestamp_level_cost", "timestamp", "advisor_level", "total_cost_usd"),
+    )
 
 # Feedback table for user feedback
 class Feedback(Base):
@@ -35,21 +46,152 @@ class Feedback(Base):
     project_id = Column(String, index=True)  # Project this feedback belongs to
     message = Column(String)  # Optional user message about the feedback
 
+# Pre-aggregated request counters per (time bucket, project, model), maintained on insert.
+# See rollups.py for maintenance and querying.
+class RollupColumns:
+    bucket_start = Column(DateTime, primary_key=True)
+    project_id = Column(String, primary_key=True)
+    model = Column(String, primary_key=True)
+    request_count = Column(Integer, default=0)
+    prompt_tokens = Column(Integer, default=0)
+    completion_tokens = Column(Integer, default=0)
+    total_cost_usd = Column(Float, default=0.0)
+    # Histogram of advisor levels (level_4 also counts anything above 4)
+    level_0 = Column(Integer, default=0)
+    level_1 = Column(Integer, default=0)
+    level_2 = Column(Integer, default=0)
+    level_3 = Column(Integer, default=0)
+    level_4 = Column(Integer, default=0)
+    # Counts per progress indicator
+    progress_stuck = Column(Integer, default=0)
+    progress_exploring = Column(Integer, default=0)
+    progress_refining = Column(Integer, default=0)
+    progress_resolved = Column(Integer, default=0)
+    progress_other = Column(Integer, default=0)
+    # Pattern-based usage categories used by project stats
+    debug_pattern_count = Column(Integer, default=0)  # pattern_score >= 3
+    development_pattern_count = Column(Integer, default=0)  # pattern_score nonzero and < 3, similarity < 0.5
+    last_request_at = Column(DateTime)
+
+class RequestRollupHourly(RollupColumns, Base):
+    __tablename__ = "request_rollups_hourly"
+    __table_args__ = (
+        Index("ix_request_rollups_hourly_project_bucket", "project_id", "bucket_start"),
+    )
+
+class RequestRollupDaily(RollupColumns, Base):
+    __tablename__ = "request_rollups_daily"
+    __table_args__ = (
+        Index("ix_request_rollups_daily_project_bucket", "project_id", "bucket_start"),
+    )
+
+# Applied schema migrations (see migrations.py)
+class SchemaMigration(Base):
+    __tablename__ = "schema_migrations"
+    
+    version = Column(Integer, primary_key=True)
+    name = Column(String)
+    applied_at = Column(DateTime, default=datetime.utcnow)
+
 # Database setup
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./data/watchdog.db")
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False} if "sqlite" in DATABASE_URL else {})
+
+
+def _apply_sqlite_pragmas(dbapi_connection, connection_record):
+    """Tune every new SQLite connection for the production profile"""
+    db_config = settings.database
+    cursor = dbapi_connection.cursor()
+    try:
+        cursor.execute(f"PRAGMA journal_mode={db_config.sqlite_journal_mode}")
+        cursor.execute(f"PRAGMA synchronous={db_config.sqlite_synchronous}")
+        cursor.execute(f"PRAGMA busy_timeout={int(db_config.sqlite_busy_timeout_ms)}")
+        cursor.execute(f"PRAGMA mmap_size={int(db_config.sqlite_mmap_size)}")
+        cursor.execute(f"PRAGMA cache_size={int(db_config.sqlite_cache_size)}")
+        cursor.execute(f"PRAGMA temp_store={db_config.sqlite_temp_store}")
+    finally:
+        cursor.close()
+
+
+def _use_autocommit_driver(dbapi_connection, connection_record):
+    # Let SQLAlchemy emit BEGIN itself instead of pysqlite's deferred BEGIN
+    dbapi_connection.isolation_level = None
+
+
+def _begin_immediate(conn):
+    # Take the write lock up front so a writer waits on busy_timeout instead of
+    # failing when it upgrades a read transaction
+    conn.exec_driver_sql("BEGIN IMMEDIATE")
+
+
+def create_engines(database_url: str, profile: str = "default") -> Tuple[Engine, Engine]:
+    """
+    Create the (reader, writer) engine pair for a database URL.
+    The SQLite "production" profile tunes connections with PRAGMAs (WAL, synchronous,
+    mmap, cache, busy timeout, temp store) and pairs a pool of reader connections with
+    a single writer connection; otherwise one engine serves both roles.
+    """
+    if "sqlite" not in database_url:
+        engine = create_engine(database_url)
+        return engine, engine
+    
+    is_file_db = ":memory:" not in database_url and database_url.rstrip("/") != "sqlite:"
+    if profile != "production" or not is_file_db:
+        engine = create_engine(database_url, connect_args={"check_same_thread": False})
+        return engine, engine
+    
+    connect_args = {
+        "check_same_thread": False,
+        "timeout": settings.database.sqlite_busy_timeout_ms / 1000
+    }
+    # WAL lets readers run alongside the writer, so readers get a real pool
+    reader = create_engine(
+        database_url,
+        connect_args=connect_args,
+        pool_size=settings.database.sqlite_reader_pool_size,
+        max_overflow=settings.database.sqlite_reader_pool_size
+    )
+    # SQLite allows one writer at a time; a single pooled connection serializes
+    # this process's writes instead of having them contend for the lock
+    writer = create_engine(
+        database_url,
+        connect_args=connect_args,
+        pool_size=1,
+        max_overflow=0,
+        pool_timeout=60
+    )
+    event.listen(reader, "connect", _apply_sqlite_pragmas)
+    event.listen(writer, "connect", _apply_sqlite_pragmas)
+    event.listen(writer, "connect", _use_autocommit_driver)
+    event.listen(writer, "begin", _begin_immediate)
+    return reader, writer
+
+
+engine, write_engine = create_engines(DATABASE_URL, settings.database.sqlite_profile)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# Sessions for writes (write-behind queue, migrations, write endpoints)
+WriteSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=write_engine)
 
 def init_db():
     """Initialize the database and create tables"""
     # Create data directory if it doesn't exist
     os.makedirs("data", exist_ok=True)
-    # Create all tables with the new schema (without dropping existing data)
-    Base.metadata.create_all(bind=engine)
+    # Create all tables with the new schema (without dropping existing data);
+    # create_all never alters existing tables, so schema changes are applied as migrations.
+    # Both run under one lock, since every server worker calls this at startup
+    from .migrations import run_migrations
+    run_migrations(write_engine)
 
 def get_db():
     """Dependency for getting DB session"""
     db = SessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+def get_write_db():
+    """Dependency for endpoints that write: a session on the single writer connection"""
+    db = WriteSessionLocal()
     try:
         yield db
     finally:
@@ -0,0 +1,314 @@
+"""
+Per-project locality-sensitive hashing index over recent prompts.
+Answers "how many near-duplicates of this prompt did the project send in the
+last N hours" without scoring the prompt against every stored request:
+  - raw prompts get a one-permutation MinHash signature over character shingles,
+    split into bands; prompts sharing any band are candidates and are confirmed
+    with the Jaccard estimate from their signatures
+  - privacy-mode fingerprints (64-bit simhash hex) are split into bit bands; two
+    fingerprints within fewer differing bits than there are bands share at least
+    one band, and candidates are confirmed by Hamming distance
+Filled when requests are stored, like the request history.
+"""
+import operator
+import re
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Set, Tuple
+from .config import settings
+
+_SIMHASH_RE = re.compile(r"[0-9a-f]{16}")
+_MASK64 = 0xFFFFFFFFFFFFFFFF
+_EMPTY_BIN = _MASK64  # Larger than any bin value (values use at most 58 bits)
+
+
+def minhash_signature(text: str, num_bins: int, shingle_size: int) -> Tuple[int, ...]:
+    """
+    One-permutation MinHash: each shingle hash goes to one of num_bins bins and
+    every bin keeps its minimum, so the signature costs one pass over the text.
+    Empty bins borrow the next non-empty bin's value (rotation densification),
+    keeping short texts comparable.
+    """
+    text = text.lower()
+    shingles = {text[i:i + shingle_size] for i in range(max(1, len(text) - shingle_size + 1))}
+    bins = [_EMPTY_BIN] * num_bins
+    for shingle in shingles:
+        h = hash(shingle) & _MASK64
+        index = h % num_bins
+        value = h // num_bins
+        if value < bins[index]:
+            bins[index] = value
+
+    filled = [i for i, value in enumerate(bins) if value != _EMPTY_BIN]
+    if not filled or len(filled) == num_bins:
+        return tuple(bins)
+    signature = list(bins)
+    for i in range(num_bins):
+        if bins[i] == _EMPTY_BIN:
+            # Nearest filled bin to the right (wrapping), offset so borrowed values differ per bin
+            j = next((k for k in filled if k > i), filled[0])
+            distance = (j - i) % num_bins
+            signature[i] = bins[j] + distance * (1 << 58)
+    return tuple(signature)
+
+
+def signature_similarity(sig_a: Tuple[int, ...], sig_b: Tuple[int, ...]) -> float:
+    """Estimated Jaccard similarity: fraction of bins with equal values"""
+    if not sig_a or len(sig_a) != len(sig_b):
+        return 0.0
+    if sig_a == sig_b:
+        return 1.0
+    return sum(map(operator.eq, sig_a, sig_b)) / len(sig_a)
+
+
+def simhash_bands(fingerprint: int, bands: int, bits: int = 64) -> List[int]:
+    """Split a fingerprint into `bands` contiguous bit ranges"""
+    keys = []
+    start = 0
+    for band in range(bands):
+        width = bits // bands + (1 if band < bits % bands else 0)
+        keys.append((fingerprint >> start) & ((1 << width) - 1))
+        start += width
+    return keys
+
+
+_ENTRY_OVERHEAD_BYTES = 200  # Rough per-entry overhead (object, ordered dict slot)
+_KEY_BYTES = 150  # Band key tuple plus its bucket set slot
+_BIN_BYTES = 40  # One signature value
+
+
+class _Entry:
+    __slots__ = ("timestamp", "kind", "signature", "keys")
+
+    def __init__(self, timestamp: datetime, kind: str, signature, keys: List[tuple]):
+        self.timestamp = timestamp
+        self.kind = kind  # "minhash" or "simhash"
+        self.signature = signature
+        self.keys = keys
+
+    def size_bytes(self) -> int:
+        """Rough memory footprint, used for the index's size cap"""
+        bins = len(self.signature) if self.kind == "minhash" else 1
+        return _ENTRY_OVERHEAD_BYTES + _KEY_BYTES * len(self.keys) + _BIN_BYTES * bins
+
+
+class _ProjectIndex:
+    """Entries of one project (oldest first) and the band buckets pointing at them"""
+
+    __slots__ = ("entries", "buckets", "next_id", "kinds", "bytes")
+
+    def __init__(self):
+        self.entries: "OrderedDict[int, _Entry]" = OrderedDict()
+        self.buckets: Dict[tuple, Set[int]] = {}
+        self.next_id = 0
+        self.kinds: Dict[str, int] = {"minhash": 0, "simhash": 0}
+        self.bytes = 0
+
+    def add(self, entry: _Entry):
+        entry_id = self.next_id
+        self.next_id += 1
+        self.entries[entry_id] = entry
+        self.kinds[entry.kind] += 1
+        self.bytes += entry.size_bytes()
+        for key in entry.keys:
+            self.buckets.setdefault(key, set()).add(entry_id)
+
+    def pop_oldest(self):
+        entry_id, entry = self.entries.popitem(last=False)
+        self.kinds[entry.kind] -= 1
+        self.bytes -= entry.size_bytes()
+        for key in entry.keys:
+            bucket = self.buckets.get(key)
+            if bucket is not None:
+                bucket.discard(entry_id)
+                if not bucket:
+                    del self.buckets[key]
+
+
+class NearDuplicateIndex:
+    """
+    LSH index of each project's prompts from the last window_hours,
+    with LRU eviction over projects once the project count or the memory cap is exceeded
+    """
+
+    def __init__(self, window_hours: float = 24, max_entries_per_project: int = 2000, max_projects: int = 1000,
+                 minhash_bands: int = 16, minhash_rows: int = 4, simhash_bands: int = 8,
+                 jaccard_threshold: float = 0.7, simhash_threshold: float = 0.89, max_bytes: int = 64 * 1024 * 1024):
+        self.window_hours = window_hours
+        self.max_entries_per_project = max_entries_per_project
+        self.max_projects = max_projects
+        self.max_bytes = max_bytes
+        self.minhash_bands = minhash_bands
+        self.minhash_rows = minhash_rows
+        self.simhash_bands = simhash_bands
+        self.jaccard_threshold = jaccard_threshold
+        self.simhash_threshold = simhash_threshold
+        self._projects: "OrderedDict[str, _ProjectIndex]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._bytes = 0
+        self._evictions = 0
+        self._queries = 0
+        self._candidates = 0
+
+    def _minhash(self, text: str) -> Tuple[Tuple[int, ...], List[tuple]]:
+        from .analyzer import get_text_features
+        rows = self.minhash_rows
+        # Cached on the text's memoized features: count() and add() of a request share one signature
+        signature = get_text_features(text).minhash_signature(self.minhash_bands * rows,
+                                                              settings.analyzer.minhash_shingle_size)
+        keys = [("m", band, signature[band * rows:(band + 1) * rows]) for band in range(self.minhash_bands)]
+        return signature, keys
+
+    def _simhash(self, fingerprint: int) -> List[tuple]:
+        return [("s", band, value) for band, value in enumerate(simhash_bands(fingerprint, self.simhash_bands))]
+
+    def _expire(self, index: _ProjectIndex, now: datetime):
+        cutoff = now - timedelta(hours=self.window_hours)
+        before = index.bytes
+        while index.entries and (
+            len(index.entries) > self.max_entries_per_project
+            or next(iter(index.entries.values())).timestamp < cutoff
+        ):
+            index.pop_oldest()
+        self._bytes -= before - index.bytes
+
+    def _evict(self):
+        while len(self._projects) > 1 and (len(self._projects) > self.max_projects or self._bytes > self.max_bytes):
+            # Never evicts the project that was just written
+            _, index = self._projects.popitem(last=False)
+            self._bytes -= index.bytes
+            self._evictions += 1
+
+    def add(self, project_id: str, prompt_text: Optional[str], timestamp: datetime, now: Optional[datetime] = None):
+        """Index a stored prompt (raw text or simhash fingerprint); now defaults to the current time"""
+        if not prompt_text:
+            return
+        stored = prompt_text.strip().lower()
+        if _SIMHASH_RE.fullmatch(stored):
+            fingerprint = int(stored, 16)
+            entry = _Entry(timestamp, "simhash", fingerprint, self._simhash(fingerprint))
+        else:
+            signature, keys = self._minhash(prompt_text)
+            entry = _Entry(timestamp, "minhash", signature, keys)
+
+        with self._lock:
+            index = self._projects.get(project_id)
+            if index is None:
+                index = self._projects[project_id] = _ProjectIndex()
+            else:
+                self._projects.move_to_end(project_id)
+            index.add(entry)
+            self._bytes += entry.size_bytes()
+            self._expire(index, now or max(timestamp, datetime.utcnow()))
+            self._evict()
+
+    def count(self, project_id: str, text: str, hours: Optional[float] = None, now: Optional[datetime] = None) -> int:
+        """Number of the project's prompts from the last `hours` that are near-duplicates of text"""
+        if not text:
+            return 0
+        now = now or datetime.utcnow()
+        since = now - timedelta(hours=hours if hours is not None else self.window_hours)
+
+        with self._lock:
+            index = self._projects.get(project_id)
+            if index is None:
+                return 0
+            self._expire(index, now)
+            has_minhash = index.kinds["minhash"] > 0
+            has_simhash = index.kinds["simhash"] > 0
+
+        # Signatures of the query are computed outside the lock
+        signature = fingerprint = None
+        keys: List[tuple] = []
+        if has_minhash:
+            signature, minhash_keys = self._minhash(text)
+            keys.extend(minhash_keys)
+        if has_simhash:
+            from .analyzer import compute_simhash_hex
+            query = text.strip().lower()
+            fingerprint = int(query if _SIMHASH_RE.fullmatch(query) else compute_simhash_hex(text), 16)
+            keys.extend(self._simhash(fingerprint))
+
+        with self._lock:
+            index = self._projects.get(project_id)
+            if index is None:
+                return 0
+            candidate_ids: Set[int] = set()
+            for key in keys:
+                bucket = index.buckets.get(key)
+                if bucket:
+                    candidate_ids.update(bucket)
+            candidates = [index.entries[i] for i in candidate_ids if i in index.entries]
+            self._queries += 1
+            self._candidates += len(candidates)
+
+        count = 0
+        for entry in candidates:
+            if entry.timestamp < since:
+                continue
+            if entry.kind == "minhash":
+                if signature_similarity(signature, entry.signature) >= self.jaccard_threshold:
+                    count += 1
+            elif 1 - (entry.signature ^ fingerprint).bit_count() / 64 >= self.simhash_threshold:
+                count += 1
+        return count
+
+    def forget(self, project_id: str):
+        with self._lock:
+            index = self._projects.pop(project_id, None)
+            if index is not None:
+                self._bytes -= index.bytes
+
+    def clear(self):
+        with self._lock:
+            self._projects.clear()
+            self._bytes = 0
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            return {
+                "projects": len(self._projects),
+                "entries": sum(len(index.entries) for index in self._projects.values()),
+                "buckets": sum(len(index.buckets) for index in self._projects.values()),
+                "bytes": self._bytes,
+                "evictions": self._evictions,
+                "queries": self._queries,
+                "avg_candidates": self._candidates / self._queries if self._queries else 0.0
+            }
+
+    def seed_from_db(self):
+        """Index the prompts stored within the window"""
+        from .models import SessionLocal, Request
+
+        db = SessionLocal()
+        try:
+            cutoff = datetime.utcnow() - timedelta(hours=self.window_hours)
+            rows = db.query(Request.project_id, Request.prompt_text, Request.timestamp).filter(
+                Request.timestamp >= cutoff,
+                Request.prompt_text.isnot(None)
+            ).order_by(Request.timestamp).all()
+        except Exception as e:
+            print(f"[NearDuplicates] Could not seed from database: {str(e)}")
+            rows = []
+        finally:
+            db.close()
+
+        self.clear()
+        for row in rows:
+            self.add(row.project_id, row.prompt_text, row.timestamp)
+        print(f"[NearDuplicates] Indexed {len(rows)} recent prompts")
+
+
+# Global per-project near-duplicate index used by the analyzer
+near_duplicate_index = NearDuplicateIndex(
+    window_hours=settings.analyzer.near_duplicate_window_hours,
+    max_entries_per_project=settings.analyzer.near_duplicate_max_entries,
+    max_projects=settings.analyzer.history_max_projects,
+    minhash_bands=settings.analyzer.near_duplicate_minhash_bands,
+    minhash_rows=settings.analyzer.near_duplicate_minhash_rows,
+    simhash_bands=settings.analyzer.near_duplicate_simhash_bands,
+    jaccard_threshold=settings.analyzer.near_duplicate_jaccard_threshold,
+    simhash_threshold=settings.analyzer.near_duplicate_simhash_threshold,
+    max_bytes=settings.analyzer.near_duplicate_max_bytes
+)
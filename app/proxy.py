@@ -1,183 +1,309 @@
 import httpx
 import asyncio
-from typing import Dict, Any, AsyncGenerator, List
+from typing import Dict, Any, AsyncGenerator, List, Optional
 from .config import settings
-from .models import Request, get_db
-from sqlalchemy.orm import Session
+from .models import Request
 import json
 import uuid
 from datetime import datetime, timedelta
-from .analyzer import analyze_behavior
+from .analysis_pool import run_analysis
+from .spend_tracker import spend_tracker
+from .write_queue import request_write_queue
+from .history import project_history
+from .near_duplicates import near_duplicate_index
+from .worker_sync import request_log_follower
 from .advisor import generate_message
 
-async def proxy_request(request_body: Dict[str, Any], headers: Dict[str, str], provider: str = "openai"):
+# Long-lived upstream clients, one per provider, so keep-alive connections
+# (and their TLS sessions) are reused across proxied requests.
+_upstream_clients: Dict[str, httpx.AsyncClient] = {}
+
+
+def _build_upstream_client(provider: str) -> httpx.AsyncClient:
     """
-    Proxy the request to the upstream API provider and analyze the interaction
+    Create a pooled AsyncClient using the provider's pool settings
+    """
+    pool_config = settings.upstream.pools.get(provider)
+    if pool_config is None:
+        pool_config = settings.upstream.pools.get("openai")
+
+    http2 = bool(pool_config.http2)
+    if http2:
+        try:
+            import h2  # noqa: F401
+        except ImportError:
+            print(f"[Upstream] HTTP/2 requested for {provider} but 'h2' is not installed, falling back to HTTP/1.1")
+            http2 = False
+
+    return httpx.AsyncClient(
+        timeout=pool_config.timeout,
+        http2=http2,
+        limits=httpx.Limits(
+            max_connections=pool_config.max_connections,
+            max_keepalive_connections=pool_config.max_keepalive_connections,
+            keepalive_expiry=pool_config.keepalive_expiry,
+        ),
+    )
+
+
+async def start_upstream_clients():
+    """
+    Create the shared upstream clients (called on app startup)
+    """
+    for provider in ("openai", "anthropic", "openrouter"):
+        if provider not in _upstream_clients:
+            _upstream_clients[provider] = _build_upstream_client(provider)
+
+
+async def close_upstream_clients():
+    """
+    Close the shared upstream clients (called on app shutdown)
+    """
+    clients = list(_upstream_clients.values())
+    _upstream_clients.clear()
+    for client in clients:
+        await client.aclose()
+
+
+def get_upstream_client(provider: str) -> httpx.AsyncClient:
+    """
+    Get the shared client for a provider, creating it lazily if startup has not run
+    (e.g. when proxy_request is called from scripts or tests)
+    """
+    client = _upstream_clients.get(provider)
+    if client is None or client.is_closed:
+        client = _build_upstream_client(provider)
+        _upstream_clients[provider] = client
+    return client
+
+
+UPSTREAM_PROVIDERS = ("openai", "anthropic", "openrouter")
+
+
+def get_upstream_url(provider: str) -> str:
+    """
+    Resolve the upstream base URL for a provider, defaulting to OpenAI
     """
-    # Determine the upstream URL based on provider
     upstream_urls = {
         "openai": settings.upstream.openai,
         "anthropic": settings.upstream.anthropic,
         "openrouter": settings.upstream.openrouter
     }
+    return upstream_urls.get(provider, upstream_urls["openai"])
+
+
+def build_upstream_headers(headers: Dict[str, str], provider: str) -> Dict[str, str]:
+    """
+    Build the headers forwarded to the upstream API
+    """
+    auth_header = headers.get("Authorization", "")
+    upstream_headers = {
+        "Content-Type": "application/json",
+        "Authorization": auth_header
+    }
     
-    upstream_url = upstream_urls.get(provider, upstream_urls["openai"])
+    # Add provider-specific headers
+    if provider == "anthropic":
+        upstream_headers["x-api-key"] = auth_header.replace("Bearer ", "")
+        upstream_headers["anthropic-version"] = "2023-06-01"
+    
+    return upstream_headers
+
+
+def get_last_user_message(messages: List[Dict[str, Any]]) -> str:
+    """
+    Get the last user message of a conversation
+    """
+    for msg in reversed(messages):
+        if msg.get("role") == "user":
+            return msg.get("content", "")
+    return ""
+
+
+def get_stored_prompt_text(last_user_message: str) -> Optional[str]:
+    """
+    Decide what is stored for the prompt, honoring privacy settings
+    """
+    # If privacy settings restrict storing content, only store metadata
+    if settings.privacy.store_request_content:
+        return last_user_message
+    
+    # If privacy is enabled, store a fingerprint instead of raw content.
+    # "hash" is treated as simhash for similarity detection (backward compatible config).
+    method = (settings.privacy.similarity_method or "hash").lower()
+    if method in ("sha256", "sha-256"):
+        import hashlib
+        return hashlib.sha256(last_user_message.encode()).hexdigest() if last_user_message else None
+    
+    # Default to simhash so analyzer can still detect repeats.
+    from .analyzer import compute_simhash_hex
+    return compute_simhash_hex(last_user_message) if last_user_message else None
+
+
+def get_hourly_cost(project_id: str) -> float:
+    """
+    Total cost of the project's requests in the last hour
+    """
+    return spend_tracker.get_spend(project_id)
+
+
+def build_rate_limit_error(total_hourly_cost: float) -> Dict[str, Any]:
+    """
+    Build the 429 response body for a project over its hourly budget
+    """
+    from .routes import calculate_equivalents
+    
+    cost_cny = total_hourly_cost * settings.pricing.exchange_rate_usd_to_cny
+    equivalents = calculate_equivalents(cost_cny)
+    
+    return {
+        "error": {
+            "message": "检测到情绪化编程，建议休息20分钟",
+            "type": "rate_limit_exceeded",
+            "details": {
+                "cost_usd": round(total_hourly_cost, 2),
+                "cost_cny": round(cost_cny, 2),
+                "equivalents": equivalents,
+                "suggestions": ["去喝杯水", "看看官方文档", "休息一下再继续"]
+            }
+        }
+    }
+
+
+async def proxy_request(request_body: Dict[str, Any], headers: Dict[str, str], provider: str = "openai"):
+    """
+    Proxy the request to the upstream API provider and analyze the interaction
+    """
+    # Determine the upstream URL based on provider
+    upstream_url = get_upstream_url(provider)
     
     # Extract project_id from headers
     project_id = headers.get("X-Project-ID", "default")
     model = request_body.get("model", "gpt-4o")
     
     # Get the last user message for privacy consideration and storage
-    last_user_message = ""
-    for msg in reversed(request_body.get("messages", [])):
-        if msg.get("role") == "user":
-            last_user_message = msg.get("content", "")
-            break
+    last_user_message = get_last_user_message(request_body.get("messages", []))
     
-    # Analyze behavior using advanced multi-dimensional analysis
-    analysis_result = analyze_behavior(project_id, request_body.get("messages", []), model)
-    similarity_score = analysis_result["details"]["similarity"]
-    pattern_score = analysis_result["details"]["emotion_score"]  # Using emotion score as pattern score for now
-    advisor_level = analysis_result["level"]
-    advisor_reasons = analysis_result["reasons"]
-    advisor_details = analysis_result["details"]
+    # Analyze behavior using advanced multi-dimensional analysis (off the event loop).
+    # In concurrent mode the analysis overlaps the upstream call and is only joined
+    # when the response is built, since it just decides the advisor level and headers.
+    messages = request_body.get("messages", [])
+    analysis_task = None
+    if settings.analyzer.execution_mode == "concurrent":
+        analysis_task = asyncio.create_task(run_analysis(project_id, messages, model))
+    else:
+        analysis_result = await run_analysis(project_id, messages, model)
     
-    # Make the actual request to upstream API
-    async with httpx.AsyncClient(timeout=settings.upstream.timeout) as client:
-        try:
-            # Prepare the request to upstream
-            auth_header = headers.get("Authorization", "")
-            upstream_headers = {
-                "Content-Type": "application/json",
-                "Authorization": auth_header
+    # The budget check is the only decision that has to block before the upstream call:
+    # a project already over its hourly budget is refused without paying for another request
+    hourly_cost_before = None
+    if settings.advisor.enable_rate_limit:
+        hourly_cost_before = get_hourly_cost(project_id)
+        if hourly_cost_before > settings.advisor.max_cost_per_hour_usd:
+            if analysis_task is not None:
+                analysis_task.cancel()
+            return build_rate_limit_error(hourly_cost_before), 429
+    
+    # Make the actual request to upstream API over the shared, pooled client
+    client = get_upstream_client(provider if provider in UPSTREAM_PROVIDERS else "openai")
+    try:
+        # Prepare the request to upstream
+        upstream_headers = build_upstream_headers(headers, provider)
+        
+        # Forward the request to upstream API
+        response = await client.post(
+            f"{upstream_url}/v1/chat/completions",
+            headers=upstream_headers,
+            json=request_body
+        )
+        
+        if response.status_code != 200:
+            # Handle upstream errors
+            return {"error": response.json()}, response.status_code
+        
+        # Parse the response
+        response_data = response.json()
+        
+        # Calculate costs based on token usage
+        usage = response_data.get("usage", {})
+        prompt_tokens = usage.get("prompt_tokens", 0)
+        completion_tokens = usage.get("completion_tokens", 0)
+        total_tokens = usage.get("total_tokens", prompt_tokens + completion_tokens)
+        
+        # Calculate cost based on model pricing
+        cost_usd = calculate_cost(model, prompt_tokens, completion_tokens)
+        
+        # Store the request in database with privacy considerations
+        stored_prompt_text = get_stored_prompt_text(last_user_message)
+        
+        # Check for rate limiting based on hourly total cost BEFORE storing this request
+        # This checks the cost BEFORE adding current request, so we need to add current cost
+        if hourly_cost_before is None:
+            hourly_cost_before = get_hourly_cost(project_id)
+        total_hourly_cost = hourly_cost_before + cost_usd
+        
+        # Check if rate limiting should be triggered
+        if settings.advisor.enable_rate_limit and total_hourly_cost > settings.advisor.max_cost_per_hour_usd:
+            # Return 429 rate limit response
+            return build_rate_limit_error(total_hourly_cost), 429
+        
+        # Join the analysis started alongside the upstream call
+        if analysis_task is not None:
+            analysis_result = await analysis_task
+            analysis_task = None
+        similarity_score = analysis_result["details"]["similarity"]
+        pattern_score = analysis_result["details"]["emotion_score"]  # Using emotion score as pattern score for now
+        advisor_level = analysis_result["level"]
+        advisor_details = analysis_result["details"]
+        
+        # Store the request in database
+        store_request_in_db(
+            request_id=str(uuid.uuid4()),
+            timestamp=datetime.utcnow(),
+            project_id=project_id,
+            provider=provider,
+            model=model,
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+            total_cost_usd=cost_usd,
+            similarity_score=similarity_score,
+            pattern_score=pattern_score,
+            prompt_text=stored_prompt_text,
+            progress_indicator=advisor_details.get("progress", "unknown"),
+            token_efficiency=(completion_tokens / prompt_tokens) if prompt_tokens > 0 else 0.0,
+            pair_similarity=advisor_details.get("pair_similarity")
+        )
+        
+        # Update advisor level if needed (but don't trigger rate limit here, already checked above)
+        if total_hourly_cost > settings.advisor.max_cost_per_hour_usd * 0.8:  # 80% threshold warning
+            advisor_level = max(advisor_level, 3)  # Warning level, not rate limit
+        
+        advisor_message = generate_message(advisor_level, cost_usd, similarity_score, model=model)
+        
+        # Add custom headers to response
+        response_data["x_advisor_message"] = advisor_message
+        response_data["x_advisor_level"] = advisor_level
+        response_data["x_total_cost_usd"] = cost_usd
+        response_data["x_total_cost_cny"] = cost_usd * settings.pricing.exchange_rate_usd_to_cny
+        response_data["x_similarity_score"] = similarity_score
+        response_data["x_analysis_details"] = advisor_details  # Include analysis details
+        
+        return response_data, 200
+        
+    except Exception as e:
+        # Log error and return error response
+        print(f"Proxy error: {str(e)}")
+        return {
+            "error": {
+                "message": "Upstream API request failed",
+                "type": "upstream_error",
+                "upstream_status": getattr(e, 'status_code', 500)
             }
-            
-            # Add provider-specific headers
-            if provider == "anthropic":
-                upstream_headers["x-api-key"] = auth_header.replace("Bearer ", "")
-                upstream_headers["anthropic-version"] = "2023-06-01"
-            
-            # Forward the request to upstream API
-            response = await client.post(
-                f"{upstream_url}/v1/chat/completions",
-                headers=upstream_headers,
-                json=request_body
-            )
-            
-            if response.status_code != 200:
-                # Handle upstream errors
-                return {"error": response.json()}, response.status_code
-            
-            # Parse the response
-            response_data = response.json()
-            
-            # Calculate costs based on token usage
-            usage = response_data.get("usage", {})
-            prompt_tokens = usage.get("prompt_tokens", 0)
-            completion_tokens = usage.get("completion_tokens", 0)
-            total_tokens = usage.get("total_tokens", prompt_tokens + completion_tokens)
-            
-            # Calculate cost based on model pricing
-            cost_usd = calculate_cost(model, prompt_tokens, completion_tokens)
-            
-            # Store the request in database with privacy considerations
-            # If privacy settings restrict storing content, only store metadata
-            if settings.privacy.store_request_content:
-                stored_prompt_text = last_user_message
-            else:
-                # If privacy is enabled, store a fingerprint instead of raw content.
-                # "hash" is treated as simhash for similarity detection (backward compatible config).
-                method = (settings.privacy.similarity_method or "hash").lower()
-                if method in ("hash", "simhash"):
-                    from .analyzer import compute_simhash_hex
-                    stored_prompt_text = compute_simhash_hex(last_user_message) if last_user_message else None
-                elif method in ("sha256", "sha-256"):
-                    import hashlib
-                    stored_prompt_text = hashlib.sha256(last_user_message.encode()).hexdigest() if last_user_message else None
-                else:
-                    # Default to simhash so analyzer can still detect repeats.
-                    from .analyzer import compute_simhash_hex
-                    stored_prompt_text = compute_simhash_hex(last_user_message) if last_user_message else None
-            
-            # Check for rate limiting based on hourly total cost BEFORE storing this request
-            # This checks the cost BEFORE adding current request, so we need to add current cost
-            from .routes import calculate_equivalents
-            from .models import SessionLocal
-            
-            # Calculate total cost including current request
-            one_hour_ago = datetime.utcnow() - timedelta(hours=1)
-            db_session = SessionLocal()
-            try:
-                recent_requests = db_session.query(Request).filter(
-                    Request.project_id == project_id,
-                    Request.timestamp > one_hour_ago
-                ).all()
-                total_hourly_cost = sum(req.total_cost_usd for req in recent_requests) + cost_usd
-            finally:
-                db_session.close()
-            
-            # Check if rate limiting should be triggered
-            if settings.advisor.enable_rate_limit and total_hourly_cost > settings.advisor.max_cost_per_hour_usd:
-                # Return 429 rate limit response
-                cost_cny = total_hourly_cost * settings.pricing.exchange_rate_usd_to_cny
-                equivalents = calculate_equivalents(cost_cny)
-                
-                return {
-                    "error": {
-                        "message": "检测到情绪化编程，建议休息20分钟",
-                        "type": "rate_limit_exceeded",
-                        "details": {
-                            "cost_usd": round(total_hourly_cost, 2),
-                            "cost_cny": round(cost_cny, 2),
-                            "equivalents": equivalents,
-                            "suggestions": ["去喝杯水", "看看官方文档", "休息一下再继续"]
-                        }
-                    }
-                }, 429
-            
-            # Store the request in database
-            store_request_in_db(
-                request_id=str(uuid.uuid4()),
-                timestamp=datetime.utcnow(),
-                project_id=project_id,
-                provider=provider,
-                model=model,
-                prompt_tokens=prompt_tokens,
-                completion_tokens=completion_tokens,
-                total_cost_usd=cost_usd,
-                similarity_score=similarity_score,
-                pattern_score=pattern_score,
-                prompt_text=stored_prompt_text,
-                progress_indicator=advisor_details.get("progress", "unknown"),
-                token_efficiency=(completion_tokens / prompt_tokens) if prompt_tokens > 0 else 0.0
-            )
-            
-            # Update advisor level if needed (but don't trigger rate limit here, already checked above)
-            if total_hourly_cost > settings.advisor.max_cost_per_hour_usd * 0.8:  # 80% threshold warning
-                advisor_level = max(advisor_level, 3)  # Warning level, not rate limit
-            
-            advisor_message = generate_message(advisor_level, cost_usd, similarity_score, model=model)
-            
-            # Add custom headers to response
-            response_data["x_advisor_message"] = advisor_message
-            response_data["x_advisor_level"] = advisor_level
-            response_data["x_total_cost_usd"] = cost_usd
-            response_data["x_total_cost_cny"] = cost_usd * settings.pricing.exchange_rate_usd_to_cny
-            response_data["x_similarity_score"] = similarity_score
-            response_data["x_analysis_details"] = advisor_details  # Include analysis details
-            
-            return response_data, 200
-            
-        except Exception as e:
-            # Log error and return error response
-            print(f"Proxy error: {str(e)}")
-            return {
-                "error": {
-                    "message": "Upstream API request failed",
-                    "type": "upstream_error",
-                    "upstream_status": getattr(e, 'status_code', 500)
-                }
-            }, 502
+        }, 502
+    finally:
+        # Drop an analysis nobody will join (upstream error or rate limit)
+        if analysis_task is not None:
+            analysis_task.cancel()
 
 
 def calculate_cost(model: str, prompt_tokens: int, completion_tokens: int) -> float:
@@ -240,194 +366,274 @@ def store_request_in_db(request_id: str, timestamp: datetime, project_id: str,
                        provider: str, model: str, prompt_tokens: int, 
                        completion_tokens: int, total_cost_usd: float, 
                        similarity_score: float, pattern_score: int, prompt_text: str,
-                       progress_indicator: str = "unknown", token_efficiency: float = 0.0):
+                       progress_indicator: str = "unknown", token_efficiency: float = 0.0,
+                       pair_similarity: Optional[float] = None):
     """
-    Store request data in database
+    Store request data in database.
+    The record is handed to the write-behind queue, so the caller does not wait for the commit.
+    pair_similarity (from the analysis) updates the project's running topic drift.
     """
-    from .models import get_db, Request
-    db = next(get_db())
-    try:
-        request_record = Request(
-            id=request_id,
-            timestamp=timestamp,
-            project_id=project_id,
-            provider=provider,
-            model=model,
-            prompt_tokens=prompt_tokens,
-            completion_tokens=completion_tokens,
-            total_cost_usd=total_cost_usd,
-            similarity_score=similarity_score,
-            pattern_score=pattern_score,
-            advisor_level=0,  # Will be set during analysis
-            prompt_text=prompt_text,  # Store the prompt text for similarity analysis
-            progress_indicator=progress_indicator,
-            token_efficiency=token_efficiency
-        )
-        db.add(request_record)
-        db.commit()
-    except Exception as e:
-        db.rollback()
-        raise e
-    finally:
-        db.close()
+    request_write_queue.enqueue({
+        "id": request_id,
+        "timestamp": timestamp,
+        "project_id": project_id,
+        "provider": provider,
+        "model": model,
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_cost_usd": total_cost_usd,
+        "similarity_score": similarity_score,
+        "pattern_score": pattern_score,
+        "advisor_level": 0,  # Will be set during analysis
+        "prompt_text": prompt_text,  # Store the prompt text for similarity analysis
+        "progress_indicator": progress_indicator,
+        "token_efficiency": token_efficiency
+    })
+    # Update in-memory state right away so the rate limit and the analyzer
+    # do not lag behind the queue
+    spend_tracker.add(project_id, total_cost_usd or 0.0, timestamp)
+    request_log_follower.mark_own(request_id)
+    project_history.record(project_id, prompt_text, timestamp, prompt_tokens, completion_tokens, pair_similarity)
+    near_duplicate_index.add(project_id, prompt_text, timestamp)
 
-
-async def parse_tokens_from_stream(chunks: list) -> Dict[str, int]:
+class StreamUsageParser:
     """
-    Parse token usage from SSE stream chunks
+    Incrementally parse SSE bytes, keeping only the latest usage block.
+    Chunks are never retained, only the trailing partial line.
     """
-    total_prompt_tokens = 0
-    total_completion_tokens = 0
-    total_tokens = 0
     
-    for chunk in chunks:
+    def __init__(self):
+        self._pending = b""
+        self.usage: Dict[str, Any] = {}
+    
+    def feed(self, chunk: bytes):
+        """Consume a raw chunk as it is forwarded to the client"""
+        self._pending += chunk
+        *lines, self._pending = self._pending.split(b"\n")
+        for line in lines:
+            self._parse_line(line)
+    
+    def close(self):
+        """Parse whatever is left once the stream has ended"""
+        if self._pending:
+            self._parse_line(self._pending)
+            self._pending = b""
+    
+    def _parse_line(self, line: bytes):
+        line = line.strip()
+        if not line.startswith(b"data:"):
+            return
+        data_part = line[5:].strip()
+        # Only chunks carrying usage are worth decoding (normally just the final one)
+        if not data_part or data_part == b"[DONE]" or b'"usage"' not in data_part:
+            return
         try:
-            # Decode the chunk if it's bytes
-            if isinstance(chunk, bytes):
-                chunk_str = chunk.decode('utf-8')
-            else:
-                chunk_str = str(chunk)
-                
-            # Check if this is a data line in SSE format
-            if chunk_str.startswith('data: ') and 'DONE' not in chunk_str:
-                # Remove 'data: ' prefix
-                data_part = chunk_str[6:].strip()
-                
-                # Skip empty lines
-                if not data_part:
-                    continue
-                    
-                # Parse JSON
-                import json
-                parsed_data = json.loads(data_part)
-                
-                # Extract usage information
-                if 'usage' in parsed_data:
-                    usage = parsed_data['usage']
-                    total_prompt_tokens = usage.get('prompt_tokens', 0)
-                    total_completion_tokens = usage.get('completion_tokens', 0)
-                    total_tokens = usage.get('total_tokens', 0)
-                    
-        except (json.JSONDecodeError, KeyError, AttributeError):
+            parsed_data = json.loads(data_part)
+        except (json.JSONDecodeError, UnicodeDecodeError):
             # Skip malformed chunks
-            continue
+            return
+        usage = parsed_data.get("usage") if isinstance(parsed_data, dict) else None
+        if isinstance(usage, dict):
+            self.usage.update(usage)
     
-    return {
-        "prompt_tokens": total_prompt_tokens,
-        "completion_tokens": total_completion_tokens,
-        "total_tokens": total_tokens
-    }
+    def get_token_usage(self) -> Dict[str, int]:
+        """Token usage in the same shape as non-streamed responses"""
+        prompt_tokens = self.usage.get("prompt_tokens", self.usage.get("input_tokens", 0)) or 0
+        completion_tokens = self.usage.get("completion_tokens", self.usage.get("output_tokens", 0)) or 0
+        return {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": self.usage.get("total_tokens") or prompt_tokens + completion_tokens
+        }
 
 
-# Note: We're commenting out the stream_proxy_response function for now to avoid the syntax error
-# async def stream_proxy_response(request_body: Dict[str, Any], headers: Dict[str, str], provider: str = "openai"):
-#     """
-#     Stream the response from upstream API while capturing usage data
-#     """
-#     upstream_urls = {
-#         "openai": settings.upstream.openai,
-#         "anthropic": settings.upstream.anthropic,
-#         "openrouter": settings.upstream.openrouter
-#     }
-    
-#     upstream_url = upstream_urls.get(provider, upstream_urls["openai"])
+def _is_usage_only_event(event: bytes) -> bool:
+    """True for the `data: {"choices": [], "usage": {...}}` event sent for include_usage"""
+    for line in event.split(b"\n"):
+        line = line.strip()
+        if not line.startswith(b"data:") or b'"usage"' not in line:
+            continue
+        try:
+            parsed_data = json.loads(line[5:].strip())
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            return False
+        return isinstance(parsed_data, dict) and parsed_data.get("choices") == [] and bool(parsed_data.get("usage"))
+    return False
+
+
+async def parse_tokens_from_stream(chunks: list) -> Dict[str, int]:
+    """
+    Parse token usage from SSE stream chunks
+    """
+    parser = StreamUsageParser()
+    for chunk in chunks:
+        parser.feed(chunk if isinstance(chunk, bytes) else str(chunk).encode("utf-8"))
+    parser.close()
+    return parser.get_token_usage()
+
+
+# Keep references to post-stream accounting tasks so they are not garbage collected
+_background_tasks: set = set()
+
+
+class ProxiedStream:
+    """
+    An upstream SSE response forwarded to the client chunk by chunk.
+    Cost and DB accounting run once the stream has ended.
+    """
     
-#     # Extract project_id and model
-#     project_id = headers.get("X-Project-ID", "default")
-#     model = request_body.get("model", "gpt-4o")
+    def __init__(self, response: httpx.Response, project_id: str, provider: str, model: str,
+                 analysis_result: Dict[str, Any], stored_prompt_text: Optional[str],
+                 strip_usage_chunk: bool = False):
+        self._response = response
+        self._parser = StreamUsageParser()
+        # Set when stream_options.include_usage was added by the proxy: the client did not
+        # ask for the trailing usage-only chunk (choices: []), so it is not forwarded
+        self._strip_usage_chunk = strip_usage_chunk
+        self._pending_event = b""
+        self.project_id = project_id
+        self.provider = provider
+        self.model = model
+        self.analysis_result = analysis_result
+        self.stored_prompt_text = stored_prompt_text
+        # Cost is unknown until the stream ends, so only analysis results go in headers
+        self.headers = {
+            "X-Advisor-Level": str(analysis_result["level"]),
+            "X-Similarity-Score": str(analysis_result["details"]["similarity"]),
+        }
     
-#     # Get recent requests for similarity analysis
-#     recent_requests = get_recent_requests_for_analysis(project_id)
+    async def iter_chunks(self) -> AsyncGenerator[bytes, None]:
+        """Yield upstream chunks unchanged, feeding the usage parser on the way"""
+        try:
+            async for chunk in self._response.aiter_bytes():
+                self._parser.feed(chunk)
+                if self._strip_usage_chunk:
+                    chunk = self._drop_usage_events(chunk)
+                    if not chunk:
+                        continue
+                yield chunk
+            if self._pending_event:
+                yield self._pending_event
+                self._pending_event = b""
+        finally:
+            await self._response.aclose()
+            self._parser.close()
+            task = asyncio.create_task(asyncio.to_thread(self._record_usage))
+            _background_tasks.add(task)
+            task.add_done_callback(_background_tasks.discard)
     
-#     # Calculate similarity
-#     similarity_score = 0.0
-#     last_user_message = ""
-#     for msg in reversed(request_body.get("messages", [])):
-#         if msg.get("role") == "user":
-#             last_user_message = msg.get("content", "")
-#             break
+    def _drop_usage_events(self, chunk: bytes) -> bytes:
+        """Forward complete SSE events, leaving out usage-only ones (held back until complete)"""
+        self._pending_event += chunk
+        *events, self._pending_event = self._pending_event.split(b"\n\n")
+        if not events:
+            return b""
+        return b"".join(event + b"\n\n" for event in events if not _is_usage_only_event(event))
     
-#     if recent_requests and last_user_message and recent_requests[0].prompt_text:
-#         similarity_score = calculate_similarity(last_user_message, recent_requests[0].prompt_text)
+    def _record_usage(self):
+        """Calculate cost and store the request once the stream is complete"""
+        usage = self._parser.get_token_usage()
+        prompt_tokens = usage["prompt_tokens"]
+        completion_tokens = usage["completion_tokens"]
+        if not usage["total_tokens"]:
+            print(f"[Stream] No usage reported for streamed {self.model} request (project: {self.project_id})")
+        
+        details = self.analysis_result["details"]
+        try:
+            store_request_in_db(
+                request_id=str(uuid.uuid4()),
+                timestamp=datetime.utcnow(),
+                project_id=self.project_id,
+                provider=self.provider,
+                model=self.model,
+                prompt_tokens=prompt_tokens,
+                completion_tokens=completion_tokens,
+                total_cost_usd=calculate_cost(self.model, prompt_tokens, completion_tokens),
+                similarity_score=details["similarity"],
+                pattern_score=details["emotion_score"],
+                prompt_text=self.stored_prompt_text,
+                progress_indicator=details.get("progress", "unknown"),
+                token_efficiency=(completion_tokens / prompt_tokens) if prompt_tokens > 0 else 0.0,
+                pair_similarity=details.get("pair_similarity")
+            )
+        except Exception as e:
+            print(f"[Stream] Failed to record streamed request: {str(e)}")
+
+
+async def stream_proxy_request(request_body: Dict[str, Any], headers: Dict[str, str], provider: str = "openai"):
+    """
+    Proxy a stream=true request, forwarding SSE chunks to the client as they arrive.
+    Returns (ProxiedStream, 200) on success, otherwise (error body, status code).
+    """
+    upstream_url = get_upstream_url(provider)
+    project_id = headers.get("X-Project-ID", "default")
+    model = request_body.get("model", "gpt-4o")
+    messages = request_body.get("messages", [])
     
-#     # Extract pattern score
-#     pattern_score = extract_pattern_score(request_body.get("messages", []))
+    # Same execution modes as proxy_request: in concurrent mode the analysis runs
+    # while the upstream connection is opened and is joined before the response
+    # headers (which carry the advisor level) are built
+    analysis_task = None
+    if settings.analyzer.execution_mode == "concurrent":
+        analysis_task = asyncio.create_task(run_analysis(project_id, messages, model))
+    else:
+        analysis_result = await run_analysis(project_id, messages, model)
     
-#     # Prepare for streaming
-#     async with httpx.AsyncClient(timeout=settings.upstream.timeout) as client:
-#         auth_header = headers.get("Authorization", "")
-#         upstream_headers = {
-#             "Content-Type": "application/json",
-#             "Authorization": auth_header
-#         }
+    try:
+        # The cost of this request is unknown until it finishes, so block only
+        # when the project is already over its hourly budget
+        if settings.advisor.enable_rate_limit:
+            total_hourly_cost = get_hourly_cost(project_id)
+            if total_hourly_cost > settings.advisor.max_cost_per_hour_usd:
+                return build_rate_limit_error(total_hourly_cost), 429
         
-#         if provider == "anthropic":
-#             upstream_headers["x-api-key"] = auth_header.replace("Bearer ", "")
-#             upstream_headers["anthropic-version"] = "2023-06-01"
+        # OpenAI only reports usage on streams when asked to
+        strip_usage_chunk = provider == "openai" and "stream_options" not in request_body
+        if strip_usage_chunk:
+            request_body = {**request_body, "stream_options": {"include_usage": True}}
         
-#         # Make streaming request to upstream
-#         upstream_response = await client.stream(
-#             "POST",
-#             f"{upstream_url}/v1/chat/completions",
-#             headers=upstream_headers,
-#             json=request_body
-#         )
+        client = get_upstream_client(provider if provider in UPSTREAM_PROVIDERS else "openai")
+        try:
+            upstream_request = client.build_request(
+                "POST",
+                f"{upstream_url}/v1/chat/completions",
+                headers=build_upstream_headers(headers, provider),
+                json=request_body
+            )
+            response = await client.send(upstream_request, stream=True)
+        except Exception as e:
+            print(f"Proxy error: {str(e)}")
+            return {
+                "error": {
+                    "message": "Upstream API request failed",
+                    "type": "upstream_error",
+                    "upstream_status": getattr(e, 'status_code', 500)
+                }
+            }, 502
         
-#         # Process the stream
-#         async with upstream_response:
-#             if upstream_response.status_code != 200:
-#                 yield f"data: {json.dumps({'error': await upstream_response.json()})}\n\n"
-#                 return  # This is fine in an async generator, just return without a value
-            
-#             # Buffer to collect usage data
-#             collected_chunks = []
-#             async for chunk in upstream_response.aiter_bytes():
-#                 collected_chunks.append(chunk)
-#                 yield chunk
+        if response.status_code != 200:
+            # Handle upstream errors
+            await response.aread()
+            await response.aclose()
+            try:
+                error_body = response.json()
+            except ValueError:
+                error_body = {"message": response.text}
+            return {"error": error_body}, response.status_code
         
-#         # After stream is complete, calculate usage and store in DB
-#         usage_data = await parse_tokens_from_stream(collected_chunks)
+        # Join the analysis started alongside the upstream call
+        if analysis_task is not None:
+            try:
+                analysis_result = await analysis_task
+            except BaseException:
+                await response.aclose()
+                raise
+            analysis_task = None
         
-#         if usage_data["total_tokens"] > 0:
-#             cost_usd = calculate_cost(model, usage_data["prompt_tokens"], usage_data["completion_tokens"])
-            
-#             # Store the request in database
-#             store_request_in_db(
-#                 request_id=str(uuid.uuid4()),
-#                 timestamp=datetime.utcnow(),
-#                 project_id=project_id,
-#                 provider=provider,
-#                 model=model,
-#                 prompt_tokens=usage_data["prompt_tokens"],
-#                 completion_tokens=usage_data["completion_tokens"],
-#                 total_cost_usd=cost_usd,
-#                 similarity_score=similarity_score,
-#                 pattern_score=pattern_score,
-#                 prompt_text=last_user_message
-#             )
-            
-#             # Generate advisor message
-#             advisor_level = determine_advisor_level(similarity_score, pattern_score, cost_usd)
-#             advisor_message = generate_message(advisor_level, cost_usd, similarity_score, model=model)
-            
-#             # Send final metadata
-#             metadata = {
-#                 "x_advisor_message": advisor_message,
-#                 "x_advisor_level": advisor_level,
-#                 "x_total_cost_usd": cost_usd,
-#                 "x_total_cost_cny": cost_usd * settings.pricing.exchange_rate_usd_to_cny,
-#                 "x_similarity_score": similarity_score
-#             }
-            
-#             yield f"data: {json.dumps({'metadata': metadata})}\n\n"
-
-
-async def save_request_to_db(db: Session, request_data: Dict[str, Any]):
-    """
-    Save request data to database
-    """
-    db_request = Request(**request_data)
-    db.add(db_request)
-    db.commit()
-    db.refresh(db_request)
-    return db_request
\ No newline at end of file
+        stored_prompt_text = get_stored_prompt_text(get_last_user_message(messages))
+        return ProxiedStream(response, project_id, provider, model, analysis_result, stored_prompt_text,
+                             strip_usage_chunk=strip_usage_chunk), 200
+    finally:
+        # Drop an analysis nobody will join (upstream error or rate limit)
+        if analysis_task is not None:
+            analysis_task.cancel()
@@ -0,0 +1,204 @@
+"""
+Hourly and daily request rollups.
+Counters per (bucket, project, model) are maintained incrementally when
+requests are written and can be rebuilt from the raw requests table. The
+stats queries that read them live in aggregation.py.
+
+Rebuild from raw data:
+    python -m app.rollups rebuild
+"""
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, List, Tuple
+from sqlalchemy import case, delete, select, update
+from .models import Request, RequestRollupHourly, RequestRollupDaily
+
+ROLLUP_TABLES = (RequestRollupHourly, RequestRollupDaily)
+
+# Additive counter columns shared by both rollup tables
+COUNTER_COLUMNS = [
+    "request_count", "prompt_tokens", "completion_tokens", "total_cost_usd",
+    "level_0", "level_1", "level_2", "level_3", "level_4",
+    "progress_stuck", "progress_exploring", "progress_refining", "progress_resolved", "progress_other",
+    "debug_pattern_count", "development_pattern_count",
+]
+
+PROGRESS_COLUMNS = {
+    "stuck": "progress_stuck",
+    "exploring": "progress_exploring",
+    "refining": "progress_refining",
+    "resolved": "progress_resolved",
+}
+
+# Raw request columns needed to compute counters
+RAW_COLUMNS = [
+    Request.timestamp, Request.project_id, Request.model, Request.prompt_tokens,
+    Request.completion_tokens, Request.total_cost_usd, Request.advisor_level,
+    Request.progress_indicator, Request.pattern_score, Request.similarity_score,
+]
+
+
+def floor_hour(dt: datetime) -> datetime:
+    return dt.replace(minute=0, second=0, microsecond=0)
+
+
+def floor_day(dt: datetime) -> datetime:
+    return dt.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def ceil_to(dt: datetime, floor, step: timedelta) -> datetime:
+    floored = floor(dt)
+    return floored if floored == dt else floored + step
+
+
+def record_counters(record: Dict[str, Any]) -> Dict[str, float]:
+    """Counter contributions of a single request record"""
+    counters = dict.fromkeys(COUNTER_COLUMNS, 0)
+    counters["request_count"] = 1
+    counters["prompt_tokens"] = record.get("prompt_tokens") or 0
+    counters["completion_tokens"] = record.get("completion_tokens") or 0
+    counters["total_cost_usd"] = record.get("total_cost_usd") or 0.0
+    
+    level = record.get("advisor_level") or 0
+    counters[f"level_{min(max(level, 0), 4)}"] = 1
+    counters[PROGRESS_COLUMNS.get(record.get("progress_indicator"), "progress_other")] = 1
+    
+    pattern_score = record.get("pattern_score")
+    similarity_score = record.get("similarity_score")
+    if pattern_score and pattern_score >= 3:
+        counters["debug_pattern_count"] = 1
+    elif pattern_score and similarity_score is not None and similarity_score < 0.5:
+        counters["development_pattern_count"] = 1
+    return counters
+
+
+def _accumulate(buckets: Dict[Tuple, Dict[str, Any]], key: Tuple, counters: Dict[str, float], timestamp: datetime):
+    row = buckets.get(key)
+    if row is None:
+        row = buckets[key] = dict.fromkeys(COUNTER_COLUMNS, 0)
+        row["last_request_at"] = timestamp
+    for column in COUNTER_COLUMNS:
+        row[column] += counters[column]
+    if timestamp > row["last_request_at"]:
+        row["last_request_at"] = timestamp
+
+
+def aggregate_records(records: Iterable[Dict[str, Any]]) -> Tuple[Dict[Tuple, Dict], Dict[Tuple, Dict]]:
+    """Fold raw records into hourly and daily deltas keyed by (bucket_start, project_id, model)"""
+    hourly: Dict[Tuple, Dict] = {}
+    daily: Dict[Tuple, Dict] = {}
+    for record in records:
+        timestamp = record.get("timestamp")
+        if timestamp is None:
+            continue
+        project_id = record.get("project_id") or "default"
+        model = record.get("model") or "unknown"
+        counters = record_counters(record)
+        _accumulate(hourly, (floor_hour(timestamp), project_id, model), counters, timestamp)
+        _accumulate(daily, (floor_day(timestamp), project_id, model), counters, timestamp)
+    return hourly, daily
+
+
+def _to_rows(deltas: Dict[Tuple, Dict]) -> List[Dict[str, Any]]:
+    return [
+        {"bucket_start": bucket_start, "project_id": project_id, "model": model, **counters}
+        for (bucket_start, project_id, model), counters in deltas.items()
+    ]
+
+
+def _dialect_name(executor) -> str:
+    bind = executor.get_bind() if hasattr(executor, "get_bind") else executor
+    return bind.dialect.name
+
+
+def _upsert(executor, table_model, rows: List[Dict[str, Any]]):
+    """Add deltas to existing buckets, inserting buckets that do not exist yet"""
+    if not rows:
+        return
+    table = table_model.__table__
+    dialect = _dialect_name(executor)
+    if dialect in ("sqlite", "postgresql"):
+        if dialect == "sqlite":
+            from sqlalchemy.dialects.sqlite import insert as dialect_insert
+        else:
+            from sqlalchemy.dialects.postgresql import insert as dialect_insert
+        stmt = dialect_insert(table)
+        set_ = {column: table.c[column] + stmt.excluded[column] for column in COUNTER_COLUMNS}
+        set_["last_request_at"] = case(
+            (stmt.excluded.last_request_at > table.c.last_request_at, stmt.excluded.last_request_at),
+            else_=table.c.last_request_at
+        )
+        stmt = stmt.on_conflict_do_update(index_elements=["bucket_start", "project_id", "model"], set_=set_)
+        executor.execute(stmt, rows)
+        return
+    
+    # Portable fallback: update the bucket, insert it if nothing was updated
+    for row in rows:
+        key_filter = (
+            (table.c.bucket_start == row["bucket_start"])
+            & (table.c.project_id == row["project_id"])
+            & (table.c.model == row["model"])
+        )
+        values = {column: table.c[column] + row[column] for column in COUNTER_COLUMNS}
+        values["last_request_at"] = case(
+            (table.c.last_request_at < row["last_request_at"], row["last_request_at"]),
+            else_=table.c.last_request_at
+        )
+        result = executor.execute(update(table).where(key_filter).values(**values))
+        if result.rowcount == 0:
+            executor.execute(table.insert().values(**row))
+
+
+def apply_rollups(executor, records: List[Dict[str, Any]]):
+    """
+    Fold newly inserted request records into the rollups.
+    Runs in the caller's transaction so raw rows and rollups commit together.
+    """
+    hourly, daily = aggregate_records(records)
+    _upsert(executor, RequestRollupHourly, _to_rows(hourly))
+    _upsert(executor, RequestRollupDaily, _to_rows(daily))
+
+
+def delete_project_rollups(executor, project_id: str):
+    for table_model in ROLLUP_TABLES:
+        executor.execute(delete(table_model.__table__).where(table_model.__table__.c.project_id == project_id))
+
+
+def rebuild_rollups(conn, chunk_size: int = 10000) -> int:
+    """
+    Recompute both rollup tables from the raw requests table.
+    Returns the number of raw requests folded in.
+    """
+    for table_model in ROLLUP_TABLES:
+        conn.execute(delete(table_model.__table__))
+    
+    hourly: Dict[Tuple, Dict] = {}
+    daily: Dict[Tuple, Dict] = {}
+    keys = [column.key for column in RAW_COLUMNS]
+    total = 0
+    result = conn.execution_options(stream_results=True, yield_per=chunk_size).execute(select(*RAW_COLUMNS))
+    for partition in result.partitions():
+        chunk_hourly, chunk_daily = aggregate_records(dict(zip(keys, row)) for row in partition)
+        for target, deltas in ((hourly, chunk_hourly), (daily, chunk_daily)):
+            for key, counters in deltas.items():
+                _accumulate(target, key, counters, counters["last_request_at"])
+        total += len(partition)
+    
+    for table_model, deltas in ((RequestRollupHourly, hourly), (RequestRollupDaily, daily)):
+        rows = _to_rows(deltas)
+        for i in range(0, len(rows), chunk_size):
+            conn.execute(table_model.__table__.insert(), rows[i:i + chunk_size])
+    return total
+
+
+if __name__ == "__main__":
+    import argparse
+    from .models import init_db, write_engine
+    
+    parser = argparse.ArgumentParser(description="Maintain request rollup tables")
+    parser.add_argument("command", choices=["rebuild"], help="rebuild: recompute rollups from raw requests")
+    args = parser.parse_args()
+    
+    init_db()
+    with write_engine.begin() as conn:
+        count = rebuild_rollups(conn)
+    print(f"[Rollups] Rebuilt hourly and daily rollups from {count} requests")
@@ -1,12 +1,24 @@
-from fastapi import APIRouter, Depends, Header
+from fastapi import APIRouter, Depends, Header, Query, Response
+from fastapi.responses import JSONResponse, StreamingResponse
 from sqlalchemy.orm import Session
-from .models import Request, SessionLocal, Feedback, get_db
+from .models import Request, SessionLocal, Feedback, get_db, get_write_db
 from .analyzer import analyze_efficiency
+from .analysis_pool import analyze_batch
 from typing import List, Dict, Any
 from datetime import datetime, timedelta
 from .config import settings
+import json
+import time
 import uuid
 from .i18n import ActivityMessages, EfficiencyMessages, Language, get_language_from_header
+from .spend_tracker import spend_tracker
+from .history import project_history
+from .near_duplicates import near_duplicate_index
+from .worker_sync import request_log_follower
+from .events import ProjectChange, project_events
+from .shared_state import shared_state
+from .rollups import delete_project_rollups
+from .aggregation import summarize_requests, daily_cost_series, project_summaries
 
 # Add UserPreferences model
 from pydantic import BaseModel
@@ -40,44 +52,44 @@ def calculate_equivalents(cost_cny: float) -> Dict[str, Any]:
     }
 
 @router.get("/api/projects")
-def get_projects(db: Session = Depends(get_db)):
-    """Get list of all projects from database"""
-    # Get all unique project IDs from the Request table
-    unique_projects = db.query(Request.project_id).distinct().all()
+def get_projects(
+    response: Response,
+    sort: str = "last_activity",
+    order: str = "desc",
+    limit: Optional[int] = Query(None, ge=1, le=1000),
+    offset: int = Query(0, ge=0),
+    db: Session = Depends(get_db)
+):
+    """
+    Get list of all projects from database
+    sort: last_activity | cost | requests | name, order: desc | asc
+    The total number of projects is returned in the X-Total-Count header.
+    """
+    # One aggregate query over the daily rollup covers every project
+    rows, total = project_summaries(db, sort=sort, descending=order != "asc", limit=limit, offset=offset)
+    response.headers["X-Total-Count"] = str(total)
     
     projects = []
-    for project_row in unique_projects:
-        project_id = project_row[0]  # Extract string from tuple
-        
-        # Get the most recent request for this project to get creation time
-        recent_request = db.query(Request).filter(
-            Request.project_id == project_id
-        ).order_by(Request.timestamp.desc()).first()
-        
-        # Get all requests for this project to calculate totals
-        project_requests = db.query(Request).filter(
-            Request.project_id == project_id
-        ).all()
-        
-        total_cost_usd = sum(req.total_cost_usd for req in project_requests)
+    for row in rows:
+        total_cost_usd = row["total_cost_usd"] or 0.0
         total_cost_cny = total_cost_usd * settings.pricing.exchange_rate_usd_to_cny
         
         # Calculate equivalent
         equivalents = calculate_equivalents(total_cost_cny)
         
         project_info = {
-            "id": project_id,
-            "name": project_id,  # For now, use the project_id as the name
-            "createdAt": recent_request.timestamp.strftime("%Y-%m-%d") if recent_request else datetime.utcnow().strftime("%Y-%m-%d"),
+            "id": row["project_id"],
+            "name": row["project_id"],  # For now, use the project_id as the name
+            "createdAt": row["last_request_at"].strftime("%Y-%m-%d") if row["last_request_at"] else datetime.utcnow().strftime("%Y-%m-%d"),
             "totalCost": total_cost_usd,
             "totalCostCNY": total_cost_cny,
-            "equivalent": equivalents["meal_equivalent"]
+            "equivalent": equivalents["meal_equivalent"],
+            "requestCount": int(row["request_count"] or 0)
         }
         projects.append(project_info)
     
     return projects
 
-
 @router.get("/api/dashboard/summary")
 def get_dashboard_summary(time_range: str = "24h", db: Session = Depends(get_db)):
     """
@@ -106,25 +118,20 @@ def get_dashboard_summary(time_range: str = "24h", db: Session = Depends(get_db)
         comparison_period = "previous_period"
         comparison_start_time = datetime.utcnow() - timedelta(hours=48)
     
-    # Query for all requests in the specified time range
-    requests = db.query(Request).filter(Request.timestamp >= start_time).all()
+    # Aggregate the specified time range from the rollup tables
+    summary = summarize_requests(db, start_time)
     
-    total_spend_usd = sum(req.total_cost_usd for req in requests)
+    total_spend_usd = summary.total_cost_usd
     total_spend_cny = total_spend_usd * settings.pricing.exchange_rate_usd_to_cny
     
     # Count unique projects
-    unique_projects = set(req.project_id for req in requests)
+    unique_projects = summary.projects
     
     # Count warnings (requests with advisor_level > 1)
-    warnings_count = sum(1 for req in requests if req.advisor_level and req.advisor_level > 1)
+    warnings_count = summary.level_count(2)
     
     # Calculate trend (compare with previous period)
-    prev_requests = db.query(Request).filter(
-        Request.timestamp >= comparison_start_time,
-        Request.timestamp < start_time
-    ).all()
-    
-    prev_spend = sum(req.total_cost_usd for req in prev_requests)
+    prev_spend = summarize_requests(db, comparison_start_time, start_time).total_cost_usd
     
     if prev_spend > 0:
         change_pct = round(((total_spend_usd - prev_spend) / prev_spend) * 100, 2)
@@ -165,19 +172,12 @@ def get_dashboard_summary(time_range: str = "24h", db: Session = Depends(get_db)
     # For backward compatibility, also return week data if not requesting week data
     if time_range != "7d":
         week_ago = datetime.utcnow() - timedelta(days=7)
-        week_requests = db.query(Request).filter(Request.timestamp >= week_ago).all()
-        
-        week_spend_usd = sum(req.total_cost_usd for req in week_requests)
+        week_spend_usd = summarize_requests(db, week_ago).total_cost_usd
         week_spend_cny = week_spend_usd * settings.pricing.exchange_rate_usd_to_cny
         
         # Calculate week trend (compare with previous week)
         two_weeks_ago = datetime.utcnow() - timedelta(days=14)
-        prev_week_requests = db.query(Request).filter(
-            Request.timestamp >= two_weeks_ago,
-            Request.timestamp < week_ago
-        ).all()
-        
-        prev_week_spend = sum(req.total_cost_usd for req in prev_week_requests)
+        prev_week_spend = summarize_requests(db, two_weeks_ago, week_ago).total_cost_usd
         
         if prev_week_spend > 0:
             week_change_pct = round(((week_spend_usd - prev_week_spend) / prev_week_spend) * 100, 2)
@@ -202,6 +202,33 @@ def get_dashboard_summary(time_range: str = "24h", db: Session = Depends(get_db)
     
     return result
 
+@router.get("/api/spend/hourly")
+def get_hourly_spend(project_id: Optional[str] = None):
+    """
+    Return spend in the current hourly rate-limit window, per project
+    """
+    budget_usd = settings.advisor.max_cost_per_hour_usd
+    if project_id:
+        spend_by_project = {project_id: spend_tracker.get_spend(project_id)}
+    else:
+        spend_by_project = spend_tracker.snapshot()
+    
+    projects = []
+    for pid, cost_usd in sorted(spend_by_project.items(), key=lambda x: x[1], reverse=True):
+        projects.append({
+            "project_id": pid,
+            "cost_usd": round(cost_usd, 4),
+            "cost_cny": round(cost_usd * settings.pricing.exchange_rate_usd_to_cny, 2),
+            "budget_used_percent": round(cost_usd / budget_usd * 100, 2) if budget_usd > 0 else 0.0,
+            "rate_limited": settings.advisor.enable_rate_limit and cost_usd > budget_usd
+        })
+    
+    return {
+        "window_minutes": spend_tracker.window_seconds // 60,
+        "budget_usd": budget_usd,
+        "projects": projects
+    }
+
 @router.get("/api/projects/{id}/stats")
 def get_project_stats(id: str, time_range: str = "24h", db: Session = Depends(get_db)):
     """Get project statistics from database"""
@@ -218,14 +245,11 @@ def get_project_stats(id: str, time_range: str = "24h", db: Session = Depends(ge
         # Default to 24 hours if invalid time range
         start_time = datetime.utcnow() - timedelta(hours=24)
     
-    # Query for requests for this specific project in the specified time range
-    requests = db.query(Request).filter(
-        Request.project_id == id,
-        Request.timestamp >= start_time
-    ).all()
+    # Aggregate this project's requests in the specified time range from the rollup tables
+    summary = summarize_requests(db, start_time, project_id=id)
     
-    total_requests = len(requests)
-    total_cost_usd = sum(req.total_cost_usd for req in requests)
+    total_requests = summary.request_count
+    total_cost_usd = summary.total_cost_usd
     total_cost_cny = total_cost_usd * settings.pricing.exchange_rate_usd_to_cny
     
     # Calculate equivalents
@@ -233,23 +257,14 @@ def get_project_stats(id: str, time_range: str = "24h", db: Session = Depends(ge
     
     # Calculate debug rate (requests with advisor_level >= 2)
     if total_requests > 0:
-        debug_requests = sum(1 for req in requests if req.advisor_level and req.advisor_level >= 2)
+        debug_requests = summary.level_count(2)
         debug_rate = round(debug_requests / total_requests, 2)
     else:
         debug_rate = 0.0
     
-    # Group by model to get top models
-    model_stats = {}
-    for req in requests:
-        model = req.model
-        if model not in model_stats:
-            model_stats[model] = {"requests": 0, "cost": 0.0}
-        model_stats[model]["requests"] += 1
-        model_stats[model]["cost"] += req.total_cost_usd
-    
     # Sort by cost and get top models
     top_models = []
-    for model, stats in sorted(model_stats.items(), key=lambda x: x[1]["cost"], reverse=True):
+    for model, stats in sorted(summary.models.items(), key=lambda x: x[1]["cost"], reverse=True):
         top_models.append({
             "model": model,
             "requests": stats["requests"],
@@ -257,58 +272,19 @@ def get_project_stats(id: str, time_range: str = "24h", db: Session = Depends(ge
         })
     
     # Calculate daily trend based on time range
-    daily_trend = []
-    
-    # Determine number of days based on time_range
     if time_range == "24h":
-        # For 24h, just return the current day data
-        day_start = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
-        day_end = day_start + timedelta(days=1)
-        
-        day_requests = db.query(Request).filter(
-            Request.project_id == id,
-            Request.timestamp >= day_start,
-            Request.timestamp < day_end
-        ).all()
-        
-        day_cost = sum(req.total_cost_usd for req in day_requests)
-        
-        daily_trend.append({
-            "date": day_start.strftime("%m-%d"),
-            "cost": round(day_cost, 2)
-        })
+        num_days = 1  # For 24h, just return the current day data
+    elif time_range == "30d":
+        num_days = 30
+    elif time_range == "90d":
+        num_days = 90
     else:
-        # Calculate number of days based on time range
-        if time_range == "7d":
-            num_days = 7
-        elif time_range == "30d":
-            num_days = 30
-        elif time_range == "90d":
-            num_days = 90
-        else:
-            num_days = 7  # Default to 7 days
-        
-        for i in range(num_days - 1, -1, -1):  # From num_days ago to today
-            day_start = datetime.utcnow() - timedelta(days=i)
-            day_start = day_start.replace(hour=0, minute=0, second=0, microsecond=0)
-            day_end = day_start + timedelta(days=1)
-            
-            day_requests = db.query(Request).filter(
-                Request.project_id == id,
-                Request.timestamp >= day_start,
-                Request.timestamp < day_end
-            ).all()
-            
-            day_cost = sum(req.total_cost_usd for req in day_requests)
-            
-            daily_trend.append({
-                "date": day_start.strftime("%m-%d"),
-                "cost": round(day_cost, 2)
-            })
+        num_days = 7  # Default to 7 days
+    daily_trend = daily_cost_series(db, num_days, project_id=id)
     
     # Calculate usage analysis (breakdown by purpose)
-    debug_requests = sum(1 for req in requests if req.pattern_score and req.pattern_score >= 3)
-    development_requests = sum(1 for req in requests if req.pattern_score and req.pattern_score < 3 and req.similarity_score < 0.5)
+    debug_requests = int(summary.totals["debug_pattern_count"])
+    development_requests = int(summary.totals["development_pattern_count"])
     optimization_requests = total_requests - debug_requests - development_requests
     
     usage_breakdown = [
@@ -362,50 +338,60 @@ def get_efficiency_analysis(
         }
 
 
+class BatchAnalysisItem(BaseModel):
+    project_id: str = "default"
+    messages: List[Dict[str, Any]]
+    model: str = "gpt-4o"
+
+
+class BatchAnalysisRequest(BaseModel):
+    items: List[BatchAnalysisItem]
+    use_history: bool = False  # Score against the live per-project history instead of each item's messages alone
+    workers: Optional[int] = None  # Defaults to (and is capped at) analyzer.batch.workers
+
+
+@router.post("/api/analyzer/batch")
+def analyze_behavior_batch(request: BatchAnalysisRequest):
+    """
+    Run the behavior analysis over many (project, messages, model) items, e.g. to
+    replay conversation logs when tuning thresholds. Results are streamed as
+    newline-delimited JSON in input order, each with its item "index".
+    """
+    if len(request.items) > settings.analyzer.batch_max_items:
+        return JSONResponse(status_code=413, content={
+            "success": False,
+            "error": f"At most {settings.analyzer.batch_max_items} items per batch"
+        })
+    
+    items = [item.model_dump() for item in request.items]
+    results = analyze_batch(items, use_history=request.use_history, workers=request.workers)
+    return StreamingResponse(
+        (json.dumps(result, ensure_ascii=False, default=str) + "\n" for result in results),
+        media_type="application/x-ndjson"
+    )
+
+
 @router.get("/api/projects/stats")
 def get_all_projects_stats(time_range: str = "30d", db: Session = Depends(get_db)):
     """
     Return aggregated statistics across all projects
     """
-    # Get all unique project IDs
-    unique_project_ids = [row[0] for row in db.query(Request.project_id).distinct().all()]
-    
-    # Aggregate data across all projects
-    all_requests = []
-    for project_id in unique_project_ids:
-        # Calculate time range based on parameter
-        start_time = None
-        if time_range == "24h":
-            from datetime import datetime, timedelta
-            start_time = datetime.utcnow() - timedelta(hours=24)
-        elif time_range == "7d":
-            from datetime import datetime, timedelta
-            start_time = datetime.utcnow() - timedelta(days=7)
-        elif time_range == "30d":
-            from datetime import datetime, timedelta
-            start_time = datetime.utcnow() - timedelta(days=30)
-        elif time_range == "90d":
-            from datetime import datetime, timedelta
-            start_time = datetime.utcnow() - timedelta(days=90)
-        else:
-            from datetime import datetime, timedelta
-            start_time = datetime.utcnow() - timedelta(days=30)  # Default to 30 days
-
-        # Get requests for this project in the time range
-        project_requests = db.query(Request).filter(
-            Request.project_id == project_id
-        )
-        
-        if start_time:
-            project_requests = project_requests.filter(
-                Request.timestamp >= start_time
-            )
-        
-        all_requests.extend(project_requests.all())
+    # Calculate time range based on parameter
+    if time_range == "24h":
+        start_time = datetime.utcnow() - timedelta(hours=24)
+    elif time_range == "7d":
+        start_time = datetime.utcnow() - timedelta(days=7)
+    elif time_range == "90d":
+        start_time = datetime.utcnow() - timedelta(days=90)
+    else:
+        start_time = datetime.utcnow() - timedelta(days=30)  # Default to 30 days
+    
+    # Aggregate requests across all projects from the rollup tables
+    summary = summarize_requests(db, start_time)
     
     # Calculate overall statistics
-    total_requests = len(all_requests)
-    total_cost_usd = sum(req.total_cost_usd for req in all_requests)
+    total_requests = summary.request_count
+    total_cost_usd = summary.total_cost_usd
     total_cost_cny = total_cost_usd * settings.pricing.exchange_rate_usd_to_cny
     
     # Calculate equivalents
@@ -413,23 +399,14 @@ def get_all_projects_stats(time_range: str = "30d", db: Session = Depends(get_db
     
     # Calculate debug rate
     if total_requests > 0:
-        debug_requests = sum(1 for req in all_requests if req.advisor_level and req.advisor_level >= 2)
+        debug_requests = summary.level_count(2)
         debug_rate = round(debug_requests / total_requests, 2)
     else:
         debug_rate = 0.0
     
-    # Group by model to get top models across all projects
-    model_stats = {}
-    for req in all_requests:
-        model = req.model
-        if model not in model_stats:
-            model_stats[model] = {"requests": 0, "cost": 0.0}
-        model_stats[model]["requests"] += 1
-        model_stats[model]["cost"] += req.total_cost_usd
-    
     # Sort by cost and get all models (not just top 3)
     top_models = []
-    for model, stats in sorted(model_stats.items(), key=lambda x: x[1]["cost"], reverse=True):
+    for model, stats in sorted(summary.models.items(), key=lambda x: x[1]["cost"], reverse=True):
         top_models.append({
             "model": model,
             "requests": stats["requests"],
@@ -437,75 +414,24 @@ def get_all_projects_stats(time_range: str = "30d", db: Session = Depends(get_db
         })
     
     # Calculate daily trend across all projects
-    daily_trend = []
-    
-    # Determine number of days based on time_range
     if time_range == "24h":
-        from datetime import datetime, timedelta
-        # For 24h, just return the current day data
-        day_start = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
-        day_end = day_start + timedelta(days=1)
-        
-        day_requests = db.query(Request).filter(
-            Request.timestamp >= day_start,
-            Request.timestamp < day_end
-        ).all()
-        
-        day_cost = sum(req.total_cost_usd for req in day_requests)
-        
-        daily_trend.append({
-            "date": day_start.strftime("%m-%d"),
-            "cost": round(day_cost, 2)
-        })
+        num_days = 1  # For 24h, just return the current day data
+    elif time_range == "7d":
+        num_days = 7
+    elif time_range == "90d":
+        num_days = 90
     else:
-        from datetime import datetime, timedelta
-        # Calculate number of days based on time_range
-        if time_range == "7d":
-            num_days = 7
-        elif time_range == "30d":
-            num_days = 30
-        elif time_range == "90d":
-            num_days = 90
-        else:
-            num_days = 30  # Default to 30 days
-            
-        # Build daily trend from the already collected all_requests data
-        # Create a mapping of dates to costs, grouping requests by date
-        date_costs = {}
-        for req in all_requests:
-            # Extract just the date part (YYYY-MM-DD) then format as MM-DD
-            # Match the exact format used in single project stats
-            req_date = req.timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
-            date_key = req_date.strftime("%m-%d")
-            if date_key not in date_costs:
-                date_costs[date_key] = 0.0
-            date_costs[date_key] += req.total_cost_usd
-        
-        # Generate the date range and populate with actual data or 0
-        # Following the same pattern as single project stats to maintain consistency
-        # Ensure we have an entry for every day in the range, even if cost is 0
-        daily_trend = []  # Initialize for non-24h time ranges
-        for i in range(num_days - 1, -1, -1):  # From num_days ago to today
-            day_start = datetime.utcnow() - timedelta(days=i)
-            day_start = day_start.replace(hour=0, minute=0, second=0, microsecond=0)  # Normalize to start of day
-            
-            date_key = day_start.strftime("%m-%d")
-            
-            day_cost = date_costs.get(date_key, 0.0)
-            
-            daily_trend.append({
-                "date": date_key,
-                "cost": round(day_cost, 2)
-            })
+        num_days = 30  # Default to 30 days
+    daily_trend = daily_cost_series(db, num_days)
 
     # Calculate usage breakdown across all projects
     usage_breakdown = []
     if total_requests > 0:
-        debug_requests = sum(1 for req in all_requests if req.advisor_level and req.advisor_level >= 2)
-        refining_requests = sum(1 for req in all_requests if req.progress_indicator == "refining")
-        exploring_requests = sum(1 for req in all_requests if req.progress_indicator == "exploring")
-        resolved_requests = sum(1 for req in all_requests if req.progress_indicator == "resolved")
-        stuck_requests = sum(1 for req in all_requests if req.progress_indicator == "stuck")
+        debug_requests = summary.level_count(2)
+        refining_requests = summary.totals["progress_refining"]
+        exploring_requests = summary.totals["progress_exploring"]
+        resolved_requests = summary.totals["progress_resolved"]
+        stuck_requests = summary.totals["progress_stuck"]
         
         usage_breakdown = [
             {"name": "Debug", "percentage": round((debug_requests / total_requests) * 100, 2)},
@@ -532,11 +458,15 @@ def get_all_projects_stats(time_range: str = "30d", db: Session = Depends(get_db
 @router.get("/api/cache/stats")
 def get_cache_stats():
     """
-    Get cache statistics
+    Get efficiency cache statistics (hit/miss/eviction counters, size, in-flight computations)
+    the analyzer's per-text memo and the pick-up of other workers' requests
     """
     try:
-        from .analyzer import efficiency_cache
+        from .analyzer import efficiency_cache, text_memo
         stats = efficiency_cache.get_stats()
+        stats["events"] = project_events.get_stats()
+        stats["text_memo"] = text_memo.get_stats()
+        stats["worker_sync"] = request_log_follower.get_stats()
         
         return {
             "success": True,
@@ -550,6 +480,19 @@ def get_cache_stats():
         }
 
 
+@router.get("/api/write-queue/stats")
+def get_write_queue_stats():
+    """
+    Get write-behind queue statistics (queue depth, flush latency, dropped records)
+    """
+    from .write_queue import request_write_queue
+    
+    return {
+        "success": True,
+        "data": request_write_queue.get_stats()
+    }
+
+
 @router.post("/api/cache/invalidate")
 def invalidate_cache(project_id: str = None, time_range: str = None):
     """
@@ -707,7 +650,7 @@ def get_recent_activities(
     }
 
 @router.post("/api/feedback")
-def post_feedback(feedback: Dict[str, Any], db: Session = Depends(get_db)):
+def post_feedback(feedback: Dict[str, Any], db: Session = Depends(get_write_db)):
     """
     Handle feedback from users
     """
@@ -739,7 +682,7 @@ def post_feedback(feedback: Dict[str, Any], db: Session = Depends(get_db)):
 
 
 @router.delete("/api/projects/{project_id}")
-def delete_project(project_id: str, db: Session = Depends(get_db)):
+def delete_project(project_id: str, db: Session = Depends(get_write_db)):
     """
     Delete a project and all its associated requests and feedback
     """
@@ -749,8 +692,15 @@ def delete_project(project_id: str, db: Session = Depends(get_db)):
     # Delete all feedback for this project
     deleted_feedback = db.query(Feedback).filter(Feedback.project_id == project_id).delete()
     
+    # Drop the project's rollup buckets
+    delete_project_rollups(db, project_id)
+    
     # Commit the changes
     db.commit()
+    spend_tracker.forget(project_id)
+    project_history.forget(project_id)
+    near_duplicate_index.forget(project_id)
+    project_events.publish(ProjectChange(project_id, kind="deleted"))
     
     return {
         "success": True,
@@ -768,7 +718,7 @@ class UserPreferences(BaseModel):
     warning_threshold: Optional[int] = 20
 
 
-# System-wide settings storage
+# System-wide settings storage (defaults; the live copy is kept in shared state so all workers agree)
 system_settings = {
     "pricing": {
         "exchange_rate_usd_to_cny": settings.pricing.exchange_rate_usd_to_cny,
@@ -793,7 +743,36 @@ system_settings = {
     }
 }
 
-# In-memory storage for user preferences (in production, this would be stored in DB)
+SYSTEM_SETTINGS_KEY = "settings:system"
+USER_PREFERENCES_KEY = "settings:user_preferences:default"
+_settings_sync = {"checked_at": 0.0, "applied": None}
+
+
+def sync_system_settings(force: bool = False):
+    """
+    Pick up system settings saved by any worker and apply them to this process.
+    Checks shared state at most once per config_refresh_interval_ms unless forced.
+    """
+    global system_settings
+    now = time.time()
+    if not force and (now - _settings_sync["checked_at"]) * 1000 < settings.shared_state.config_refresh_interval_ms:
+        return
+    _settings_sync["checked_at"] = now
+    shared_settings = shared_state.get(SYSTEM_SETTINGS_KEY)
+    if shared_settings is None or shared_settings == _settings_sync["applied"]:
+        return
+    system_settings = shared_settings
+    apply_system_settings(shared_settings)
+    _settings_sync["applied"] = shared_settings
+
+
+def save_system_settings():
+    """Publish this process's system settings to the other workers"""
+    shared_state.set(SYSTEM_SETTINGS_KEY, system_settings)
+    _settings_sync["applied"] = system_settings
+
+
+# Default user preferences (the saved copy is kept in shared state)
 user_preferences_storage = {
     "default": {
         "today_budget": 50.0,
@@ -809,12 +788,7 @@ def get_user_preferences():
     """
     Get user preference settings for dashboard meters
     """
-    return UserPreferences(**user_preferences_storage.get("default", {
-        "today_budget": 50.0,
-        "week_budget": 300.0,
-        "active_proj_limit": 10,
-        "warning_threshold": 20
-    }))
+    return UserPreferences(**shared_state.get(USER_PREFERENCES_KEY, user_preferences_storage["default"]))
 
 
 @router.get("/api/settings")
@@ -822,9 +796,52 @@ def get_system_settings():
     """
     Get system-wide settings including pricing configuration
     """
+    sync_system_settings(force=True)
     return system_settings
 
 
+def apply_system_settings(updated_settings: dict):
+    """Apply system settings to the settings object used by this process"""
+    # Update the actual pricing configuration in settings object to apply changes globally
+    pricing_data = updated_settings.get("pricing", {})
+    
+    # Update exchange rate
+    if "exchange_rate_usd_to_cny" in pricing_data:
+        settings.pricing.exchange_rate_usd_to_cny = pricing_data["exchange_rate_usd_to_cny"]
+    
+    # Update equivalent prices
+    if "equivalents" in pricing_data:
+        equivalents = pricing_data["equivalents"]
+        if "coffee" in equivalents:
+            settings.pricing.coffee_price_cny = equivalents["coffee"]
+        if "jianbing" in equivalents:
+            settings.pricing.jianbing_price_cny = equivalents["jianbing"]
+        if "meal" in equivalents:
+            settings.pricing.meal_price_cny = equivalents["meal"]
+        if "hotpot" in equivalents:
+            settings.pricing.hotpot_price_cny = equivalents["hotpot"]
+    
+    # Update model prices
+    if "models" in pricing_data:
+        settings.pricing.models = pricing_data["models"]
+    
+    # Update privacy configuration
+    privacy_data = updated_settings.get("privacy", {})
+    if privacy_data:
+        # Update store_request_content
+        if "store_request_content" in privacy_data:
+            settings.privacy.store_request_content = privacy_data["store_request_content"]
+        # Update similarity_method
+        if "similarity_method" in privacy_data:
+            settings.privacy.similarity_method = privacy_data["similarity_method"]
+        # Update cache_ttl_seconds
+        if "cache_ttl_seconds" in privacy_data:
+            settings.privacy.cache_ttl_seconds = privacy_data["cache_ttl_seconds"]
+        # Update anonymize_project_id
+        if "anonymize_project_id" in privacy_data:
+            settings.privacy.anonymize_project_id = privacy_data["anonymize_project_id"]
+
+
 @router.post("/api/settings")
 def update_system_settings(updated_settings: dict):
     """
@@ -834,45 +851,9 @@ def update_system_settings(updated_settings: dict):
     try:
         # Update the system settings
         system_settings = updated_settings
-        
-        # Update the actual pricing configuration in settings object to apply changes globally
-        pricing_data = updated_settings.get("pricing", {})
-        
-        # Update exchange rate
-        if "exchange_rate_usd_to_cny" in pricing_data:
-            settings.pricing.exchange_rate_usd_to_cny = pricing_data["exchange_rate_usd_to_cny"]
-        
-        # Update equivalent prices
-        if "equivalents" in pricing_data:
-            equivalents = pricing_data["equivalents"]
-            if "coffee" in equivalents:
-                settings.pricing.coffee_price_cny = equivalents["coffee"]
-            if "jianbing" in equivalents:
-                settings.pricing.jianbing_price_cny = equivalents["jianbing"]
-            if "meal" in equivalents:
-                settings.pricing.meal_price_cny = equivalents["meal"]
-            if "hotpot" in equivalents:
-                settings.pricing.hotpot_price_cny = equivalents["hotpot"]
-        
-        # Update model prices
-        if "models" in pricing_data:
-            settings.pricing.models = pricing_data["models"]
-        
-        # Update privacy configuration
-        privacy_data = updated_settings.get("privacy", {})
-        if privacy_data:
-            # Update store_request_content
-            if "store_request_content" in privacy_data:
-                settings.privacy.store_request_content = privacy_data["store_request_content"]
-            # Update similarity_method
-            if "similarity_method" in privacy_data:
-                settings.privacy.similarity_method = privacy_data["similarity_method"]
-            # Update cache_ttl_seconds
-            if "cache_ttl_seconds" in privacy_data:
-                settings.privacy.cache_ttl_seconds = privacy_data["cache_ttl_seconds"]
-            # Update anonymize_project_id
-            if "anonymize_project_id" in privacy_data:
-                settings.privacy.anonymize_project_id = privacy_data["anonymize_project_id"]
+        apply_system_settings(updated_settings)
+        # Share the new settings with the other workers
+        save_system_settings()
         
         return {
             "success": True,
@@ -981,6 +962,7 @@ def auto_update_pricing_from_data(update_existing: bool = False):
         
         # Update system settings with new pricing
         global system_settings
+        sync_system_settings(force=True)
         for model, pricing in pricing_for_used_models.items():
             if update_existing or model not in system_settings["pricing"]["models"]:
                 system_settings["pricing"]["models"][model] = pricing
@@ -989,6 +971,7 @@ def auto_update_pricing_from_data(update_existing: bool = False):
         for model, pricing in pricing_for_used_models.items():
             if update_existing or model not in settings.pricing.models:
                 settings.pricing.models[model] = pricing
+        save_system_settings()
         
         return {
             "success": True,
@@ -1013,5 +996,5 @@ def update_user_preferences(preferences: UserPreferences):
     """
     Update user preference settings for dashboard meters
     """
-    user_preferences_storage["default"] = preferences.dict()
-    return {"success": True, "preferences": user_preferences_storage["default"]}
\ No newline at end of file
+    shared_state.set(USER_PREFERENCES_KEY, preferences.dict())
+    return {"success": True, "preferences": preferences.dict()}
\ No newline at end of file
@@ -0,0 +1,320 @@
+"""
+Key-value state shared by all worker processes.
+With server.workers > 1 every process would otherwise keep its own caches,
+settings and rate-limit buckets. Backends:
+  - "memory": per-process dict (single worker, tests)
+  - "sqlite": a WAL-mode SQLite file next to the database; no server needed
+  - "redis":  any Redis-compatible server (requires the optional 'redis' package)
+Values must be JSON-serializable.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Optional
+from .config import settings
+
+
+class MemoryBackend:
+    """Process-local backend with the same semantics as the shared ones"""
+
+    is_shared = False
+
+    def __init__(self):
+        self._data: Dict[str, tuple] = {}  # key -> (value, expires_at)
+        self._lock = threading.Lock()
+
+    def _live(self, key: str, now: float):
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        if entry[1] is not None and entry[1] <= now:
+            del self._data[key]
+            return None
+        return entry
+
+    def get(self, key: str) -> Any:
+        with self._lock:
+            entry = self._live(key, time.time())
+            return entry[0] if entry else None
+
+    def set(self, key: str, value: Any, ttl_seconds: Optional[float] = None):
+        with self._lock:
+            self._data[key] = (value, time.time() + ttl_seconds if ttl_seconds else None)
+
+    def add(self, key: str, value: Any, ttl_seconds: Optional[float] = None) -> bool:
+        """Set only if the key does not exist; returns whether it was set"""
+        with self._lock:
+            now = time.time()
+            if self._live(key, now):
+                return False
+            self._data[key] = (value, now + ttl_seconds if ttl_seconds else None)
+            return True
+
+    def incr(self, key: str, amount: float = 1, ttl_seconds: Optional[float] = None) -> float:
+        with self._lock:
+            now = time.time()
+            entry = self._live(key, now)
+            value = (entry[0] if entry else 0) + amount
+            expires_at = entry[1] if entry else (now + ttl_seconds if ttl_seconds else None)
+            self._data[key] = (value, expires_at)
+            return value
+
+    def delete(self, key: str):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def delete_prefix(self, prefix: str):
+        with self._lock:
+            for key in [k for k in self._data if k.startswith(prefix)]:
+                del self._data[key]
+
+    def scan(self, prefix: str) -> Dict[str, Any]:
+        """All live keys starting with prefix"""
+        with self._lock:
+            now = time.time()
+            return {k: entry[0] for k in list(self._data) if k.startswith(prefix) and (entry := self._live(k, now))}
+
+    def close(self):
+        pass
+
+
+class SQLiteBackend:
+    """
+    Shared state in a SQLite file. Every worker opens the same file; WAL mode lets
+    readers proceed while one process writes. Connections are per thread.
+    """
+
+    is_shared = True
+    _PURGE_EVERY = 1000  # Writes between sweeps of expired keys
+
+    def __init__(self, filename: str, busy_timeout_ms: int = 5000):
+        self.filename = filename
+        self.busy_timeout_ms = busy_timeout_ms
+        self._local = threading.local()
+        self._writes = 0
+        # The file and table are created on first use, not when the module is imported
+        self._ready = False
+        self._init_lock = threading.Lock()
+
+    def _create(self):
+        with self._init_lock:
+            if self._ready:
+                return
+            directory = os.path.dirname(self.filename)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._ready = True
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            first = not self._ready
+            if first:
+                self._create()
+            # Autocommit; multi-statement updates use explicit BEGIN IMMEDIATE
+            conn = sqlite3.connect(self.filename, timeout=self.busy_timeout_ms / 1000, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            if first:
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS shared_state ("
+                    "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL)"
+                )
+            self._local.conn = conn
+        return conn
+
+    def _after_write(self, conn: sqlite3.Connection):
+        self._writes += 1
+        if self._writes % self._PURGE_EVERY == 0:
+            conn.execute("DELETE FROM shared_state WHERE expires_at IS NOT NULL AND expires_at <= ?", (time.time(),))
+
+    @staticmethod
+    def _expiry(ttl_seconds: Optional[float]) -> Optional[float]:
+        return time.time() + ttl_seconds if ttl_seconds else None
+
+    def get(self, key: str) -> Any:
+        row = self._conn().execute(
+            "SELECT value FROM shared_state WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)",
+            (key, time.time())
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set(self, key: str, value: Any, ttl_seconds: Optional[float] = None):
+        conn = self._conn()
+        conn.execute(
+            "INSERT OR REPLACE INTO shared_state (key, value, expires_at) VALUES (?, ?, ?)",
+            (key, json.dumps(value), self._expiry(ttl_seconds))
+        )
+        self._after_write(conn)
+
+    def add(self, key: str, value: Any, ttl_seconds: Optional[float] = None) -> bool:
+        conn = self._conn()
+        now = time.time()
+        # An expired row counts as absent
+        cursor = conn.execute(
+            "INSERT INTO shared_state (key, value, expires_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET value = excluded.value, expires_at = excluded.expires_at "
+            "WHERE shared_state.expires_at IS NOT NULL AND shared_state.expires_at <= ?",
+            (key, json.dumps(value), self._expiry(ttl_seconds), now)
+        )
+        self._after_write(conn)
+        return cursor.rowcount > 0
+
+    def incr(self, key: str, amount: float = 1, ttl_seconds: Optional[float] = None) -> float:
+        conn = self._conn()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "INSERT INTO shared_state (key, value, expires_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET "
+                "value = CASE WHEN shared_state.expires_at IS NOT NULL AND shared_state.expires_at <= ? "
+                "THEN excluded.value ELSE shared_state.value + excluded.value END, "
+                "expires_at = CASE WHEN shared_state.expires_at IS NOT NULL AND shared_state.expires_at <= ? "
+                "THEN excluded.expires_at ELSE shared_state.expires_at END",
+                (key, json.dumps(amount), self._expiry(ttl_seconds), now, now)
+            )
+            value = conn.execute("SELECT value FROM shared_state WHERE key = ?", (key,)).fetchone()[0]
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        self._after_write(conn)
+        return json.loads(str(value))
+
+    def delete(self, key: str):
+        self._conn().execute("DELETE FROM shared_state WHERE key = ?", (key,))
+
+    @staticmethod
+    def _prefix_range(prefix: str) -> tuple:
+        """Key range holding exactly the keys that start with prefix, so lookups use the primary key index"""
+        return prefix, prefix + "\U0010ffff"
+
+    def delete_prefix(self, prefix: str):
+        self._conn().execute("DELETE FROM shared_state WHERE key >= ? AND key < ?", self._prefix_range(prefix))
+
+    def scan(self, prefix: str) -> Dict[str, Any]:
+        rows = self._conn().execute(
+            "SELECT key, value FROM shared_state WHERE key >= ? AND key < ? "
+            "AND (expires_at IS NULL OR expires_at > ?)",
+            (*self._prefix_range(prefix), time.time())
+        ).fetchall()
+        return {key: json.loads(value) for key, value in rows}
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+class RedisBackend:
+    """Shared state in a Redis-compatible server"""
+
+    is_shared = True
+
+    def __init__(self, dsn: str):
+        import redis  # Optional dependency, only needed for this backend
+        self._client = redis.Redis.from_url(dsn)
+
+    def get(self, key: str) -> Any:
+        value = self._client.get(key)
+        return json.loads(value) if value is not None else None
+
+    def set(self, key: str, value: Any, ttl_seconds: Optional[float] = None):
+        self._client.set(key, json.dumps(value), px=int(ttl_seconds * 1000) if ttl_seconds else None)
+
+    def add(self, key: str, value: Any, ttl_seconds: Optional[float] = None) -> bool:
+        return bool(self._client.set(key, json.dumps(value), nx=True, px=int(ttl_seconds * 1000) if ttl_seconds else None))
+
+    def incr(self, key: str, amount: float = 1, ttl_seconds: Optional[float] = None) -> float:
+        pipe = self._client.pipeline()
+        pipe.incrbyfloat(key, amount)
+        if ttl_seconds:
+            # NX keeps the expiry set by the first increment
+            pipe.expire(key, int(ttl_seconds) + 1, nx=True)
+        return float(pipe.execute()[0])
+
+    def delete(self, key: str):
+        self._client.delete(key)
+
+    def delete_prefix(self, prefix: str):
+        keys = list(self._client.scan_iter(match=prefix + "*"))
+        if keys:
+            self._client.delete(*keys)
+
+    def scan(self, prefix: str) -> Dict[str, Any]:
+        keys = list(self._client.scan_iter(match=prefix + "*"))
+        if not keys:
+            return {}
+        values = self._client.mget(keys)
+        return {
+            key.decode() if isinstance(key, bytes) else key: json.loads(value)
+            for key, value in zip(keys, values) if value is not None
+        }
+
+    def close(self):
+        self._client.close()
+
+
+class SharedState:
+    """Namespaces every key with a prefix and delegates to the configured backend"""
+
+    def __init__(self, backend, key_prefix: str = ""):
+        self.backend = backend
+        self.key_prefix = key_prefix
+
+    @property
+    def is_shared(self) -> bool:
+        """True when other worker processes see the same state"""
+        return self.backend.is_shared
+
+    def get(self, key: str, default: Any = None) -> Any:
+        value = self.backend.get(self.key_prefix + key)
+        return default if value is None else value
+
+    def set(self, key: str, value: Any, ttl_seconds: Optional[float] = None):
+        self.backend.set(self.key_prefix + key, value, ttl_seconds)
+
+    def add(self, key: str, value: Any, ttl_seconds: Optional[float] = None) -> bool:
+        return self.backend.add(self.key_prefix + key, value, ttl_seconds)
+
+    def incr(self, key: str, amount: float = 1, ttl_seconds: Optional[float] = None) -> float:
+        return self.backend.incr(self.key_prefix + key, amount, ttl_seconds)
+
+    def delete(self, key: str):
+        self.backend.delete(self.key_prefix + key)
+
+    def delete_prefix(self, prefix: str):
+        self.backend.delete_prefix(self.key_prefix + prefix)
+
+    def scan(self, prefix: str) -> Dict[str, Any]:
+        offset = len(self.key_prefix)
+        return {key[offset:]: value for key, value in self.backend.scan(self.key_prefix + prefix).items()}
+
+    def close(self):
+        self.backend.close()
+
+
+def create_shared_state(backend: str, sqlite_file: str, redis_dsn: str, key_prefix: str = "") -> SharedState:
+    """Build the configured backend, falling back to SQLite when Redis is unavailable"""
+    if backend == "redis":
+        try:
+            return SharedState(RedisBackend(redis_dsn), key_prefix)
+        except ImportError:
+            print("[SharedState] Redis backend requested but 'redis' is not installed, falling back to SQLite")
+            backend = "sqlite"
+    if backend == "sqlite":
+        return SharedState(SQLiteBackend(sqlite_file), key_prefix)
+    return SharedState(MemoryBackend(), key_prefix)
+
+
+# Global shared state for caches, settings and rate-limit buckets
+shared_state = create_shared_state(
+    settings.shared_state.backend,
+    settings.shared_state.sqlite_file,
+    settings.shared_state.redis_dsn,
+    settings.shared_state.key_prefix
+)
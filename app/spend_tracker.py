@@ -0,0 +1,280 @@
+"""
+Per-project sliding-window spend tracking for the hourly rate limit.
+Each project keeps one ring buffer of time buckets, so checking the hourly
+spend no longer scans the last hour of requests.
+"""
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+from .config import settings
+from .shared_state import shared_state
+
+_EPOCH = datetime(1970, 1, 1)
+
+
+class _ProjectWindow:
+    """Ring buffer of bucket costs for one project"""
+    
+    __slots__ = ("costs", "head", "total")
+    
+    def __init__(self, num_buckets: int):
+        self.costs = [0.0] * num_buckets
+        self.head = None  # Newest bucket id written or expired so far
+        self.total = 0.0
+
+
+class SpendTracker:
+    """
+    Sliding-window spend accumulator.
+    Costs land in fixed-size buckets (one minute by default); advancing the window
+    clears expired buckets, so reads and writes cost O(buckets) at worst.
+    """
+    
+    def __init__(self, window_seconds: int = 3600, bucket_seconds: int = 60):
+        self.window_seconds = window_seconds
+        self.bucket_seconds = bucket_seconds
+        self.num_buckets = max(1, window_seconds // bucket_seconds)
+        self._windows: Dict[str, _ProjectWindow] = {}
+        self._lock = threading.Lock()
+        self._seed_lock = threading.Lock()
+        self._seeded = False
+    
+    def _bucket_id(self, timestamp: datetime) -> int:
+        return int((timestamp - _EPOCH).total_seconds() // self.bucket_seconds)
+    
+    def _advance(self, window: _ProjectWindow, bucket_id: int):
+        """Move the window head forward, clearing buckets that fell out of the window"""
+        if window.head is not None and bucket_id <= window.head:
+            return
+        if window.head is None or bucket_id - window.head >= self.num_buckets:
+            window.costs = [0.0] * self.num_buckets
+        else:
+            for expired in range(window.head + 1, bucket_id + 1):
+                window.costs[expired % self.num_buckets] = 0.0
+        window.head = bucket_id
+        # Re-summing on advance keeps float drift from accumulating
+        window.total = sum(window.costs)
+    
+    def _add_to(self, windows: Dict[str, _ProjectWindow], project_id: str, bucket_id: int, cost_usd: float):
+        """Add a cost to a bucket of one of the given windows (caller holds the lock)"""
+        window = windows.get(project_id)
+        if window is None:
+            window = windows[project_id] = _ProjectWindow(self.num_buckets)
+        self._advance(window, bucket_id)
+        if bucket_id <= window.head - self.num_buckets:
+            return  # Older than the window
+        window.costs[bucket_id % self.num_buckets] += cost_usd
+        window.total += cost_usd
+    
+    def add(self, project_id: str, cost_usd: float, timestamp: Optional[datetime] = None):
+        """Record the cost of a stored request"""
+        if not cost_usd:
+            return
+        bucket_id = self._bucket_id(timestamp or datetime.utcnow())
+        with self._lock:
+            self._add_to(self._windows, project_id, bucket_id, cost_usd)
+    
+    def get_spend(self, project_id: str, now: Optional[datetime] = None) -> float:
+        """Total cost of the project's requests within the window"""
+        self.ensure_seeded()
+        with self._lock:
+            window = self._windows.get(project_id)
+            if window is None:
+                return 0.0
+            self._advance(window, self._bucket_id(now or datetime.utcnow()))
+            return max(0.0, window.total)
+    
+    def snapshot(self, now: Optional[datetime] = None) -> Dict[str, float]:
+        """Current window spend for every project with spend in the window"""
+        self.ensure_seeded()
+        bucket_id = self._bucket_id(now or datetime.utcnow())
+        with self._lock:
+            result = {}
+            for project_id, window in list(self._windows.items()):
+                self._advance(window, bucket_id)
+                if window.total > 0:
+                    result[project_id] = window.total
+                else:
+                    # Idle projects are dropped so the tracker only holds active ones
+                    del self._windows[project_id]
+            return result
+    
+    def forget(self, project_id: str):
+        """Drop a project's window (e.g. after the project is deleted)"""
+        with self._lock:
+            self._windows.pop(project_id, None)
+    
+    def reset(self):
+        with self._lock:
+            self._windows.clear()
+            self._seeded = False
+    
+    def seed(self, rows: List[tuple]):
+        """Load (project_id, timestamp, cost_usd) rows, e.g. the last hour from the DB"""
+        for project_id, timestamp, cost_usd in rows:
+            if timestamp is not None:
+                self.add(project_id, cost_usd or 0.0, timestamp)
+        self._seeded = True
+    
+    def _clear_windows(self):
+        with self._lock:
+            self._windows.clear()
+    
+    def start_sync(self):
+        """Start sharing spend with other workers (no-op for the in-process tracker)"""
+    
+    def stop_sync(self):
+        pass
+    
+    def ensure_seeded(self):
+        """Seed from the database once, for callers that run without the app startup hook"""
+        if not self._seeded:
+            with self._seed_lock:
+                if not self._seeded:
+                    self.seed_from_db()
+    
+    def seed_from_db(self):
+        """Seed every project's window from the requests stored within the window"""
+        from .models import SessionLocal, Request
+        
+        cutoff = datetime.utcnow() - timedelta(seconds=self.window_seconds)
+        db = SessionLocal()
+        try:
+            rows = db.query(
+                Request.project_id,
+                Request.timestamp,
+                Request.total_cost_usd
+            ).filter(Request.timestamp > cutoff).all()
+        except Exception as e:
+            # Start empty rather than failing every rate-limit check
+            print(f"[SpendTracker] Could not seed from database: {str(e)}")
+            rows = []
+        finally:
+            db.close()
+        self._clear_windows()
+        self.seed(rows)
+        print(f"[SpendTracker] Seeded hourly spend from {len(rows)} recent requests")
+
+
+class SharedSpendTracker(SpendTracker):
+    """
+    Sliding-window spend shared by every worker, so they enforce the same hourly budget.
+    Reads and writes stay on the in-process ring buffers; a background thread pushes
+    this worker's new costs to shared state (one counter per project and bucket, expiring
+    with the window) and reloads the buffers from the shared totals every sync interval.
+    Other workers' spend is therefore seen up to one interval late.
+    """
+    
+    def __init__(self, shared, window_seconds: int = 3600, bucket_seconds: int = 60, sync_interval_ms: int = 500):
+        super().__init__(window_seconds, bucket_seconds)
+        self._shared = shared
+        self.sync_interval_ms = sync_interval_ms
+        # Costs recorded locally but not yet pushed: (project_id, bucket_id) -> cost
+        self._pending: Dict[Tuple[str, int], float] = {}
+        self._sync_lock = threading.Lock()
+        self._stop_sync = threading.Event()
+        self._sync_thread: Optional[threading.Thread] = None
+    
+    def _key(self, project_id: str, bucket_id: int = None) -> str:
+        return f"spend:{project_id}:" if bucket_id is None else f"spend:{project_id}:{bucket_id}"
+    
+    def add(self, project_id: str, cost_usd: float, timestamp: Optional[datetime] = None):
+        if not cost_usd:
+            return
+        bucket_id = self._bucket_id(timestamp or datetime.utcnow())
+        with self._lock:
+            self._add_to(self._windows, project_id, bucket_id, cost_usd)
+            key = (project_id, bucket_id)
+            self._pending[key] = self._pending.get(key, 0.0) + cost_usd
+    
+    def sync(self, now: Optional[datetime] = None):
+        """Push this worker's pending costs and reload every window from the shared buckets"""
+        now = now or datetime.utcnow()
+        current = self._bucket_id(now)
+        with self._sync_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+            try:
+                for (project_id, bucket_id), cost in pending.items():
+                    age_seconds = (current - bucket_id) * self.bucket_seconds
+                    if age_seconds >= self.window_seconds:
+                        continue  # Already out of the window
+                    self._shared.incr(self._key(project_id, bucket_id), cost,
+                                      ttl_seconds=self.window_seconds - age_seconds + self.bucket_seconds)
+                shared_buckets = self._shared.scan("spend:")
+            except Exception as e:
+                # Keep the costs for the next attempt; local windows stay as they are
+                with self._lock:
+                    for key, cost in pending.items():
+                        self._pending[key] = self._pending.get(key, 0.0) + cost
+                print(f"[SpendTracker] Could not sync spend with other workers: {str(e)}")
+                return
+            
+            windows: Dict[str, _ProjectWindow] = {}
+            with self._lock:
+                for key, cost in shared_buckets.items():
+                    project_id, _, bucket = key[len("spend:"):].rpartition(":")
+                    if bucket.isdigit():
+                        self._add_to(windows, project_id, int(bucket), float(cost))
+                # Costs added while this sync ran are not in the shared totals yet
+                for (project_id, bucket_id), cost in self._pending.items():
+                    self._add_to(windows, project_id, bucket_id, cost)
+                self._windows = windows
+    
+    def _sync_loop(self):
+        while not self._stop_sync.wait(self.sync_interval_ms / 1000):
+            self.sync()
+    
+    def start_sync(self):
+        """Start the background sync thread (called on app startup)"""
+        if self._sync_thread is not None and self._sync_thread.is_alive():
+            return
+        self._stop_sync.clear()
+        self._sync_thread = threading.Thread(target=self._sync_loop, name="spend-sync", daemon=True)
+        self._sync_thread.start()
+    
+    def stop_sync(self):
+        """Stop the sync thread and push what is still pending (called on app shutdown)"""
+        self._stop_sync.set()
+        if self._sync_thread is not None:
+            self._sync_thread.join(timeout=5)
+            self._sync_thread = None
+        self.sync()
+    
+    def forget(self, project_id: str):
+        with self._lock:
+            self._windows.pop(project_id, None)
+            self._pending = {key: cost for key, cost in self._pending.items() if key[0] != project_id}
+        self._shared.delete_prefix(self._key(project_id))
+    
+    def reset(self):
+        self._clear_windows()
+        self._shared.delete("spend_seeded")
+        self._seeded = False
+    
+    def seed_from_db(self):
+        """
+        Seed from the database only if no worker has done so within the window;
+        buckets written since then are already in shared state.
+        """
+        if self._shared.add("spend_seeded", True, ttl_seconds=self.window_seconds):
+            super().seed_from_db()
+        self.sync()
+        self._seeded = True
+    
+    def _clear_windows(self):
+        with self._lock:
+            self._windows.clear()
+            self._pending.clear()
+        self._shared.delete_prefix("spend:")
+
+
+def create_spend_tracker(shared=None) -> SpendTracker:
+    """Shared buckets when workers share state, the in-process ring buffer otherwise"""
+    if shared is not None and shared.is_shared:
+        return SharedSpendTracker(shared, sync_interval_ms=settings.shared_state.spend_sync_interval_ms)
+    return SpendTracker()
+
+
+# Global tracker for the hourly rate limit
+spend_tracker = create_spend_tracker(shared_state)
@@ -0,0 +1,125 @@
+"""
+Keeps this worker's in-memory request history and near-duplicate index in step
+with requests stored by the other server workers.
+Each worker records the requests it stores itself right away; requests stored by
+other workers are picked up from the requests table, reading only the rows
+appended since the last sync (by SQLite rowid, which grows with every insert),
+at most once per history_sync_interval_ms before an analysis.
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict
+from sqlalchemy import func, literal_column, select
+from .config import settings
+from .history import project_history
+from .models import Request, engine
+from .near_duplicates import near_duplicate_index
+
+# Ids of requests this worker stored but has not yet seen in the table
+_MAX_OWN_IDS = 100000
+
+_ROWID = literal_column("requests.rowid")
+_MAX_ROWID = select(func.coalesce(func.max(_ROWID), 0)).select_from(Request.__table__)
+_NEW_ROWS = select(
+    _ROWID.label("rowid"), Request.id, Request.project_id, Request.prompt_text,
+    Request.timestamp, Request.prompt_tokens, Request.completion_tokens
+)
+
+
+class RequestLogFollower:
+    """Tails the requests table and records other workers' requests in the in-memory state"""
+
+    def __init__(self, interval_ms: int = 100, batch_size: int = 1000):
+        self.interval_ms = interval_ms
+        self.batch_size = batch_size
+        self._last_rowid = None  # None until start(): the follower is inactive
+        self._last_sync = 0.0
+        self._own_ids: "OrderedDict[str, None]" = OrderedDict()
+        self._own_lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self._stats = {"syncs": 0, "rows_read": 0, "foreign_recorded": 0}
+
+    @property
+    def active(self) -> bool:
+        return self._last_rowid is not None
+
+    def start(self):
+        """
+        Follow the table from its current end (called on startup, after the in-memory
+        state was seeded from the database). Only SQLite databases are followed.
+        """
+        if self.interval_ms <= 0 or engine.dialect.name != "sqlite":
+            return
+        with engine.connect() as conn:
+            self._last_rowid = conn.execute(_MAX_ROWID).scalar()
+
+    def stop(self):
+        self._last_rowid = None
+
+    def mark_own(self, request_id: str):
+        """Remember a request stored by this worker, so it is not recorded a second time"""
+        if not self.active:
+            return
+        with self._own_lock:
+            self._own_ids[request_id] = None
+            while len(self._own_ids) > _MAX_OWN_IDS:
+                self._own_ids.popitem(last=False)
+
+    def sync(self, force: bool = False):
+        """Record requests other workers stored since the last sync (throttled to one read per interval)"""
+        if not self.active:
+            return
+        if not force and (time.monotonic() - self._last_sync) * 1000 < self.interval_ms:
+            return
+        with self._sync_lock:
+            if not force and (time.monotonic() - self._last_sync) * 1000 < self.interval_ms:
+                return  # Another thread synced while this one waited
+            try:
+                self._read_new_rows()
+            except Exception as e:
+                print(f"[WorkerSync] Could not read requests stored by other workers: {str(e)}")
+            self._last_sync = time.monotonic()
+
+    def _read_new_rows(self):
+        with engine.connect() as conn:
+            max_rowid = conn.execute(_MAX_ROWID).scalar()
+            if max_rowid < self._last_rowid:
+                # The newest rows were deleted (project deletion), so rowids will be reused
+                self._last_rowid = max_rowid
+            while self._last_rowid < max_rowid:
+                rows = conn.execute(
+                    _NEW_ROWS.where(_ROWID > self._last_rowid).order_by(_ROWID).limit(self.batch_size)
+                ).all()
+                if not rows:
+                    break
+                self._last_rowid = rows[-1].rowid
+                self._record(rows)
+        self._stats["syncs"] += 1
+
+    def _record(self, rows):
+        self._stats["rows_read"] += len(rows)
+        for row in rows:
+            with self._own_lock:
+                if row.id in self._own_ids:
+                    del self._own_ids[row.id]
+                    continue  # Stored by this worker, already recorded
+            if row.timestamp is None:
+                continue
+            # Other workers' consecutive-prompt similarity is not stored, so the running
+            # topic drift keeps averaging only the pairs this worker analyzed
+            project_history.record(row.project_id, row.prompt_text, row.timestamp, row.prompt_tokens or 0,
+                                   row.completion_tokens or 0)
+            near_duplicate_index.add(row.project_id, row.prompt_text, row.timestamp)
+            self._stats["foreign_recorded"] += 1
+
+    def get_stats(self) -> Dict:
+        stats = dict(self._stats)
+        stats["active"] = self.active
+        with self._own_lock:
+            stats["own_pending"] = len(self._own_ids)
+        return stats
+
+
+# Global follower for this worker's in-memory analyzer state
+request_log_follower = RequestLogFollower(interval_ms=settings.analyzer.history_sync_interval_ms)
@@ -0,0 +1,175 @@
+"""
+Write-behind queue for Request records.
+Proxied requests enqueue their record and return immediately; a background
+thread flushes the queue in bulk inserts on a size or time threshold.
+"""
+import queue
+import threading
+import time
+from typing import Any, Dict, List, Optional
+from sqlalchemy import insert
+from .models import WriteSessionLocal, Request
+from .config import settings
+from .rollups import apply_rollups
+from .events import project_events
+
+# Queued by stop() to wake the flusher, which then drains without waiting
+_STOP = object()
+
+
+class RequestWriteQueue:
+    """Batches Request rows in memory and writes them with one INSERT per flush"""
+    
+    def __init__(self, batch_size: int = 200, flush_interval_ms: int = 250, max_queue_size: int = 10000,
+                 retry_attempts: int = 5, retry_backoff_ms: int = 100):
+        self.batch_size = batch_size
+        self.flush_interval_ms = flush_interval_ms
+        self.retry_attempts = max(1, retry_attempts)
+        self.retry_backoff_ms = retry_backoff_ms
+        self._queue: "queue.Queue[Dict[str, Any]]" = queue.Queue(maxsize=max_queue_size)
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            "enqueued": 0,
+            "written": 0,
+            "dropped": 0,  # Records lost because every flush attempt failed or the queue was stopped
+            "retries": 0,  # Flush attempts repeated after a failure
+            "sync_fallbacks": 0,  # Records written inline because the queue was full
+            "flushes": 0,
+            "last_flush_ms": 0.0,
+            "max_flush_ms": 0.0,
+            "total_flush_ms": 0.0,
+        }
+    
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+    
+    def start(self):
+        """Start the background flusher (called on app startup)"""
+        if self.running:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="request-write-queue", daemon=True)
+        self._thread.start()
+    
+    def stop(self, timeout: float = 30.0):
+        """Flush everything still queued and stop (called on app shutdown)"""
+        if not self.running:
+            return
+        self._stop.set()
+        try:
+            self._queue.put(_STOP, timeout=timeout)
+        except queue.Full:
+            pass
+        self._thread.join(timeout)
+        self._thread = None
+        with self._queue.mutex:
+            remaining = sum(1 for item in self._queue.queue if item is not _STOP)
+        if remaining:
+            self._count("dropped", remaining)
+            print(f"[WriteQueue] Shutdown timed out with {remaining} records still queued")
+    
+    def enqueue(self, record: Dict[str, Any]):
+        """Queue a record, writing it inline when the queue is not running or full"""
+        if not self.running:
+            write_records([record])
+            return
+        try:
+            self._queue.put_nowait(record)
+            self._count("enqueued")
+        except queue.Full:
+            self._count("sync_fallbacks")
+            write_records([record])
+    
+    def _run(self):
+        interval = self.flush_interval_ms / 1000
+        while True:
+            batch: List[Dict[str, Any]] = []
+            deadline = time.monotonic() + interval
+            while len(batch) < self.batch_size:
+                try:
+                    if self._stop.is_set():
+                        # Shutting down: write out what is queued without waiting for more
+                        item = self._queue.get_nowait()
+                    else:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            break
+                        item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is not _STOP:
+                    batch.append(item)
+            if batch:
+                self._flush(batch)
+            elif self._stop.is_set():
+                break
+    
+    def _flush(self, batch: List[Dict[str, Any]]):
+        start = time.perf_counter()
+        backoff = self.retry_backoff_ms / 1000
+        for attempt in range(1, self.retry_attempts + 1):
+            try:
+                write_records(batch)
+                self._count("written", len(batch))
+                break
+            except Exception as e:
+                # write_records rolls back on failure, so the whole batch can be retried
+                if attempt == self.retry_attempts:
+                    self._count("dropped", len(batch))
+                    print(f"[WriteQueue] Dropped {len(batch)} records after {attempt} failed flushes: {str(e)}")
+                    break
+                self._count("retries")
+                print(f"[WriteQueue] Flush of {len(batch)} records failed ({str(e)}), retrying in {backoff * 1000:.0f}ms")
+                time.sleep(backoff)
+                backoff *= 2
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        with self._stats_lock:
+            self._stats["flushes"] += 1
+            self._stats["last_flush_ms"] = elapsed_ms
+            self._stats["max_flush_ms"] = max(self._stats["max_flush_ms"], elapsed_ms)
+            self._stats["total_flush_ms"] += elapsed_ms
+    
+    def _count(self, key: str, amount: int = 1):
+        with self._stats_lock:
+            self._stats[key] += amount
+    
+    def get_stats(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            stats = dict(self._stats)
+        total_flush_ms = stats.pop("total_flush_ms")
+        stats["avg_flush_ms"] = round(total_flush_ms / stats["flushes"], 3) if stats["flushes"] else 0.0
+        stats["last_flush_ms"] = round(stats["last_flush_ms"], 3)
+        stats["max_flush_ms"] = round(stats["max_flush_ms"], 3)
+        # Includes the batch currently being collected or flushed
+        stats["queue_depth"] = stats["enqueued"] - stats["written"] - stats["dropped"]
+        stats["running"] = self.running
+        return stats
+
+
+def write_records(records: List[Dict[str, Any]]):
+    """Insert Request records in a single bulk INSERT and fold them into the rollups"""
+    db = WriteSessionLocal()
+    try:
+        db.execute(insert(Request), records)
+        apply_rollups(db, records)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+    # Only announce the change once the rows are visible to readers
+    project_events.publish_stored(records)
+
+
+# Global write-behind queue for proxied requests
+request_write_queue = RequestWriteQueue(
+    batch_size=settings.database.write_batch_size,
+    flush_interval_ms=settings.database.write_flush_interval_ms,
+    max_queue_size=settings.database.write_queue_max_size,
+    retry_attempts=settings.database.write_retry_attempts,
+    retry_backoff_ms=settings.database.write_retry_backoff_ms
+)
@@ -0,0 +1,142 @@
+"""
+Throughput benchmark for the offline backfill (app/backfill.py).
+
+Replays a synthetic request log through analyze_project_rows, the per-worker
+part of the backfill, and reports rows/s per core. The log mixes short
+questions, medium-length prompts, pasted stack traces and debugging loops
+(a prompt re-sent with small edits), spread over a few projects.
+With --db it also runs the full backfill (read, analyze, write back) against
+a temporary SQLite database.
+
+Usage:
+    python benchmarks/backfill_bench.py [--rows 20000] [--projects 4] [--db] [--workers 1]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import analyzer
+from app.analyzer import text_memo
+
+WORDS = ("the request handler returns a value when user calls api model token cost retry "
+         "database query index cache config deploy build test frontend layout button "
+         "why does fix error still same again please explain refactor migrate schema").split()
+
+
+def make_traceback(rng: random.Random, frames: int) -> str:
+    lines = ["Traceback (most recent call last):"]
+    for _ in range(frames):
+        lines.append(f'  File "/srv/app/module_{rng.randint(0, 50)}.py", line {rng.randint(1, 900)}, in func_{rng.randint(0, 99)}')
+        lines.append("    " + " ".join(rng.choice(WORDS) for _ in range(8)))
+    lines.append(rng.choice(["TypeError", "KeyError", "ValueError"]) + ": " + " ".join(rng.choice(WORDS) for _ in range(6)))
+    return "\n".join(lines)
+
+
+def make_prompt(rng: random.Random) -> str:
+    kind = rng.random()
+    if kind < 0.5:
+        return " ".join(rng.choice(WORDS) for _ in range(rng.randint(5, 40)))
+    if kind < 0.85:
+        return " ".join(rng.choice(WORDS) for _ in range(rng.randint(40, 200)))
+    return make_traceback(rng, rng.randint(5, 25))
+
+
+def make_rows(rng: random.Random, count: int, start: datetime):
+    """(request_id, timestamp, model, prompt_text, prompt_tokens, completion_tokens, pattern_score) oldest first"""
+    rows = []
+    prompt = make_prompt(rng)
+    timestamp = start
+    for _ in range(count):
+        roll = rng.random()
+        if roll < 0.3:
+            # Debugging loop: the previous prompt again, slightly edited
+            words = prompt.split(" ")
+            words[rng.randrange(len(words))] = rng.choice(WORDS)
+            prompt = " ".join(words)
+        elif roll < 0.35:
+            prompt = prompt  # Exact resend
+        else:
+            prompt = make_prompt(rng)
+        timestamp += timedelta(seconds=rng.randint(5, 600))
+        rows.append((str(uuid.uuid4()), timestamp, rng.choice(["gpt-4o", "gpt-4o-mini", "claude-3-sonnet"]),
+                     prompt, rng.randint(50, 2000), rng.randint(50, 1500), 0))
+    return rows
+
+
+def clear_memos():
+    """Start cold: the text and ratio memos would otherwise carry over between runs"""
+    text_memo.clear()
+    with analyzer._char_ratios_lock:
+        analyzer._char_ratios.clear()
+
+
+def bench_analysis(rows_per_project, rounds: int = 1):
+    from app.backfill import analyze_project_rows
+
+    total = sum(len(rows) for rows in rows_per_project.values())
+    best = None
+    for _ in range(rounds):
+        clear_memos()
+        started = time.perf_counter()
+        for project_id, rows in rows_per_project.items():
+            analyze_project_rows(project_id, rows)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    print(f"analyze_project_rows: {total} rows in {best:.2f}s = {total / best:,.0f} rows/s per core")
+
+
+def bench_backfill(rows_per_project, workers: int):
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+    from app import backfill
+    from app.models import Base, Request
+
+    with tempfile.TemporaryDirectory() as directory:
+        engine = create_engine(f"sqlite:///{os.path.join(directory, 'bench.db')}")
+        Base.metadata.create_all(engine)
+        Session = sessionmaker(bind=engine)
+        db = Session()
+        db.add_all([
+            Request(id=request_id, project_id=project_id, model=model, prompt_text=prompt, timestamp=timestamp,
+                    prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+            for project_id, rows in rows_per_project.items()
+            for request_id, timestamp, model, prompt, prompt_tokens, completion_tokens, _ in rows
+        ])
+        db.commit()
+        db.close()
+        backfill.SessionLocal = backfill.WriteSessionLocal = Session
+        clear_memos()
+        stats = backfill.run_backfill(workers=workers, checkpoint_path=os.path.join(directory, "ckpt.json"),
+                                      rebuild_rollups=False)
+        engine.dispose()
+    print(f"run_backfill (workers={workers}): {stats['rows']} rows at {stats['rows_per_second']:,.0f} rows/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=20000)
+    parser.add_argument("--projects", type=int, default=4)
+    parser.add_argument("--rounds", type=int, default=1)
+    parser.add_argument("--db", action="store_true", help="Also run the full backfill against a temporary database")
+    parser.add_argument("--workers", type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(5)
+    start = datetime(2025, 3, 1)
+    rows_per_project = {
+        f"project-{i}": make_rows(rng, args.rows // args.projects, start) for i in range(args.projects)
+    }
+    bench_analysis(rows_per_project, args.rounds)
+    if args.db:
+        bench_backfill(rows_per_project, args.workers)
+
+
+if __name__ == "__main__":
+    main()
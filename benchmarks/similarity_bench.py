@@ -0,0 +1,125 @@
+"""
+Micro-benchmark for calculate_similarity.
+
+Compares the previous implementation (re-lowercasing, regex compiled per call,
+SequenceMatcher on every pair) with the current one on a history-sized workload:
+one current prompt scored against several stored prompts, including long pasted
+stack traces. Also checks that exact scores are unchanged, and times prompts
+long enough (20k characters) to switch to the MinHash mode.
+
+Usage:
+    python benchmarks/similarity_bench.py [--rounds 3]
+"""
+import argparse
+import difflib
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.analyzer import calculate_similarity, get_text_features, similarity_mode, text_memo
+
+
+def legacy_calculate_similarity(text1: str, text2: str) -> float:
+    """calculate_similarity before the rework, kept for comparison"""
+    if not text1 or not text2:
+        return 0.0
+    char_similarity = difflib.SequenceMatcher(None, text1.lower(), text2.lower()).ratio()
+    words1 = set(re.findall(r'\b\w+\b', text1.lower()))
+    words2 = set(re.findall(r'\b\w+\b', text2.lower()))
+    word_overlap = len(words1 & words2) / len(words1 | words2) if words1 and words2 else 0.0
+    debug_keywords = [
+        "error", "bug", "fix", "修复", "报错", "exception", "traceback",
+        "typeerror", "valueerror", "keyerror", "attributeerror", "indexerror",
+        "nullpointer", "segfault",
+    ]
+    keyword_match = 0.3 if any(k in text1.lower() and k in text2.lower() for k in debug_keywords) else 0.0
+    len1, len2 = len(text1), len(text2)
+    length_similarity = 1 - abs(len1 - len2) / max(len1, len2)
+    combined = char_similarity * 0.3 + word_overlap * 0.4 + keyword_match * 0.2 + length_similarity * 0.1
+    exc_pattern = re.compile(r"\b[a-zA-Z_]*?(?:error|exception)\b", re.IGNORECASE)
+    exc1 = set(m.group(0).lower() for m in exc_pattern.finditer(text1))
+    exc2 = set(m.group(0).lower() for m in exc_pattern.finditer(text2))
+    if exc1 and exc2 and (exc1 & exc2):
+        combined = min(1.0, combined + 0.35)
+    if "same" in text1.lower() and "same" in text2.lower():
+        combined = min(1.0, combined + 0.2)
+    if "still" in text1.lower() and "still" in text2.lower():
+        combined = min(1.0, combined + 0.15)
+    return float(combined)
+
+
+WORDS = ("the request handler returns a value when user calls api model token cost retry "
+         "database query index cache config deploy build test frontend layout button").split()
+
+
+def make_traceback(rng: random.Random, frames: int) -> str:
+    lines = ["Traceback (most recent call last):"]
+    for i in range(frames):
+        lines.append(f'  File "/srv/app/module_{rng.randint(0, 50)}.py", line {rng.randint(1, 900)}, in func_{rng.randint(0, 99)}')
+        lines.append("    " + " ".join(rng.choice(WORDS) for _ in range(8)))
+    lines.append(rng.choice(["TypeError", "KeyError", "ValueError"]) + ": " + " ".join(rng.choice(WORDS) for _ in range(6)))
+    return "\n".join(lines)
+
+
+def make_workload(rng: random.Random):
+    """(current prompt, history prompts) pairs like analyze_behavior sees them"""
+    workload = []
+    for _ in range(4):
+        short = " ".join(rng.choice(WORDS) for _ in range(rng.randint(5, 30)))
+        history = [" ".join(rng.choice(WORDS) for _ in range(rng.randint(5, 30))) for _ in range(4)]
+        workload.append((short, history + [make_traceback(rng, 20)]))
+        trace = make_traceback(rng, 30)
+        workload.append((trace, [make_traceback(rng, 30), trace.replace("line", "ln"), short, short + " still same error"]))
+    return workload
+
+
+def run(label: str, func, workload, rounds: int, **kwargs) -> float:
+    started = time.perf_counter()
+    for _ in range(rounds):
+        text_memo.clear()  # Each round sees the texts for the first time, like a new request
+        for current, history in workload:
+            for previous in history:
+                func(current, previous, **kwargs)
+    elapsed = time.perf_counter() - started
+    pairs = rounds * sum(len(history) for _, history in workload)
+    print(f"{label:<32} {elapsed * 1000 / pairs:8.3f} ms/pair  ({pairs} pairs)")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args()
+
+    workload = make_workload(random.Random(7))
+    pairs = [(current, previous) for current, history in workload for previous in history]
+    exact_pairs = [pair for pair in pairs if similarity_mode(*pair) == "exact"]
+    mismatches = sum(
+        1 for current, previous in exact_pairs
+        if abs(legacy_calculate_similarity(current, previous) - calculate_similarity(current, previous)) > 1e-12
+    )
+    print(f"Exact-mode score mismatches vs legacy: {mismatches}/{len(exact_pairs)} "
+          f"({len(pairs) - len(exact_pairs)} pairs use the MinHash mode)")
+
+    legacy = run("legacy", legacy_calculate_similarity, workload, args.rounds)
+    exact = run("current", calculate_similarity, workload, args.rounds)
+    rejecting = run("current (reject_below=0.6)", calculate_similarity, workload, args.rounds, reject_below=0.6)
+    print(f"Speedup: {legacy / exact:.1f}x, with quick reject: {legacy / rejecting:.1f}x")
+
+    # Pasted 20k-character tracebacks: quadratic diff vs bounded MinHash mode
+    rng = random.Random(11)
+    long_workload = [(make_traceback(rng, 200), [make_traceback(rng, 200) for _ in range(2)])]
+    current, history = long_workload[0]
+    long_workload[0] = (current, history + [current.replace("line", "ln")])
+    print(f"Long prompts: {len(current)} characters")
+    legacy = run("legacy (long)", legacy_calculate_similarity, long_workload, 1)
+    minhash = run("current (long, minhash)", calculate_similarity, long_workload, 1)
+    print(f"Speedup long: {legacy / minhash:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
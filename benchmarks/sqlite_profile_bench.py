@@ -0,0 +1,145 @@
+"""
+Compare SQLite write/read throughput for the "default" and "production" engine profiles.
+
+Simulates several uvicorn workers: each process runs one writer thread doing
+write-behind style bulk inserts and a few reader threads running dashboard
+style aggregates against the same database file.
+
+Usage:
+    python benchmarks/sqlite_profile_bench.py [--workers 4] [--seconds 5]
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import func, insert
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+
+from app.models import Base, Request, create_engines
+
+PROJECTS = [f"project-{i}" for i in range(20)]
+BATCH_SIZE = 50
+
+
+def make_rows(count: int):
+    now = datetime.utcnow()
+    return [{
+        "id": str(uuid.uuid4()),
+        "timestamp": now - timedelta(seconds=random.randint(0, 86400)),
+        "project_id": random.choice(PROJECTS),
+        "provider": "openai",
+        "model": "gpt-4o",
+        "prompt_tokens": 500,
+        "completion_tokens": 200,
+        "total_cost_usd": 0.0045,
+        "similarity_score": random.random(),
+        "pattern_score": random.randint(0, 5),
+        "advisor_level": random.randint(0, 3),
+        "prompt_text": "0123456789abcdef",
+        "progress_indicator": "exploring",
+        "token_efficiency": 0.4,
+    } for _ in range(count)]
+
+
+def worker(url: str, profile: str, seconds: float, readers: int, results):
+    reader_engine, writer_engine = create_engines(url, profile)
+    Reader = sessionmaker(bind=reader_engine)
+    Writer = sessionmaker(bind=writer_engine)
+    deadline = time.monotonic() + seconds
+    counters = {"rows_written": 0, "reads": 0, "locked_errors": 0}
+    lock = threading.Lock()
+
+    def write_loop():
+        while time.monotonic() < deadline:
+            db = Writer()
+            try:
+                db.execute(insert(Request), make_rows(BATCH_SIZE))
+                db.commit()
+                with lock:
+                    counters["rows_written"] += BATCH_SIZE
+            except OperationalError:
+                db.rollback()
+                with lock:
+                    counters["locked_errors"] += 1
+            finally:
+                db.close()
+
+    def read_loop():
+        while time.monotonic() < deadline:
+            db = Reader()
+            try:
+                since = datetime.utcnow() - timedelta(hours=1)
+                db.query(func.sum(Request.total_cost_usd)).filter(
+                    Request.project_id == random.choice(PROJECTS),
+                    Request.timestamp > since
+                ).scalar()
+                db.query(func.count(Request.id)).filter(
+                    Request.timestamp >= since,
+                    Request.advisor_level >= 2
+                ).scalar()
+                with lock:
+                    counters["reads"] += 1
+            except OperationalError:
+                with lock:
+                    counters["locked_errors"] += 1
+            finally:
+                db.close()
+
+    threads = [threading.Thread(target=write_loop)] + [threading.Thread(target=read_loop) for _ in range(readers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    results.put(counters)
+
+
+def run_profile(profile: str, workers: int, seconds: float, readers: int, seed_rows: int):
+    with tempfile.TemporaryDirectory() as tmp:
+        url = f"sqlite:///{os.path.join(tmp, 'bench.db')}"
+        _, writer_engine = create_engines(url, profile)
+        Base.metadata.create_all(writer_engine)
+        with writer_engine.begin() as conn:
+            for _ in range(seed_rows // 1000):
+                conn.execute(insert(Request), make_rows(1000))
+        writer_engine.dispose()
+
+        results = multiprocessing.Queue()
+        procs = [multiprocessing.Process(target=worker, args=(url, profile, seconds, readers, results)) for _ in range(workers)]
+        for p in procs:
+            p.start()
+        totals = {"rows_written": 0, "reads": 0, "locked_errors": 0}
+        for _ in procs:
+            for key, value in results.get().items():
+                totals[key] += value
+        for p in procs:
+            p.join()
+
+    print(f"{profile:>10}: {totals['rows_written'] / seconds:10.0f} rows/s written  "
+          f"{totals['reads'] / seconds:8.0f} reads/s  {totals['locked_errors']:5d} 'database is locked' errors")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--workers", type=int, default=4, help="processes, like server.workers")
+    parser.add_argument("--readers", type=int, default=3, help="reader threads per process")
+    parser.add_argument("--seconds", type=float, default=5.0)
+    parser.add_argument("--seed-rows", type=int, default=50000)
+    args = parser.parse_args()
+
+    print(f"{args.workers} workers x (1 writer + {args.readers} readers), {args.seconds:.0f}s, {args.seed_rows} seed rows")
+    for profile in ("default", "production"):
+        run_profile(profile, args.workers, args.seconds, args.readers, args.seed_rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -4,6 +4,7 @@
 """
 
 from app.models import SessionLocal, Request, init_db
+from app.write_queue import write_records
 from datetime import datetime, timedelta
 import uuid
 import random
@@ -14,7 +15,6 @@ def create_realistic_test_data():
     
     # 初始化数据库
     init_db()
-    db = SessionLocal()
     
     # 真实用户项目配置
     projects = [
@@ -76,6 +76,7 @@ def create_realistic_test_data():
     # 生成过去30天的数据（更真实的时间跨度）
     base_date = datetime.utcnow()
     total_requests = 0
+    records = []
     
     for day in range(30, -1, -1):
         date = base_date - timedelta(days=day)
@@ -146,7 +147,7 @@ def create_realistic_test_data():
                 token_efficiency = completion_tokens / prompt_tokens if prompt_tokens > 0 else 0
                 
                 # 创建请求记录（100%真实数据格式）
-                request = Request(
+                records.append(dict(
                     id=str(uuid.uuid4()),
                     timestamp=timestamp,
                     project_id=project_id,
@@ -161,14 +162,12 @@ def create_realistic_test_data():
                     prompt_text=f"用户请求 - 项目: {project_id}, 时间: {timestamp.strftime('%Y-%m-%d %H:%M')}",
                     progress_indicator=progress_indicator,
                     token_efficiency=round(token_efficiency, 3)
-                )
+                ))
                 
-                db.add(request)
                 total_requests += 1
     
-    # 提交到数据库
-    db.commit()
-    db.close()
+    # 提交到数据库（与代理写入走同一路径，同时更新小时/天汇总表）
+    write_records(records)
     
     print(f"✅ 成功创建 {total_requests} 条真实用户模拟记录")
     print("=== 数据统计 ===")
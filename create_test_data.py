@@ -4,6 +4,7 @@
 """
 
 from app.models import SessionLocal, Request, init_db
+from app.write_queue import write_records
 from datetime import datetime, timedelta
 import uuid
 import random
@@ -14,7 +15,6 @@ def create_test_data():
     
     # 初始化数据库
     init_db()
-    db = SessionLocal()
     
     # 定义测试项目
     projects = ["test-project", "demo-app", "api-monitor", "ai-assistant", "chatbot-service"]
@@ -33,6 +33,7 @@ def create_test_data():
     # 生成过去7天的数据
     base_date = datetime.utcnow()
     total_requests = 0
+    records = []
     
     for day in range(7, -1, -1):
         date = base_date - timedelta(days=day)
@@ -76,7 +77,7 @@ def create_test_data():
                 advisor_level = 1
             
             # 创建请求记录
-            request = Request(
+            records.append(dict(
                 id=str(uuid.uuid4()),
                 timestamp=timestamp,
                 project_id=project_id,
@@ -91,14 +92,12 @@ def create_test_data():
                 prompt_text=f"测试请求 {i} - 项目 {project_id}",
                 progress_indicator=random.choice(["stuck", "exploring", "refining", "resolved"]),
                 token_efficiency=round(completion_tokens / prompt_tokens, 2) if prompt_tokens > 0 else 0
-            )
+            ))
             
-            db.add(request)
             total_requests += 1
     
-    # 提交到数据库
-    db.commit()
-    db.close()
+    # 提交到数据库（与代理写入走同一路径，同时更新小时/天汇总表）
+    write_records(records)
     
     print(f"✅ 成功创建 {total_requests} 条测试记录")
     print("=== 测试数据统计 ===")
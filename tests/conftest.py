@@ -0,0 +1,12 @@
+"""
+测试共用配置：共享状态使用进程内存后端，测试不会在当前目录生成 data/shared_state.db
+"""
+
+import sys
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.config import settings
+
+settings.shared_state.backend = "memory"
@@ -0,0 +1,97 @@
+"""
+分析线程池（时间预算、过载保护、降级结果）的场景测试
+"""
+
+import sys
+import os
+import asyncio
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import analysis_pool
+from app.analysis_pool import degraded_analysis, run_analysis
+from app.config import settings
+
+
+def _blocking_analysis(release: threading.Event):
+    def analyze(project_id, messages, model):
+        release.wait(5)
+        return {"level": 2, "confidence": 0.9, "reasons": [], "details": {"similarity": 0.8}}
+    return analyze
+
+
+def test_degraded_result_shape():
+    """
+    场景：分析无法按时完成时使用的降级结果
+    预期：级别为0，包含代理读取的所有字段，并标明降级原因
+    """
+    result = degraded_analysis("timeout")
+    assert result["level"] == 0
+    details = result["details"]
+    assert details["degraded"] is True and details["degraded_reason"] == "timeout"
+    for key in ("similarity", "emotion_score", "progress", "topic_drift", "repeat_count"):
+        assert key in details
+
+
+def test_analysis_within_budget_returns_real_result(monkeypatch):
+    """
+    场景：分析在时间预算内完成
+    预期：返回真实分析结果，且在途计数归零
+    """
+    release = threading.Event()
+    release.set()
+    monkeypatch.setattr(analysis_pool, "analyze_behavior", _blocking_analysis(release))
+
+    result = asyncio.run(run_analysis("pool-test", [{"role": "user", "content": "hi"}]))
+    assert result["level"] == 2
+    assert analysis_pool._inflight == 0
+
+
+def test_time_budget_exceeded_returns_degraded(monkeypatch):
+    """
+    场景：分析超过 time_budget_ms 仍未完成
+    预期：不等待分析，立即返回 timeout 降级结果；后台分析结束后在途计数归零
+    """
+    release = threading.Event()
+    monkeypatch.setattr(analysis_pool, "analyze_behavior", _blocking_analysis(release))
+    monkeypatch.setattr(settings.analyzer, "time_budget_ms", 50)
+
+    result = asyncio.run(run_analysis("pool-test", []))
+    assert result["details"]["degraded_reason"] == "timeout"
+
+    release.set()
+    for _ in range(100):
+        if analysis_pool._inflight == 0:
+            break
+        time.sleep(0.01)
+    assert analysis_pool._inflight == 0
+
+
+def test_overload_returns_degraded_without_queueing(monkeypatch):
+    """
+    场景：在途分析数已达到 max_pending
+    预期：新请求不排队，直接返回 overloaded 降级结果；分析异常时返回 error 降级结果
+    """
+    release = threading.Event()
+    monkeypatch.setattr(analysis_pool, "analyze_behavior", _blocking_analysis(release))
+    monkeypatch.setattr(settings.analyzer, "max_pending", 1)
+    monkeypatch.setattr(settings.analyzer, "time_budget_ms", 5000)
+
+    async def run():
+        first = asyncio.create_task(run_analysis("pool-test", []))
+        await asyncio.sleep(0.05)
+        second = await run_analysis("pool-test", [])
+        release.set()
+        return await first, second
+
+    first, second = asyncio.run(run())
+    assert first["level"] == 2
+    assert second["details"]["degraded_reason"] == "overloaded"
+
+    def failing(project_id, messages, model):
+        raise ValueError("boom")
+
+    monkeypatch.setattr(analysis_pool, "analyze_behavior", failing)
+    assert asyncio.run(run_analysis("pool-test", []))["details"]["degraded_reason"] == "error"
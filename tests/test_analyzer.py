@@ -205,6 +205,92 @@ def test_cross_project_requests_should_not_affect():
     assert result_a["level"] >= 1, "项目A的重复应该被检测到"
 
 
+# ============================================
+# 场景：有历史记录时话题漂移增量计算
+# ============================================
+
+def test_topic_drift_uses_running_average():
+    """
+    场景：项目已有历史记录，连续两次分析并存储请求
+    预期：每次只新算一对（当前提问与上一条）完整相似度；话题漂移来自项目的滑动平均，
+         存储时附带的 pair_similarity 会更新该平均
+    """
+    from app import analyzer
+    from app.history import project_history
+
+    now = datetime.utcnow()
+    for i, prompt in enumerate(["fix the login bug in auth.py", "now write docs for the api",
+                                "translate the readme to french"]):
+        project_history.record("drift-project", prompt, now + timedelta(seconds=i))
+
+    first = analyze_behavior("drift-project", create_messages("translate the readme to german"))
+    pair = first["details"]["pair_similarity"]
+    assert pair == analyzer.calculate_similarity("translate the readme to german", "translate the readme to french")
+    project_history.record("drift-project", "translate the readme to german", now + timedelta(seconds=5),
+                           pair_similarity=pair)
+
+    with patch.object(analyzer, "calculate_topic_drift") as full_drift:
+        second = analyze_behavior("drift-project", create_messages("translate the readme to spanish"))
+    full_drift.assert_not_called()
+
+    running = project_history.blend_pair_similarity(
+        project_history.get_pair_similarity("drift-project"), second["details"]["pair_similarity"]
+    )
+    assert second["details"]["topic_drift"] == pytest.approx(1 - running)
+    project_history.forget("drift-project")
+
+
+# ============================================
+# 场景：快速拒绝不影响报告的相似度
+# ============================================
+
+def test_reported_similarity_matches_unbounded_scoring():
+    """
+    场景：当前提问与最近几条历史（以及无历史时的消息序列）比较，部分文本对只用上下界判断（快速拒绝）
+    预期：details["similarity"]、级别和原因与每一对都完整计算的结果一致
+    """
+    import random
+    from app import analyzer
+    from app.history import ProjectHistoryCache
+    from app.near_duplicates import NearDuplicateIndex
+
+    words = "same error still fix the api call returns TypeError when user config cache login docs".split()
+    rng = random.Random(17)
+    unbounded_similarity = analyzer.calculate_similarity
+    unbounded_privacy_aware = analyzer.calculate_similarity_privacy_aware
+    now = datetime.utcnow()
+
+    for _ in range(60):
+        prompts = [" ".join(rng.choice(words) for _ in range(rng.randint(1, 12))) for _ in range(6)]
+        history = ProjectHistoryCache()
+        for i, prompt in enumerate(prompts[:-1]):
+            history.record("bound-project", prompt, now + timedelta(seconds=i))
+        runs = []
+        for bounded in (True, False):
+            patches = [] if bounded else [
+                patch.object(analyzer, "calculate_similarity",
+                             lambda a, b, reject_below=None: unbounded_similarity(a, b)),
+                patch.object(analyzer, "calculate_similarity_privacy_aware",
+                             lambda a, b, reject_below=None: unbounded_privacy_aware(a, b)),
+                patch.object(analyzer, "similarity_bounds_privacy_aware", lambda a, b: (0.0, float("inf"))),
+            ]
+            for p in patches:
+                p.start()
+            try:
+                runs.append((
+                    analyze_behavior("bound-project", create_messages(prompts[-1]), history=history,
+                                     duplicates=NearDuplicateIndex()),
+                    analyze_behavior("bound-project", create_messages(*prompts), use_history=False),
+                ))
+            finally:
+                for p in patches:
+                    p.stop()
+        for with_bound, without_bound in zip(*runs):
+            assert with_bound["details"]["similarity"] == without_bound["details"]["similarity"]
+            assert with_bound["level"] == without_bound["level"]
+            assert with_bound["reasons"] == without_bound["reasons"]
+
+
 if __name__ == "__main__":
     # 运行所有测试
     pytest.main([__file__, "-v"])
\ No newline at end of file
@@ -0,0 +1,222 @@
+"""
+历史请求分析结果回填任务的场景测试
+"""
+
+import sys
+import os
+import uuid
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app import backfill
+from app.models import Base, Request
+
+LOOP_PROMPT = "TypeError: 'NoneType' object is not subscriptable in parse_config, same error again"
+CALM_PROMPTS = ["write a haiku about autumn", "translate the readme to french", "explain python decorators",
+                "design a schema for invoices", "summarize this meeting transcript"]
+
+
+def _setup_db(tmp_path, monkeypatch):
+    engine = create_engine(f"sqlite:///{tmp_path / 'backfill.db'}")
+    Base.metadata.create_all(engine)
+    Session = sessionmaker(bind=engine)
+    monkeypatch.setattr(backfill, "SessionLocal", Session)
+    monkeypatch.setattr(backfill, "WriteSessionLocal", Session)
+
+    start = datetime(2025, 3, 1, 10, 0, 0)
+    rows = []
+    for i in range(6):
+        rows.append(Request(id=str(uuid.uuid4()), project_id="loop", model="gpt-4o", prompt_text=LOOP_PROMPT,
+                            timestamp=start + timedelta(seconds=10 * i), prompt_tokens=500, completion_tokens=100))
+    for i, prompt in enumerate(CALM_PROMPTS):
+        rows.append(Request(id=str(uuid.uuid4()), project_id="calm", model="gpt-4o", prompt_text=prompt,
+                            timestamp=start + timedelta(minutes=10 * i), prompt_tokens=100, completion_tokens=300))
+    db = Session()
+    db.add_all(rows)
+    db.commit()
+    db.close()
+    return Session
+
+
+def _stored(Session, project_id):
+    db = Session()
+    try:
+        return db.query(Request).filter(Request.project_id == project_id).order_by(Request.timestamp).all()
+    finally:
+        db.close()
+
+
+def test_backfill_replays_each_project_in_order(tmp_path, monkeypatch):
+    """
+    场景：两个项目的历史请求尚无分析结果，按小块（4行）分页回填
+    预期：所有行都写回分析列；跨页的项目按时间顺序重放历史，重复报错的项目最终被判定为卡住并告警
+    """
+    Session = _setup_db(tmp_path, monkeypatch)
+    stats = backfill.run_backfill(workers=1, chunk_size=4, checkpoint_path=str(tmp_path / "ckpt.json"),
+                                  rebuild_rollups=False)
+
+    assert stats["rows"] == 11 and stats["projects"] == 2
+    loop_rows = _stored(Session, "loop")
+    assert all(row.advisor_level is not None and row.progress_indicator for row in loop_rows)
+    assert loop_rows[0].similarity_score == 0.0  # 第一条没有历史可比
+    assert loop_rows[-1].similarity_score == 1.0
+    assert loop_rows[-1].progress_indicator == "stuck"
+    assert loop_rows[-1].advisor_level >= 1
+    assert max(row.advisor_level for row in _stored(Session, "calm")) == 0
+    assert not os.path.exists(tmp_path / "ckpt.json")  # 完成后删除检查点
+
+
+def _add_long_project(Session, project_id="solo", count=40):
+    """一个项目的长历史：调试循环、无关提问和没有内容的请求交替出现"""
+    prompts = []
+    for i in range(count):
+        if i % 9 == 1:
+            prompts.append(None)
+        elif i % 3 == 0:
+            prompts.append(LOOP_PROMPT + (" again" * (i % 4)))
+        else:
+            prompts.append(CALM_PROMPTS[i % len(CALM_PROMPTS)])
+    start = datetime(2025, 3, 2, 9, 0, 0)
+    db = Session()
+    db.add_all([Request(id=f"{project_id}-{i:03d}", project_id=project_id, model="gpt-4o", prompt_text=prompt,
+                        timestamp=start + timedelta(minutes=3 * i), prompt_tokens=400, completion_tokens=150)
+                for i, prompt in enumerate(prompts)])
+    db.commit()
+    db.close()
+
+
+def _columns(Session):
+    db = Session()
+    try:
+        return [(row.id, row.similarity_score, row.pattern_score, row.advisor_level, row.progress_indicator)
+                for row in db.query(Request).order_by(Request.project_id, Request.timestamp, Request.id).all()]
+    finally:
+        db.close()
+
+
+def _reset_columns(Session):
+    db = Session()
+    db.query(Request).update({"similarity_score": None, "pattern_score": None, "advisor_level": None,
+                              "progress_indicator": None})
+    db.commit()
+    db.close()
+
+
+def test_segments_match_whole_project_replay(tmp_path, monkeypatch):
+    """
+    场景：同一批数据（包括没有内容的请求）按不同的分段大小回填，分段切在项目中间
+    预期：写回的分析列与整项目顺序重放完全一致（历史、近似重复窗口和话题漂移均值跨段延续）
+    """
+    Session = _setup_db(tmp_path, monkeypatch)
+    _add_long_project(Session)
+    checkpoint = str(tmp_path / "ckpt.json")
+
+    backfill.run_backfill(workers=1, chunk_size=1000, checkpoint_path=checkpoint, rebuild_rollups=False)
+    whole = _columns(Session)
+    for segment_size in (1, 2, 7):
+        _reset_columns(Session)
+        backfill.run_backfill(workers=1, chunk_size=5, segment_size=segment_size, checkpoint_path=checkpoint,
+                              rebuild_rollups=False)
+        assert _columns(Session) == whole
+
+
+def test_backfill_resumes_inside_a_project(tmp_path, monkeypatch):
+    """
+    场景：回填在项目 "solo" 中途中断（写入第4段时失败），然后再次运行
+    预期：检查点记录最后写入的请求；再次运行从该请求之后继续，只处理剩余行，最终结果与一次跑完一致
+    """
+    Session = _setup_db(tmp_path, monkeypatch)
+    _add_long_project(Session)
+    checkpoint = str(tmp_path / "ckpt.json")
+    backfill.run_backfill(workers=1, checkpoint_path=checkpoint, rebuild_rollups=False)
+    expected = _columns(Session)
+    _reset_columns(Session)
+
+    write_results = backfill.write_results
+    calls = []
+
+    def failing_write(results):
+        calls.append(len(results))
+        if len(calls) == 4:
+            raise RuntimeError("interrupted")
+        write_results(results)
+
+    monkeypatch.setattr(backfill, "write_results", failing_write)
+    try:
+        backfill.run_backfill(workers=1, chunk_size=6, checkpoint_path=checkpoint, rebuild_rollups=False)
+    except RuntimeError:
+        pass
+    state = backfill.load_checkpoint(checkpoint)
+    assert state["last_key"][0] == "solo" and 11 < state["rows"] < 51
+
+    monkeypatch.setattr(backfill, "write_results", write_results)
+    stats = backfill.run_backfill(workers=1, chunk_size=6, checkpoint_path=checkpoint, rebuild_rollups=False)
+    assert stats["rows"] == 51 - state["rows"]
+    assert _columns(Session) == expected
+
+
+def test_privacy_mode_rows_keep_the_stored_pattern_score(tmp_path, monkeypatch):
+    """
+    场景：隐私模式下只存储了 simhash 指纹和当时算出的 pattern_score（情绪分），然后回填
+    预期：pattern_score 保持不变并参与打分；相似度、级别和进度与当时（有原文时）的分析一致，不会因为原文缺失被降级
+    """
+    from app.analyzer import analyze_behavior, compute_simhash_hex
+    from app.history import HistoryEntry, ProjectHistoryCache
+    from app.near_duplicates import NearDuplicateIndex
+
+    Session = _setup_db(tmp_path, monkeypatch)
+    prompts = ["the checkout page is still not loading for mobile users",
+               "checkout page still not loading on mobile, same problem as before",
+               "checkout page still not loading on mobile, same problem, still the same",
+               "checkout page still not loading on mobile, same problem, nothing changed",
+               "checkout page still not loading on mobile, same problem, still the same again"]
+    # 代理当时的分析：当前提问是原文，历史里存的是指纹
+    history, duplicates = ProjectHistoryCache(), NearDuplicateIndex()
+    start = datetime(2025, 3, 3, 12, 0, 0)
+    rows, live = [], []
+    for i, prompt in enumerate(prompts):
+        timestamp = start + timedelta(seconds=30 * i)
+        fingerprint = compute_simhash_hex(prompt)
+        analysis = analyze_behavior("private", [{"role": "user", "content": prompt}], "gpt-4o", history=history,
+                                    duplicates=duplicates,
+                                    current=HistoryEntry("private", fingerprint, timestamp, 300, 50))
+        history.record("private", fingerprint, timestamp, 300, 50, analysis["details"]["pair_similarity"])
+        duplicates.add("private", fingerprint, timestamp, now=timestamp)
+        live.append(analysis)
+        rows.append(Request(id=f"private-{i}", project_id="private", model="gpt-4o", prompt_text=fingerprint,
+                            timestamp=timestamp, prompt_tokens=300, completion_tokens=50,
+                            pattern_score=analysis["details"]["emotion_score"]))
+    assert live[-1]["details"]["emotion_score"] > 0 and live[-1]["level"] >= 1
+    db = Session()
+    db.add_all(rows)
+    db.commit()
+    db.close()
+
+    backfill.run_backfill(workers=1, project_id="private", checkpoint_path=str(tmp_path / "ckpt.json"),
+                          rebuild_rollups=False)
+    for row, analysis in zip(_stored(Session, "private"), live):
+        assert row.pattern_score == analysis["details"]["emotion_score"]
+        assert row.similarity_score == analysis["details"]["similarity"]
+        assert row.advisor_level == analysis["level"]
+        assert row.progress_indicator == analysis["details"]["progress"]
+
+
+def test_backfill_worker_processes_match_in_process(tmp_path, monkeypatch):
+    """
+    场景：同一批数据分别用单进程和2个工作进程回填；其中一个项目较长，被切成多段分给不同进程
+    预期：写回的分析列完全一致
+    """
+    Session = _setup_db(tmp_path, monkeypatch)
+    _add_long_project(Session)
+    checkpoint = str(tmp_path / "ckpt.json")
+
+    backfill.run_backfill(workers=1, checkpoint_path=checkpoint, rebuild_rollups=False)
+    in_process = _columns(Session)
+    _reset_columns(Session)
+    stats = backfill.run_backfill(workers=2, chunk_size=8, checkpoint_path=checkpoint, rebuild_rollups=False)
+    assert stats["rows"] == 51 and stats["projects"] == 3
+    assert _columns(Session) == in_process
@@ -0,0 +1,118 @@
+"""
+批量行为分析（日志回放）的场景测试
+"""
+
+import sys
+import os
+import json
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.analyzer import analyze_behavior
+from app.analysis_pool import analyze_batch, shutdown_analysis_pool
+
+
+def _replayed_conversation(project_id: str, turns):
+    """逐轮回放一段对话：第 i 项包含前 i 轮用户消息"""
+    items = []
+    for i in range(1, len(turns) + 1):
+        items.append({
+            "project_id": project_id,
+            "messages": [{"role": "user", "content": text} for text in turns[:i]],
+            "model": "gpt-4o"
+        })
+    return items
+
+
+TURNS = [
+    "TypeError: 'NoneType' object is not subscriptable in parse_config",
+    "still the same error after adding the None check",
+    "same error, nothing changed",
+    "TypeError: 'NoneType' object is not subscriptable in parse_config",
+]
+
+
+def test_batch_matches_single_analysis_in_order():
+    """
+    场景：回放两段对话，共8项，单进程批量分析
+    预期：结果按输入顺序返回，带 index/project_id，且与逐条无状态分析结果一致
+    """
+    items = _replayed_conversation("replay-a", TURNS) + _replayed_conversation("replay-b", TURNS[:2] + ["write docs", "thanks"])
+    results = list(analyze_batch(items, workers=1, chunk_size=3))
+
+    assert [r["index"] for r in results] == list(range(len(items)))
+    for item, result in zip(items, results):
+        expected = analyze_behavior(item["project_id"], item["messages"], item["model"], use_history=False)
+        assert result["project_id"] == item["project_id"]
+        assert result["level"] == expected["level"]
+        assert result["details"]["similarity"] == expected["details"]["similarity"]
+
+
+def test_batch_in_worker_processes():
+    """
+    场景：用2个工作进程分析同一批数据
+    预期：结果与单进程一致，顺序不变
+    """
+    items = _replayed_conversation("replay-c", TURNS) * 3
+    try:
+        parallel = list(analyze_batch(items, workers=2, chunk_size=4))
+    finally:
+        shutdown_analysis_pool()
+    local = list(analyze_batch(items, workers=1))
+    assert [(r["index"], r["level"], r["details"]["progress"]) for r in parallel] == \
+        [(r["index"], r["level"], r["details"]["progress"]) for r in local]
+
+
+def test_batch_endpoint_streams_ndjson():
+    """
+    场景：通过 POST /api/analyzer/batch 提交批量请求
+    预期：返回 NDJSON，每行一个结果；超过条数上限返回413
+    """
+    from fastapi.testclient import TestClient
+    from app.main import app
+    from app.config import settings
+
+    client = TestClient(app)
+    body = {"items": _replayed_conversation("replay-d", TURNS), "workers": 1}
+    response = client.post("/api/analyzer/batch", json=body)
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    lines = [json.loads(line) for line in response.text.splitlines() if line]
+    assert [line["index"] for line in lines] == [0, 1, 2, 3]
+
+    original = settings.analyzer.batch_max_items
+    settings.analyzer.batch_max_items = 2
+    try:
+        assert client.post("/api/analyzer/batch", json=body).status_code == 413
+    finally:
+        settings.analyzer.batch_max_items = original
+
+
+def test_concurrent_batches_share_one_bounded_pool():
+    """
+    场景：两个批量请求交替读取结果，分别请求2个和1000个工作进程
+    预期：工作进程数被限制在 analyzer.batch.workers；第二个请求不会替换（并取消）第一个请求正在使用的进程池，
+         两个请求都拿到完整、有序的结果
+    """
+    from app import analysis_pool
+    from app.config import settings
+
+    original = settings.analyzer.batch_workers
+    settings.analyzer.batch_workers = 2
+    items = _replayed_conversation("replay-e", TURNS) * 2
+    try:
+        first = analyze_batch(items, workers=2, chunk_size=1)
+        first_results = [next(first)]
+        pool = analysis_pool._batch_executor
+        assert pool is not None and pool._max_workers == 2
+
+        second_results = list(analyze_batch(items, workers=1000, chunk_size=1))
+        assert analysis_pool._batch_executor is pool
+        first_results.extend(first)
+    finally:
+        settings.analyzer.batch_workers = original
+        shutdown_analysis_pool()
+
+    expected = [(r["index"], r["level"]) for r in analyze_batch(items, workers=1)]
+    assert [(r["index"], r["level"]) for r in first_results] == expected
+    assert [(r["index"], r["level"]) for r in second_results] == expected
@@ -0,0 +1,103 @@
+"""
+效率分析缓存的场景测试
+"""
+
+import sys
+import os
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.analyzer import EfficiencyCache
+
+
+def test_lru_eviction_and_ttl_expiry():
+    """
+    场景：缓存条目超过容量上限，且部分条目已过期
+    预期：最久未使用的条目被淘汰，过期条目被后台清理删除，统计计数准确
+    """
+    cache = EfficiencyCache(ttl_seconds=60, max_entries=2)
+    cache.set("a", "7d", {"v": 1})
+    cache.set("b", "7d", {"v": 2})
+    assert cache.get("a", "7d") == {"v": 1}  # a 变为最近使用
+    cache.set("c", "7d", {"v": 3})
+
+    assert cache.get("b", "7d") is None
+    assert cache.get("a", "7d") == {"v": 1}
+    stats = cache.get_stats()
+    assert stats["evictions"] == 1
+    assert stats["hits"] == 2 and stats["misses"] == 1
+    assert "cache_keys" not in stats
+
+    cache._default_ttl = 0
+    cache.set("d", "7d", {"v": 4})  # 淘汰 c，d 立即过期
+    assert cache.sweep_expired() == 1
+    assert cache.get("a", "7d") == {"v": 1}
+    assert cache.get_stats()["size"] == 1
+
+
+def test_concurrent_misses_compute_once():
+    """
+    场景：多个请求同时查询同一个未缓存的项目
+    预期：只执行一次计算，其余请求等待并共享结果
+    """
+    cache = EfficiencyCache(ttl_seconds=60, max_entries=10)
+    calls = []
+    release = threading.Event()
+
+    def compute():
+        calls.append(1)
+        release.wait(5)
+        return {"metrics": {}}
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get_or_compute("p", "7d", compute))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.1)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    assert len(results) == 8
+    assert sum(1 for _, shared in results if not shared) == 1
+    assert cache.get_stats()["coalesced"] == 7
+    assert cache.get("p", "7d") == {"metrics": {}}
+
+
+def test_invalidation_during_computation_is_not_cached():
+    """
+    场景：计算进行中项目缓存被失效
+    预期：本次计算结果照常返回，但不写入缓存，避免缓存旧数据
+    """
+    cache = EfficiencyCache(ttl_seconds=60, max_entries=10)
+
+    def compute():
+        cache.invalidate("p")
+        return {"metrics": {}}
+
+    result, shared = cache.get_or_compute("p", "7d", compute)
+    assert result == {"metrics": {}} and not shared
+    assert cache.get("p", "7d") is None
+
+
+def test_stored_requests_invalidate_project_cache():
+    """
+    场景：项目A有新请求写入
+    预期：发布项目变更事件后，项目A的缓存失效，项目B的缓存保留
+    """
+    from app.analyzer import efficiency_cache
+    from app.events import project_events
+
+    efficiency_cache.set("project-a", "7d", {"metrics": {}})
+    efficiency_cache.set("project-a", "30d", {"metrics": {}})
+    efficiency_cache.set("project-b", "7d", {"metrics": {}})
+
+    project_events.publish_stored([{"project_id": "project-a", "total_cost_usd": 0.1}])
+
+    assert efficiency_cache.get("project-a", "7d") is None
+    assert efficiency_cache.get("project-a", "30d") is None
+    assert efficiency_cache.get("project-b", "7d") == {"metrics": {}}
+    efficiency_cache.invalidate()
@@ -0,0 +1,79 @@
+"""
+项目历史缓存的场景测试
+"""
+
+import sys
+import os
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.history import ProjectHistoryCache
+
+
+def test_recent_history_newest_first_and_bounded():
+    """
+    场景：同一项目连续存储多条请求
+    预期：只保留最近N条，按时间倒序返回
+    """
+    history = ProjectHistoryCache(entries_per_project=3)
+    start = datetime(2025, 1, 1, 12, 0, 0)
+    for i in range(5):
+        history.record("project-a", f"prompt {i}", start + timedelta(seconds=i), 100, 50)
+
+    recent = history.get_recent("project-a", limit=5)
+    assert [entry.prompt_text for entry in recent] == ["prompt 4", "prompt 3", "prompt 2"]
+    assert history.get_recent("project-b") == []
+
+
+def test_least_recently_used_project_is_evicted():
+    """
+    场景：项目数量超过上限
+    预期：最久未使用的项目被淘汰，最近读取过的项目保留
+    """
+    history = ProjectHistoryCache(entries_per_project=5, max_projects=2)
+    now = datetime(2025, 1, 1, 12, 0, 0)
+    history.record("project-a", "a", now)
+    history.record("project-b", "b", now)
+    history.get_recent("project-a")  # project-a 变为最近使用
+    history.record("project-c", "c", now)
+
+    assert history.get_recent("project-b") == []
+    assert history.get_recent("project-a")[0].prompt_text == "a"
+    assert history.get_stats()["evictions"] == 1
+
+
+def test_memory_cap_evicts_projects():
+    """
+    场景：超长prompt占满内存上限
+    预期：按LRU淘汰项目，直到低于上限
+    """
+    history = ProjectHistoryCache(entries_per_project=5, max_bytes=5000)
+    now = datetime(2025, 1, 1, 12, 0, 0)
+    history.record("project-a", "x" * 3000, now)
+    history.record("project-b", "y" * 3000, now)
+
+    assert history.get_recent("project-a") == []
+    assert history.get_stats()["bytes"] <= 5000
+
+
+def test_running_pair_similarity_is_exponentially_weighted():
+    """
+    场景：存储请求时附带与上一条提问的相似度
+    预期：项目的滑动平均按EWMA更新；未提供相似度的记录不改变它；删除项目后清空
+    """
+    history = ProjectHistoryCache(drift_alpha=0.5)
+    now = datetime(2025, 1, 1, 12, 0, 0)
+    history.record("project-a", "first", now)
+    assert history.get_pair_similarity("project-a") is None
+
+    history.record("project-a", "second", now + timedelta(seconds=1), pair_similarity=1.0)
+    history.record("project-a", "third", now + timedelta(seconds=2), pair_similarity=0.0)
+    history.record("project-a", "fourth", now + timedelta(seconds=3))
+    assert history.get_pair_similarity("project-a") == 0.5
+
+    history.seed_pair_similarity("project-a", 0.9)  # 已有值时不覆盖
+    assert history.get_pair_similarity("project-a") == 0.5
+
+    history.forget("project-a")
+    assert history.get_pair_similarity("project-a") is None
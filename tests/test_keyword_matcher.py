@@ -0,0 +1,80 @@
+"""
+多模式关键词匹配的场景测试
+"""
+
+import sys
+import os
+import random
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.config import settings
+from app.keyword_matcher import KeywordMatcher
+from app.analyzer import (
+    EMOTION_KEYWORDS, TASK_PATTERNS, analyze_behavior, detect_emotion, detect_task_type, get_keyword_matcher
+)
+
+WORDS = ("same error", "still not", "def ", "function", "TypeError", "报错", "修复", "优化", "换个",
+         "write", "search", "unchanged", "fix", "prefix", "the", "api", "一样的")
+
+
+def test_matches_equal_per_list_scans():
+    """
+    场景：随机拼接的文本分别用匹配器和逐个关键词的 in 判断计算各分组得分
+    预期：每个分组的命中数完全一致（重复出现的关键词按列表重复计数）
+    """
+    rng = random.Random(7)
+    matcher = get_keyword_matcher()
+    for _ in range(300):
+        text = " ".join(rng.choice(WORDS) for _ in range(rng.randint(0, 12)))
+        lower = text.lower()
+        hits = matcher.match(text)
+        for category, config in EMOTION_KEYWORDS.items():
+            assert hits.count(f"emotion:{category}") == sum(1 for k in config["keywords"] if k.lower() in lower)
+        for task_type, config in TASK_PATTERNS.items():
+            assert hits.count(f"task:{task_type}") == sum(1 for k in config["indicators"] if k.lower() in lower)
+        for name, keywords in matcher.groups.items():
+            assert hits.any(name) == any(k in lower for k in keywords)
+
+
+def test_contained_keywords_are_pruned_correctly():
+    """
+    场景：长关键词包含短关键词（"same error" 包含 "error"）
+    预期：短关键词缺失时长关键词也不命中；短关键词存在但长关键词不在文本中时也不误报
+    """
+    matcher = KeywordMatcher({"a": ["error", "same error"], "b": ["err"]})
+    assert matcher.match("SAME ERROR").keywords("a") == {"error", "same error"}
+    assert matcher.match("an error, not the same").keywords("a") == {"error"}
+    assert not matcher.match("same problem").any("a")
+    assert matcher.match("err").groups() == ["b"]
+
+
+def test_detectors_use_matcher():
+    """
+    场景：通过 detect_emotion / detect_task_type 检测典型文本
+    预期：结果与原有的关键词权重规则一致
+    """
+    assert detect_emotion("Same error again, still not working") == 3 + 3 + 4
+    assert detect_task_type([{"role": "user", "content": "I get an error, please fix this bug"}]) == "debugging"
+    assert detect_task_type([{"role": "user", "content": "hello"}]) == "exploration"
+
+
+def test_pattern_keywords_change_rebuilds_matcher():
+    """
+    场景：运行时修改 settings.analyzer.pattern_keywords
+    预期：匹配器自动重建，details.pattern_hits 反映新的分组
+    """
+    original = settings.analyzer.pattern_keywords
+    try:
+        before = get_keyword_matcher()
+        settings.analyzer.pattern_keywords = dict(original, deploy=["kubectl", "部署"])
+        after = get_keyword_matcher()
+        assert after is not before
+        assert after.match("kubectl apply failed").groups("pattern:") == ["pattern:deploy"]
+
+        result = analyze_behavior("kw-test-project", [{"role": "user", "content": "部署 still fails"}])
+        assert "deploy" in result["details"]["pattern_hits"]
+        assert "repeat" in result["details"]["pattern_hits"]
+    finally:
+        settings.analyzer.pattern_keywords = original
+    assert get_keyword_matcher() is not after
@@ -0,0 +1,61 @@
+"""
+数据库迁移的场景测试
+"""
+
+import sys
+import os
+import tempfile
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from sqlalchemy import text
+
+from app import migrations
+from app.models import create_engines
+
+
+@pytest.mark.parametrize("profile", ["default", "production"])
+def test_concurrent_workers_apply_each_migration_once(monkeypatch, profile):
+    """
+    场景：4个服务 worker 同时启动，各自对同一个新数据库建表并执行迁移
+    预期：每个迁移只执行一次，所有 worker 都正常启动（没有主键冲突），迁移版本各记录一次
+    """
+    calls = []
+    barrier = threading.Barrier(4, timeout=10)
+
+    def probe_migration(conn):
+        calls.append(threading.get_ident())
+        conn.execute(text("CREATE TABLE IF NOT EXISTS migration_probe (id INTEGER)"))
+
+    monkeypatch.setattr(migrations, "MIGRATIONS", [(1, "probe", probe_migration), (2, "probe_again", probe_migration)])
+
+    with tempfile.TemporaryDirectory() as tmp:
+        url = f"sqlite:///{os.path.join(tmp, 'watchdog.db')}"
+        errors = []
+
+        def start_worker():
+            _, writer = create_engines(url, profile)
+            try:
+                barrier.wait()
+                migrations.run_migrations(writer)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                writer.dispose()
+
+        threads = [threading.Thread(target=start_worker) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(timeout=30)
+
+        assert not any(thread.is_alive() for thread in threads)
+        assert errors == []
+        assert len(calls) == 2
+        _, writer = create_engines(url, profile)
+        with writer.connect() as conn:
+            versions = [row[0] for row in conn.execute(text("SELECT version FROM schema_migrations ORDER BY version"))]
+        writer.dispose()
+        assert versions == [1, 2]
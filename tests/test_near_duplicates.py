@@ -0,0 +1,119 @@
+"""
+近似重复索引（LSH）的场景测试
+"""
+
+import sys
+import os
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.analyzer import compute_simhash_hex
+from app.near_duplicates import NearDuplicateIndex
+
+LOOP_PROMPTS = [
+    "The login endpoint returns 500 when the session cookie expires, how do I fix it?",
+    "Rewrite the cache layer so that it uses Redis instead of the local dict",
+    "Why does the CSV export drop the last row when the file ends without a newline?",
+]
+
+
+def test_alternating_loop_is_counted_beyond_recent_requests():
+    """
+    场景：用户在三个提问之间来回切换，中间夹杂其它请求，共存储30条
+    预期：对其中一个提问，索引统计出所有近似重复（只看最近5条会漏掉）；无关提问计数为0
+    """
+    index = NearDuplicateIndex()
+    start = datetime.utcnow() - timedelta(hours=2)
+    for i in range(30):
+        prompt = LOOP_PROMPTS[i % 3] + (" please" if i % 2 else "")
+        index.add("project-a", prompt, start + timedelta(minutes=i))
+
+    assert index.count("project-a", LOOP_PROMPTS[0]) == 10
+    assert index.count("project-a", "Translate this paragraph into French for the landing page") == 0
+    assert index.count("project-b", LOOP_PROMPTS[0]) == 0
+    # 只统计最近一小时内的
+    assert index.count("project-a", LOOP_PROMPTS[0], hours=1.5) < 10
+
+
+def test_privacy_mode_fingerprints():
+    """
+    场景：隐私模式下只存储simhash指纹
+    预期：通过位分段索引找到相同提问的指纹，与原文对比时计数正确
+    """
+    index = NearDuplicateIndex()
+    now = datetime.utcnow()
+    for i, prompt in enumerate(LOOP_PROMPTS * 4):
+        index.add("project-p", compute_simhash_hex(prompt), now - timedelta(minutes=i))
+
+    assert index.count("project-p", LOOP_PROMPTS[1]) == 4
+    assert index.get_stats()["entries"] == 12
+
+
+def test_window_and_size_bounds():
+    """
+    场景：超出时间窗口的旧提问与超过单项目上限的条目
+    预期：旧条目被丢弃，不再计数；单项目条目数不超过上限；删除项目后索引清空
+    """
+    index = NearDuplicateIndex(window_hours=1, max_entries_per_project=5)
+    now = datetime.utcnow()
+    index.add("project-a", LOOP_PROMPTS[0], now - timedelta(hours=3))
+    assert index.count("project-a", LOOP_PROMPTS[0]) == 0
+
+    for i in range(8):
+        index.add("project-a", LOOP_PROMPTS[0], now - timedelta(seconds=10 - i))
+    assert index.get_stats()["entries"] == 5
+    assert index.count("project-a", LOOP_PROMPTS[0]) == 5
+
+    index.forget("project-a")
+    assert index.count("project-a", LOOP_PROMPTS[0]) == 0
+
+
+def test_signature_is_computed_once_per_prompt(monkeypatch):
+    """
+    场景：分析时先统计近似重复（count），存储时再写入索引（add），同一提问
+    预期：MinHash 签名只从原文计算一次，之后从文本缓存读取
+    """
+    from app import analyzer
+
+    calls = []
+    original = analyzer.minhash_signature
+
+    def counting_signature(text, num_bins, shingle_size):
+        calls.append(text)
+        return original(text, num_bins, shingle_size)
+
+    monkeypatch.setattr(analyzer, "minhash_signature", counting_signature)
+    index = NearDuplicateIndex()
+    now = datetime.utcnow()
+    index.add("project-s", LOOP_PROMPTS[0], now - timedelta(minutes=1))
+    prompt = LOOP_PROMPTS[1] + " (signature cache)"
+    index.count("project-s", prompt)
+    index.add("project-s", prompt, now)
+    assert calls.count(prompt.lower()) == 1
+
+
+def test_memory_cap_evicts_least_recently_used_projects():
+    """
+    场景：很多项目各写入提问，总占用超过 max_bytes
+    预期：最久未使用的项目被淘汰，占用不超过上限；刚写入的项目保留；删除/清空后占用归零
+    """
+    probe = NearDuplicateIndex()
+    probe.add("probe", LOOP_PROMPTS[0], datetime.utcnow())
+    entry_bytes = probe.get_stats()["bytes"]
+    assert entry_bytes > 0
+
+    index = NearDuplicateIndex(max_bytes=entry_bytes * 10)
+    now = datetime.utcnow()
+    for i in range(30):
+        index.add(f"project-{i}", LOOP_PROMPTS[i % 3], now)
+    stats = index.get_stats()
+    assert stats["bytes"] <= entry_bytes * 10
+    assert stats["evictions"] == 20 and stats["projects"] == 10
+    assert index.count("project-29", LOOP_PROMPTS[29 % 3]) == 1
+    assert index.count("project-0", LOOP_PROMPTS[0]) == 0
+
+    index.forget("project-29")
+    assert index.get_stats()["bytes"] == entry_bytes * 9
+    index.clear()
+    assert index.get_stats()["bytes"] == 0
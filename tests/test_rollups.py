@@ -0,0 +1,152 @@
+"""
+请求汇总表（小时/天）的场景测试
+"""
+
+import sys
+import os
+import random
+import uuid
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app.models import Base, Request
+from app.rollups import COUNTER_COLUMNS, apply_rollups, rebuild_rollups, record_counters
+from app.aggregation import summarize_requests
+
+
+def _make_records(count, start, span_hours):
+    rng = random.Random(42)
+    records = []
+    for _ in range(count):
+        records.append({
+            "id": str(uuid.uuid4()),
+            "timestamp": start + timedelta(seconds=rng.randint(0, span_hours * 3600)),
+            "project_id": rng.choice(["alpha", "beta"]),
+            "model": rng.choice(["gpt-4o", "claude-3", None]),
+            "prompt_tokens": rng.randint(10, 500),
+            "completion_tokens": rng.randint(10, 500),
+            "total_cost_usd": rng.random(),
+            "advisor_level": rng.randint(0, 4),
+            "progress_indicator": rng.choice(["stuck", "exploring", "refining", "resolved", None]),
+            "pattern_score": rng.randint(-2, 5),
+            "similarity_score": rng.random(),
+        })
+    return records
+
+
+def _session():
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    return engine, sessionmaker(bind=engine)()
+
+
+def _expected(records, start, end, project_id=None):
+    totals = dict.fromkeys(COUNTER_COLUMNS, 0)
+    for record in records:
+        if start <= record["timestamp"] < end and (project_id is None or record["project_id"] == project_id):
+            for column, value in record_counters(record).items():
+                totals[column] += value
+    return totals
+
+
+def test_summary_matches_raw_rows_for_unaligned_ranges():
+    """
+    场景：写入跨越多天的请求并增量维护汇总表，查询起止时间不对齐整点
+    预期：汇总表与SQL条件聚合的边缘数据合计后，与逐行统计原始数据完全一致
+    """
+    engine, db = _session()
+    start = datetime(2025, 3, 1, 5, 17, 0)
+    records = _make_records(500, start, span_hours=24 * 5)
+    for i in range(0, len(records), 100):
+        db.execute(Request.__table__.insert(), records[i:i + 100])
+        apply_rollups(db, records[i:i + 100])
+    db.commit()
+
+    ranges = [
+        (datetime(2025, 3, 1, 7, 45), datetime(2025, 3, 4, 22, 10)),  # 跨天：小时+天+小时+原始边缘
+        (datetime(2025, 3, 2, 3, 30), datetime(2025, 3, 2, 9, 5)),    # 同一天内
+        (datetime(2025, 3, 3, 10, 10), datetime(2025, 3, 3, 10, 50)), # 不足一小时
+    ]
+    for range_start, range_end in ranges:
+        for project_id in (None, "alpha"):
+            summary = summarize_requests(db, range_start, range_end, project_id=project_id)
+            expected = _expected(records, range_start, range_end, project_id)
+            for column in COUNTER_COLUMNS:
+                assert abs(summary.totals[column] - expected[column]) < 1e-9, column
+
+
+def test_rebuild_matches_incremental_rollups():
+    """
+    场景：增量维护的汇总表被清空后从原始数据重建
+    预期：重建结果与增量结果一致，空模型归入 unknown
+    """
+    engine, db = _session()
+    records = _make_records(300, datetime(2025, 3, 1), span_hours=72)
+    db.execute(Request.__table__.insert(), records)
+    apply_rollups(db, records)
+    db.commit()
+    incremental = summarize_requests(db, datetime(2025, 3, 1), datetime(2025, 3, 5))
+
+    with engine.begin() as conn:
+        assert rebuild_rollups(conn) == len(records)
+    rebuilt = summarize_requests(db, datetime(2025, 3, 1), datetime(2025, 3, 5))
+
+    assert rebuilt.totals == incremental.totals
+    assert rebuilt.models == incremental.models
+    assert "unknown" in rebuilt.models
+
+
+def test_daily_cost_series_fills_missing_days():
+    """
+    场景：最近三天中只有今天和两天前有请求
+    预期：按天分组返回三天数据，缺失的日期费用为0，可按项目过滤
+    """
+    from app.aggregation import daily_cost_series
+
+    engine, db = _session()
+    today = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+    records = _make_records(4, today, span_hours=0)
+    records[0].update(project_id="alpha", total_cost_usd=1.0, timestamp=today + timedelta(minutes=5))
+    records[1].update(project_id="beta", total_cost_usd=2.0, timestamp=today + timedelta(minutes=10))
+    records[2].update(project_id="alpha", total_cost_usd=4.0, timestamp=today - timedelta(days=2, hours=-1))
+    records[3].update(project_id="alpha", total_cost_usd=8.0, timestamp=today - timedelta(days=5))
+    db.execute(Request.__table__.insert(), records)
+    apply_rollups(db, records)
+    db.commit()
+
+    assert [day["cost"] for day in daily_cost_series(db, 3)] == [4.0, 0.0, 3.0]
+    assert [day["cost"] for day in daily_cost_series(db, 3, project_id="alpha")] == [4.0, 0.0, 1.0]
+    assert daily_cost_series(db, 3)[-1]["date"] == today.strftime("%m-%d")
+
+
+def test_project_summaries_sorted_and_paginated():
+    """
+    场景：多个项目的请求写入汇总表后分页查询项目列表
+    预期：一次聚合得到每个项目的总费用、请求数和最近活动时间，并按指定字段排序分页
+    """
+    from app.aggregation import project_summaries
+
+    engine, db = _session()
+    records = _make_records(200, datetime(2025, 3, 1), span_hours=48)
+    for i, record in enumerate(records):
+        record["project_id"] = f"project-{i % 4}"
+    db.execute(Request.__table__.insert(), records)
+    apply_rollups(db, records)
+    db.commit()
+
+    projects, total = project_summaries(db, sort="cost")
+    assert total == 4
+    expected = {f"project-{n}": sum(r["total_cost_usd"] for r in records if r["project_id"] == f"project-{n}") for n in range(4)}
+    assert [p["project_id"] for p in projects] == sorted(expected, key=expected.get, reverse=True)
+    for project in projects:
+        assert abs(project["total_cost_usd"] - expected[project["project_id"]]) < 1e-9
+        assert project["request_count"] == 50
+        assert project["last_request_at"] == max(r["timestamp"] for r in records if r["project_id"] == project["project_id"])
+
+    page, total = project_summaries(db, sort="name", descending=False, limit=2, offset=1)
+    assert [p["project_id"] for p in page] == ["project-1", "project-2"]
+    assert total == 4
@@ -0,0 +1,178 @@
+"""
+跨进程共享状态的场景测试（两个实例指向同一个SQLite文件，模拟两个worker）
+"""
+
+import sys
+import os
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.shared_state import SharedState, SQLiteBackend
+from app.analyzer import EfficiencyCache
+from app.spend_tracker import SharedSpendTracker
+
+
+def _two_workers(tmp_path):
+    filename = str(tmp_path / "shared_state.db")
+    return SharedState(SQLiteBackend(filename), "test:"), SharedState(SQLiteBackend(filename), "test:")
+
+
+def test_sqlite_backend_counters_and_expiry(tmp_path):
+    """
+    场景：两个worker同时读写计数器、占位键和带过期时间的键
+    预期：计数累加结果一致，占位只有一个worker成功，过期键不可见
+    """
+    worker_a, worker_b = _two_workers(tmp_path)
+
+    worker_a.incr("counter", 1.5)
+    assert worker_b.incr("counter", 2) == 3.5
+    assert worker_a.add("once", True)
+    assert not worker_b.add("once", True)
+
+    worker_a.set("short", {"v": 1}, ttl_seconds=0.05)
+    assert worker_b.get("short") == {"v": 1}
+    time.sleep(0.1)
+    assert worker_b.get("short") is None
+    assert worker_b.add("short", {"v": 2})  # 过期键视为不存在
+
+    worker_a.set("settings:system", {"pricing": {}})
+    assert worker_b.scan("settings:") == {"settings:system": {"pricing": {}}}
+
+
+def test_efficiency_cache_shared_between_workers(tmp_path):
+    """
+    场景：worker A 计算并缓存结果，worker B 随后查询；之后 worker B 失效该项目
+    预期：B 直接读到 A 的结果而不重新计算；失效后 A 的本地缓存也不再命中
+    """
+    shared_a, shared_b = _two_workers(tmp_path)
+    cache_a = EfficiencyCache(ttl_seconds=60, shared=shared_a)
+    cache_b = EfficiencyCache(ttl_seconds=60, shared=shared_b)
+
+    cache_a.get_or_compute("p", "7d", lambda: {"metrics": {"score": 1}})
+    result, shared = cache_b.get_or_compute("p", "7d", lambda: {"metrics": {"score": 2}})
+    assert result == {"metrics": {"score": 1}} and shared
+    assert cache_b.get_stats()["shared_hits"] == 1
+
+    cache_b.invalidate("p")
+    assert cache_a.get("p", "7d") is None
+
+
+def test_sqlite_backend_is_created_on_first_use(tmp_path):
+    """
+    场景：创建SQLite后端但还没有读写；随后按前缀扫描和删除
+    预期：创建时不生成文件；前缀查询只返回/删除以该前缀开头的键
+    """
+    filename = tmp_path / "nested" / "shared_state.db"
+    shared = SharedState(SQLiteBackend(str(filename)), "test:")
+    assert not filename.exists()
+
+    for key in ("spend:a:1", "spend:a:2", "spend:ab:1", "spend;", "spenc:a:1"):
+        shared.set(key, 1)
+    assert filename.exists()
+    assert sorted(shared.scan("spend:a:")) == ["spend:a:1", "spend:a:2"]
+    shared.delete_prefix("spend:a:")
+    assert sorted(shared.scan("")) == ["spenc:a:1", "spend:ab:1", "spend;"]
+
+
+def test_spend_window_shared_between_workers(tmp_path):
+    """
+    场景：两个worker分别记录同一项目的花费，然后各自同步
+    预期：同步后任一worker读取到的小时花费都是两者之和，窗口外的花费不计入；
+         一个worker删除项目后，另一个worker同步后花费归零
+    """
+    shared_a, shared_b = _two_workers(tmp_path)
+    tracker_a = SharedSpendTracker(shared_a)
+    tracker_b = SharedSpendTracker(shared_b)
+    tracker_a._seeded = tracker_b._seeded = True
+
+    now = datetime.utcnow()
+    tracker_a.add("project-a", 1.0, now - timedelta(minutes=5))
+    tracker_b.add("project-a", 2.0, now)
+    tracker_b.add("project-a", 4.0, now - timedelta(hours=2))
+    assert tracker_a.get_spend("project-a") == 1.0  # 同步前只看到本worker的花费
+
+    tracker_a.sync()
+    tracker_b.sync()
+    tracker_a.sync()
+    assert abs(tracker_a.get_spend("project-a") - 3.0) < 1e-9
+    assert tracker_b.snapshot() == {"project-a": 3.0}
+    tracker_a.forget("project-a")
+    tracker_b.sync()
+    assert tracker_b.get_spend("project-a") == 0.0
+
+
+class _CountingBackend:
+    """记录对共享状态的调用次数，可以让调用失败"""
+
+    is_shared = True
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.calls = 0
+        self.fail = False
+
+    def __getattr__(self, name):
+        method = getattr(self.backend, name)
+
+        def call(*args, **kwargs):
+            self.calls += 1
+            if self.fail:
+                raise RuntimeError("shared state unavailable")
+            return method(*args, **kwargs)
+        return call
+
+
+def test_spend_hot_path_stays_local(tmp_path):
+    """
+    场景：请求路径上记录花费、读取小时花费；共享状态暂时不可用时同步
+    预期：add/get_spend 不访问共享状态；同步失败时本地花费保留，恢复后补推到共享状态
+    """
+    backend = _CountingBackend(SQLiteBackend(str(tmp_path / "shared_state.db")))
+    tracker = SharedSpendTracker(SharedState(backend, "test:"))
+    tracker._seeded = True
+
+    for _ in range(100):
+        tracker.add("project-a", 0.5)
+        tracker.get_spend("project-a")
+    assert backend.calls == 0
+    assert tracker.get_spend("project-a") == 50.0
+
+    backend.fail = True
+    tracker.sync()
+    assert tracker.get_spend("project-a") == 50.0
+
+    backend.fail = False
+    tracker.sync()
+    other = SharedSpendTracker(SharedState(SQLiteBackend(str(tmp_path / "shared_state.db")), "test:"))
+    other._seeded = True
+    other.sync()
+    assert other.get_spend("project-a") == 50.0
+
+
+def test_spend_sync_thread_picks_up_other_workers(tmp_path):
+    """
+    场景：worker A 启动后台同步线程，worker B 记录花费并同步
+    预期：在同步间隔后 A 自动看到 B 的花费；停止时 A 的未推送花费被推送
+    """
+    shared_a, shared_b = _two_workers(tmp_path)
+    tracker_a = SharedSpendTracker(shared_a, sync_interval_ms=10)
+    tracker_b = SharedSpendTracker(shared_b)
+    tracker_a._seeded = tracker_b._seeded = True
+
+    tracker_a.start_sync()
+    try:
+        tracker_b.add("project-a", 2.0)
+        tracker_b.sync()
+        for _ in range(200):
+            if tracker_a.get_spend("project-a") == 2.0:
+                break
+            time.sleep(0.01)
+        assert tracker_a.get_spend("project-a") == 2.0
+        tracker_a.add("project-a", 1.0)
+    finally:
+        tracker_a.stop_sync()
+
+    tracker_b.sync()
+    assert tracker_b.get_spend("project-a") == 3.0
@@ -0,0 +1,83 @@
+"""
+SimHash 指纹的场景测试
+"""
+
+import sys
+import os
+import random
+import re
+import hashlib
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.analyzer import compute_simhash_hex, simhash_similarity
+
+WORDS = "same error still fix the api call returns TypeError when user config cache 报错 修复 traceback a b".split()
+
+
+def legacy_compute_simhash_hex(text: str, bits: int = 64) -> str:
+    """逐位投票的原始实现，已存储的指纹由它生成"""
+    if not text:
+        return "0" * (bits // 4)
+    tokens = re.findall(r"\b\w+\b", text.lower())
+    if not tokens:
+        return "0" * (bits // 4)
+    v = [0] * bits
+    for tok in tokens:
+        h = int.from_bytes(hashlib.md5(tok.encode("utf-8")).digest()[:8], "big", signed=False)
+        for i in range(bits):
+            v[i] += 1 if (h >> i) & 1 else -1
+    fp = 0
+    for i, score in enumerate(v):
+        if score > 0:
+            fp |= (1 << i)
+    return f"{fp:0{bits // 4}x}"
+
+
+def test_fingerprints_match_legacy_implementation():
+    """
+    场景：随机文本（含重复词、平票、空文本、纯符号）分别用新旧实现计算指纹
+    预期：指纹逐位一致，已存储的指纹无需迁移
+    """
+    rng = random.Random(11)
+    texts = ["", "!!! ???", "a", "a b", "a a b b", "Same ERROR same error"]
+    texts += [" ".join(rng.choice(WORDS) for _ in range(rng.randint(1, 300))) for _ in range(300)]
+    for text in texts:
+        for bits in (64, 32):
+            assert compute_simhash_hex(text, bits) == legacy_compute_simhash_hex(text, bits)
+
+
+def test_similar_prompts_have_close_fingerprints():
+    """
+    场景：只差一个词的两段长提问
+    预期：指纹汉明相似度很高，与无关文本的相似度明显更低
+    """
+    base = "the api call returns TypeError when user config cache is empty " * 5
+    assert simhash_similarity(compute_simhash_hex(base), compute_simhash_hex(base + " again")) > 0.9
+    assert simhash_similarity(compute_simhash_hex(base), compute_simhash_hex("请帮我润色这段文字")) < 0.8
+
+
+def test_text_memo_shares_features_across_functions():
+    """
+    场景：同一段提问先做相似度计算，再计算指纹，之后以另一个字符串对象再次传入
+    预期：只分词一次（备忘录按内容哈希命中），指纹与直接计算一致；超出容量时按LRU淘汰
+    """
+    from app.analyzer import TextFeatureMemo, calculate_similarity, text_memo
+
+    text = "The api call returns TypeError when the user config cache is empty"
+    text_memo.clear()
+    before = text_memo.get_stats()
+    calculate_similarity(text, text + " again")
+    compute_simhash_hex(text)
+    compute_simhash_hex("".join(list(text)))  # 内容相同的另一个字符串对象
+    stats = text_memo.get_stats()
+    assert stats["misses"] - before["misses"] == 2
+    assert stats["hits"] - before["hits"] >= 2
+    assert compute_simhash_hex(text) == legacy_compute_simhash_hex(text)
+
+    memo = TextFeatureMemo(max_entries=2)
+    first = memo.get("a")
+    memo.get("b")
+    memo.get("c")
+    assert memo.get_stats()["entries"] == 2
+    assert memo.get("a") is not first
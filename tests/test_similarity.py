@@ -0,0 +1,79 @@
+"""
+相似度计算的场景测试
+"""
+
+import sys
+import os
+import random
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.analyzer import calculate_similarity
+
+WORDS = "same error still fix the api call returns TypeError when user config cache 报错 修复 traceback".split()
+
+
+def _random_text(rng):
+    return " ".join(rng.choice(WORDS) for _ in range(rng.randint(1, 40)))
+
+
+def test_quick_reject_never_hides_a_match():
+    """
+    场景：使用 reject_below 快速拒绝不可能达到阈值的文本对
+    预期：达到阈值的文本对得到与完整计算相同的分数；被拒绝的文本对返回不低于真实分数、但低于阈值的上界
+    """
+    rng = random.Random(3)
+    for _ in range(300):
+        text1, text2 = _random_text(rng), _random_text(rng)
+        exact = calculate_similarity(text1, text2)
+        for threshold in (0.55, 0.6, 0.75):
+            bounded = calculate_similarity(text1, text2, reject_below=threshold)
+            if exact >= threshold:
+                assert bounded == exact
+            else:
+                assert exact - 1e-12 <= bounded < threshold
+
+
+def test_identical_debug_prompts_score_high():
+    """
+    场景：两次完全相同的报错提问
+    预期：相似度为1
+    """
+    prompt = "Still the same TypeError: 'NoneType' object is not subscriptable, please fix"
+    assert calculate_similarity(prompt, prompt) == 1.0
+    assert calculate_similarity(prompt, "") == 0.0
+
+
+def _long_traceback(rng, frames):
+    lines = ["Traceback (most recent call last):"]
+    for _ in range(frames):
+        lines.append(f'  File "/srv/app/module_{rng.randint(0, 500)}.py", line {rng.randint(1, 900)}, in handler_{rng.randint(0, 999)}')
+        lines.append("    " + " ".join(rng.choice(WORDS) for _ in range(10)))
+    return "\n".join(lines) + "\nKeyError: 'user_id'"
+
+
+def test_long_prompts_use_bounded_minhash_mode():
+    """
+    场景：用户两次粘贴两万字符的几乎相同的报错堆栈，另有一段无关的长堆栈
+    预期：自动切换为 MinHash 模式并在 details 中标明；相同堆栈相似度高于无关堆栈
+    """
+    from app.analyzer import analyze_behavior, similarity_mode, minhash_char_similarity, get_text_features
+
+    rng = random.Random(11)
+    trace = _long_traceback(rng, 200)
+    assert len(trace) > 20000
+    retry = trace.replace("line 1", "line 2") + "\nstill failing"
+    unrelated = _long_traceback(random.Random(12), 200)
+
+    assert similarity_mode(trace, retry) == "minhash"
+    same = minhash_char_similarity(get_text_features(trace), get_text_features(retry))
+    different = minhash_char_similarity(get_text_features(trace), get_text_features(unrelated))
+    assert same > 0.9
+    assert same > different + 0.2
+
+    result = analyze_behavior(
+        "long-prompt-project",
+        [{"role": "user", "content": trace}, {"role": "user", "content": retry}],
+        model="gpt-4o",
+    )
+    assert result["details"]["similarity_mode"] == "minhash"
@@ -0,0 +1,66 @@
+"""
+小时预算滑动窗口的场景测试
+"""
+
+import sys
+import os
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.spend_tracker import SpendTracker
+
+
+def create_tracker() -> SpendTracker:
+    """创建一个不读数据库的追踪器"""
+    tracker = SpendTracker(window_seconds=3600, bucket_seconds=60)
+    tracker.seed([])
+    return tracker
+
+
+def test_spend_accumulates_within_window():
+    """
+    场景：同一项目一小时内多次请求
+    预期：花费累加，不同项目互不影响
+    """
+    tracker = create_tracker()
+    now = datetime(2025, 1, 1, 12, 0, 0)
+    tracker.add("project-a", 1.5, now - timedelta(minutes=30))
+    tracker.add("project-a", 2.0, now - timedelta(minutes=5))
+    tracker.add("project-b", 4.0, now)
+
+    assert abs(tracker.get_spend("project-a", now) - 3.5) < 1e-9
+    assert abs(tracker.get_spend("project-b", now) - 4.0) < 1e-9
+    assert tracker.get_spend("project-c", now) == 0.0
+
+
+def test_spend_expires_after_window():
+    """
+    场景：超过一小时的花费
+    预期：滑出窗口后不再计入
+    """
+    tracker = create_tracker()
+    start = datetime(2025, 1, 1, 12, 0, 0)
+    tracker.add("project-a", 3.0, start)
+    tracker.add("project-a", 1.0, start + timedelta(minutes=45))
+
+    assert abs(tracker.get_spend("project-a", start + timedelta(minutes=59)) - 4.0) < 1e-9
+    assert abs(tracker.get_spend("project-a", start + timedelta(minutes=61)) - 1.0) < 1e-9
+    assert tracker.get_spend("project-a", start + timedelta(hours=3)) == 0.0
+
+
+def test_seed_and_snapshot():
+    """
+    场景：启动时从数据库加载最近一小时的记录
+    预期：快照只包含窗口内有花费的项目
+    """
+    tracker = SpendTracker()
+    now = datetime.utcnow()
+    tracker.seed([
+        ("project-a", now - timedelta(minutes=10), 0.5),
+        ("project-b", now - timedelta(hours=2), 9.0),
+    ])
+
+    snapshot = tracker.snapshot(now)
+    assert list(snapshot.keys()) == ["project-a"]
+    assert abs(snapshot["project-a"] - 0.5) < 1e-9
@@ -0,0 +1,181 @@
+"""
+流式（stream=true）代理的场景测试：SSE用量解析与流结束后的计费记录
+"""
+
+import sys
+import os
+import asyncio
+import json
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+
+from app import proxy
+from app.proxy import StreamUsageParser
+
+ANALYSIS = {"level": 1, "details": {"similarity": 0.25, "emotion_score": 2, "progress": "exploring"}}
+
+
+def _sse(payload) -> bytes:
+    return b"data: " + json.dumps(payload).encode() + b"\n\n"
+
+
+def _openai_stream(include_usage: bool):
+    chunks = [
+        _sse({"choices": [{"index": 0, "delta": {"content": "Hel"}}], "usage": None}),
+        _sse({"choices": [{"index": 0, "delta": {"content": "lo"}}], "usage": None}),
+    ]
+    if include_usage:
+        chunks.append(_sse({"choices": [], "usage": {"prompt_tokens": 1000, "completion_tokens": 500, "total_tokens": 1500}}))
+    chunks.append(b"data: [DONE]\n\n")
+    return chunks
+
+
+def _install_upstream(monkeypatch, handler):
+    """用 MockTransport 替换上游客户端，并记录存库调用"""
+    stored = []
+
+    async def fake_analysis(project_id, messages, model):
+        return ANALYSIS
+
+    monkeypatch.setattr(proxy, "run_analysis", fake_analysis)
+    monkeypatch.setattr(proxy, "get_hourly_cost", lambda project_id: 0.0)
+    monkeypatch.setattr(proxy, "store_request_in_db", lambda **record: stored.append(record))
+    monkeypatch.setitem(proxy._upstream_clients, "openai", httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+    return stored
+
+
+async def _consume(stream):
+    body = b"".join([chunk async for chunk in stream.iter_chunks()])
+    await asyncio.gather(*list(proxy._background_tasks))
+    return body
+
+
+def test_usage_parser_handles_split_chunks():
+    """
+    场景：usage 所在的 SSE 行被拆成多个网络分片，前面还有 usage: null 的普通分片
+    预期：解析出完整的 token 用量；Anthropic 风格的 input/output 字段同样可用
+    """
+    raw = b"".join(_openai_stream(include_usage=True))
+    parser = StreamUsageParser()
+    for i in range(0, len(raw), 7):
+        parser.feed(raw[i:i + 7])
+    parser.close()
+    assert parser.get_token_usage() == {"prompt_tokens": 1000, "completion_tokens": 500, "total_tokens": 1500}
+
+    parser = StreamUsageParser()
+    parser.feed(b'data: {"type": "message_delta", "usage": {"input_tokens": 12, "output_tokens": 30}}')
+    parser.close()
+    assert parser.get_token_usage() == {"prompt_tokens": 12, "completion_tokens": 30, "total_tokens": 42}
+
+
+def test_injected_usage_chunk_is_hidden_and_accounted(monkeypatch):
+    """
+    场景：客户端没有设置 stream_options，代理自动加上 include_usage
+    预期：上游收到 include_usage；客户端收不到 choices 为空的用量分片；流结束后按用量计费存库
+    """
+    seen = {}
+
+    def handler(request):
+        seen["body"] = json.loads(request.content)
+        return httpx.Response(200, content=b"".join(_openai_stream(include_usage=True)),
+                              headers={"content-type": "text/event-stream"})
+
+    stored = _install_upstream(monkeypatch, handler)
+    body = {"model": "gpt-4o", "stream": True, "messages": [{"role": "user", "content": "hi"}]}
+
+    async def run():
+        stream, status = await proxy.stream_proxy_request(body, {"X-Project-ID": "stream-test"})
+        assert status == 200
+        assert stream.headers["X-Advisor-Level"] == "1"
+        return await _consume(stream)
+
+    forwarded = asyncio.run(run())
+
+    assert seen["body"]["stream_options"] == {"include_usage": True}
+    assert "stream_options" not in body
+    assert b'"choices": []' not in forwarded
+    assert forwarded.count(b"data: ") == 3 and forwarded.endswith(b"data: [DONE]\n\n")
+    assert len(stored) == 1
+    assert stored[0]["prompt_tokens"] == 1000 and stored[0]["completion_tokens"] == 500
+    assert stored[0]["total_cost_usd"] == proxy.calculate_cost("gpt-4o", 1000, 500)
+    assert stored[0]["project_id"] == "stream-test"
+
+
+def test_client_requested_usage_chunk_is_forwarded(monkeypatch):
+    """
+    场景：客户端自己设置了 stream_options.include_usage
+    预期：上游字节原样转发（包括用量分片），计费照常
+    """
+    raw = _openai_stream(include_usage=True)
+    stored = _install_upstream(monkeypatch, lambda request: httpx.Response(200, content=b"".join(raw)))
+    body = {"model": "gpt-4o", "stream": True, "stream_options": {"include_usage": True},
+            "messages": [{"role": "user", "content": "hi"}]}
+
+    async def run():
+        stream, status = await proxy.stream_proxy_request(body, {})
+        return await _consume(stream)
+
+    assert asyncio.run(run()) == b"".join(raw)
+    assert stored[0]["completion_tokens"] == 500
+
+
+def test_upstream_error_is_returned(monkeypatch):
+    """
+    场景：上游返回 401 错误
+    预期：返回上游的状态码与错误内容，不存库
+    """
+    stored = _install_upstream(monkeypatch, lambda request: httpx.Response(401, json={"message": "bad key"}))
+
+    async def run():
+        return await proxy.stream_proxy_request({"model": "gpt-4o", "stream": True, "messages": []}, {})
+
+    error_body, status = asyncio.run(run())
+    assert status == 401
+    assert error_body == {"error": {"message": "bad key"}}
+    assert stored == []
+
+
+def test_analysis_overlaps_upstream_call(monkeypatch):
+    """
+    场景：concurrent 模式下，分析要等到上游收到请求后才能完成；sequential 模式下记录调用顺序
+    预期：concurrent 模式先发出上游请求，再等待分析结果生成响应头；sequential 模式先分析再请求上游
+    """
+    order = []
+
+    def install(mode):
+        state = {"upstream_called": None}
+
+        async def handler(request):
+            order.append("upstream")
+            state["upstream_called"].set()
+            return httpx.Response(200, content=b"".join(_openai_stream(include_usage=False)))
+
+        _install_upstream(monkeypatch, handler)
+
+        async def analysis(project_id, messages, model):
+            if mode == "concurrent":
+                await asyncio.wait_for(state["upstream_called"].wait(), timeout=5)
+            order.append("analysis")
+            return ANALYSIS
+
+        monkeypatch.setattr(proxy, "run_analysis", analysis)
+        monkeypatch.setattr(proxy.settings.analyzer, "execution_mode", mode)
+        return state
+
+    for mode, expected in (("concurrent", ["upstream", "analysis"]), ("sequential", ["analysis", "upstream"])):
+        order.clear()
+        state = install(mode)
+
+        async def run():
+            # Event 需要在 asyncio.run 的事件循环内创建
+            state["upstream_called"] = asyncio.Event()
+            stream, status = await proxy.stream_proxy_request(
+                {"model": "gpt-4o", "stream": True, "stream_options": {}, "messages": []}, {})
+            assert status == 200
+            assert stream.headers["X-Advisor-Level"] == "1"
+            await _consume(stream)
+
+        asyncio.run(run())
+        assert order == expected
@@ -0,0 +1,112 @@
+"""
+多 worker 部署下请求历史同步的场景测试
+"""
+
+import sys
+import os
+import uuid
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, delete, insert
+
+from app import worker_sync
+from app.history import ProjectHistoryCache
+from app.models import Base, Request
+from app.near_duplicates import NearDuplicateIndex
+from app.worker_sync import RequestLogFollower
+
+LOOP_PROMPT = "KeyError: 'user_id' in handlers/auth.py line 42, still the same error after the fix"
+
+
+class _Worker:
+    """模拟一个服务 worker：自己的内存历史、近似重复索引和同步器，共享同一个数据库"""
+
+    def __init__(self, engine, monkeypatch):
+        self.engine = engine
+        self.monkeypatch = monkeypatch
+        self.history = ProjectHistoryCache()
+        self.duplicates = NearDuplicateIndex()
+        self.follower = RequestLogFollower(interval_ms=0)
+        self._use()
+        self.follower.interval_ms = 1
+        self.follower.start()
+
+    def _use(self):
+        self.monkeypatch.setattr(worker_sync, "engine", self.engine)
+        self.monkeypatch.setattr(worker_sync, "project_history", self.history)
+        self.monkeypatch.setattr(worker_sync, "near_duplicate_index", self.duplicates)
+
+    def store(self, project_id, prompt, timestamp):
+        """与 store_request_in_db 相同：先更新本进程状态，再写入数据库"""
+        self._use()
+        request_id = str(uuid.uuid4())
+        self.follower.mark_own(request_id)
+        self.history.record(project_id, prompt, timestamp, 100, 100)
+        self.duplicates.add(project_id, prompt, timestamp)
+        with self.engine.begin() as conn:
+            conn.execute(insert(Request), [{"id": request_id, "project_id": project_id, "prompt_text": prompt,
+                                             "timestamp": timestamp, "prompt_tokens": 100, "completion_tokens": 100}])
+
+    def sync(self):
+        self._use()
+        self.follower.sync(force=True)
+
+
+def _engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'workers.db'}")
+    Base.metadata.create_all(engine)
+    return engine
+
+
+def test_requests_stored_by_other_workers_are_picked_up(tmp_path, monkeypatch):
+    """
+    场景：同一项目的重复请求被轮流分配到两个 worker
+    预期：同步后每个 worker 的历史都包含全部请求（按时间排序、不重复），近似重复计数覆盖所有 worker
+    """
+    engine = _engine(tmp_path)
+    worker_a = _Worker(engine, monkeypatch)
+    worker_b = _Worker(engine, monkeypatch)
+    start = datetime.utcnow() - timedelta(minutes=10)
+    for i in range(6):
+        worker = worker_a if i % 2 == 0 else worker_b
+        worker.store("loop", f"{LOOP_PROMPT} #{i}", start + timedelta(seconds=20 * i))
+
+    worker_a.sync()
+    worker_b.sync()
+    for worker in (worker_a, worker_b):
+        recent = worker.history.get_recent("loop", limit=10)
+        assert [entry.prompt_text for entry in recent] == [f"{LOOP_PROMPT} #{i}" for i in reversed(range(6))]
+        assert worker.duplicates.count("loop", LOOP_PROMPT) == 6
+        assert worker.follower.get_stats()["own_pending"] == 0
+
+    # 再次同步不会重复记录
+    worker_a.sync()
+    assert len(worker_a.history.get_recent("loop", limit=10)) == 6
+    assert worker_a.follower.get_stats()["foreign_recorded"] == 3
+
+
+def test_follower_recovers_after_newest_rows_are_deleted(tmp_path, monkeypatch):
+    """
+    场景：最新的请求所在项目被删除，之后新的请求复用了被删除的 rowid
+    预期：同步器回退读取位置，不会漏掉新请求；未启动时不做任何查询
+    """
+    engine = _engine(tmp_path)
+    idle = RequestLogFollower(interval_ms=1)
+    idle.sync(force=True)
+    assert idle.get_stats()["syncs"] == 0
+
+    writer = _Worker(engine, monkeypatch)
+    reader = _Worker(engine, monkeypatch)
+    now = datetime.utcnow()
+    writer.store("kept", "first prompt", now - timedelta(minutes=3))
+    writer.store("removed", "second prompt", now - timedelta(minutes=2))
+    reader.sync()
+    with engine.begin() as conn:
+        conn.execute(delete(Request).where(Request.project_id == "removed"))
+    reader.sync()
+
+    writer.store("kept", "third prompt", now - timedelta(minutes=1))
+    reader.sync()
+    assert [entry.prompt_text for entry in reader.history.get_recent("kept")] == ["third prompt", "first prompt"]
@@ -0,0 +1,83 @@
+"""
+写接口（删除项目、提交反馈）使用单写连接的场景测试
+"""
+
+import sys
+import os
+import uuid
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi.testclient import TestClient
+from sqlalchemy.orm import sessionmaker
+
+from app.main import app
+from app.models import Base, Feedback, Request, create_engines, get_db, get_write_db
+
+
+def test_write_endpoints_use_the_writer_session(tmp_path):
+    """
+    场景：生产配置（WAL，读连接池 + 单写连接）下，通过接口删除项目并提交反馈
+    预期：两个接口都通过单写连接（BEGIN IMMEDIATE）写入，数据正确删除/写入；读连接池不参与写入
+    """
+    reader, writer = create_engines(f"sqlite:///{tmp_path / 'endpoints.db'}", "production")
+    Base.metadata.create_all(writer)
+    WriteSession = sessionmaker(bind=writer)
+    db = WriteSession()
+    db.add_all([Request(id=str(uuid.uuid4()), project_id=project, model="gpt-4o", timestamp=datetime.utcnow(),
+                        total_cost_usd=0.01, prompt_tokens=10, completion_tokens=10)
+                 for project in ("to-delete", "to-delete", "kept")])
+    db.commit()
+    db.close()
+
+    sessions = []
+
+    def write_db():
+        session = WriteSession()
+        sessions.append(session)
+        try:
+            yield session
+        finally:
+            session.close()
+
+    def read_only_db():
+        raise AssertionError("write endpoint used the reader session")
+
+    app.dependency_overrides[get_write_db] = write_db
+    app.dependency_overrides[get_db] = read_only_db
+    try:
+        client = TestClient(app)
+        response = client.delete("/api/projects/to-delete")
+        assert response.status_code == 200
+        assert response.json()["deleted_requests"] == 2
+
+        response = client.post("/api/feedback", json={"request_id": "r1", "is_accurate": 0, "project_id": "kept"})
+        assert response.status_code == 200
+    finally:
+        app.dependency_overrides.clear()
+
+    assert len(sessions) == 2
+    db = sessionmaker(bind=reader)()
+    try:
+        assert [row.project_id for row in db.query(Request).all()] == ["kept"]
+        assert db.query(Feedback).filter(Feedback.project_id == "kept").count() == 1
+    finally:
+        db.close()
+    reader.dispose()
+    writer.dispose()
+
+
+def test_get_write_db_is_bound_to_the_writer_engine():
+    """
+    场景：写接口依赖 get_write_db
+    预期：得到的会话绑定在写引擎上
+    """
+    from app.models import write_engine
+
+    dependency = get_write_db()
+    session = next(dependency)
+    try:
+        assert session.get_bind() is write_engine
+    finally:
+        dependency.close()
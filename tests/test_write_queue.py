@@ -0,0 +1,146 @@
+"""
+请求记录写入队列（write-behind）的场景测试
+"""
+
+import sys
+import os
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import write_queue
+from app.write_queue import RequestWriteQueue
+
+
+class _RecordingWriter:
+    """代替 write_records：记录每次写入的批次，可以让前几次写入失败"""
+
+    def __init__(self, failures: int = 0, block: threading.Event = None):
+        self.batches = []
+        self.failures = failures
+        self.block = block
+        self.calls = 0
+
+    def __call__(self, records):
+        self.calls += 1
+        if self.block is not None:
+            self.block.wait(5)
+        if self.calls <= self.failures:
+            raise RuntimeError("database is locked")
+        self.batches.append(list(records))
+
+
+def _records(count, start=0):
+    return [{"id": str(i), "project_id": "queue-test"} for i in range(start, start + count)]
+
+
+def test_batches_flush_on_size_and_drain_on_stop(monkeypatch):
+    """
+    场景：队列运行中连续写入450条记录，然后停止队列
+    预期：按 batch_size 分批批量写入，停止时剩余记录全部写完，计数器一致
+    """
+    writer = _RecordingWriter()
+    monkeypatch.setattr(write_queue, "write_records", writer)
+    queue = RequestWriteQueue(batch_size=200, flush_interval_ms=5000)
+    queue.start()
+    for record in _records(450):
+        queue.enqueue(record)
+    queue.stop()
+
+    written = [record["id"] for batch in writer.batches for record in batch]
+    assert written == [str(i) for i in range(450)]
+    assert max(len(batch) for batch in writer.batches) == 200
+    stats = queue.get_stats()
+    assert stats["enqueued"] == 450 and stats["written"] == 450
+    assert stats["dropped"] == 0 and stats["queue_depth"] == 0
+    assert stats["running"] is False
+
+
+def test_flush_interval_writes_partial_batch(monkeypatch):
+    """
+    场景：只有少量记录，达不到 batch_size
+    预期：flush_interval 到期后也会写入
+    """
+    writer = _RecordingWriter()
+    monkeypatch.setattr(write_queue, "write_records", writer)
+    queue = RequestWriteQueue(batch_size=200, flush_interval_ms=20)
+    queue.start()
+    try:
+        for record in _records(3):
+            queue.enqueue(record)
+        for _ in range(200):
+            if queue.get_stats()["written"] == 3:
+                break
+            time.sleep(0.01)
+        assert queue.get_stats()["written"] == 3
+        assert queue.running
+    finally:
+        queue.stop()
+
+
+def test_inline_write_when_stopped_or_full(monkeypatch):
+    """
+    场景：队列未启动时写入；队列已满（后台写入被阻塞）时继续写入
+    预期：记录直接同步写入而不是丢弃，sync_fallbacks 计数增加
+    """
+    writer = _RecordingWriter()
+    monkeypatch.setattr(write_queue, "write_records", writer)
+    queue = RequestWriteQueue(batch_size=1, flush_interval_ms=10, max_queue_size=1)
+    queue.enqueue(_records(1)[0])
+    assert writer.batches == [[{"id": "0", "project_id": "queue-test"}]]
+
+    release = threading.Event()
+    writer = _RecordingWriter(block=release)
+    monkeypatch.setattr(write_queue, "write_records", writer)
+    queue.start()
+    try:
+        queue.enqueue(_records(1, start=1)[0])  # 被后台线程取走后阻塞在写入
+        for _ in range(200):
+            if writer.calls:
+                break
+            time.sleep(0.01)
+        queue.enqueue(_records(1, start=2)[0])  # 占满队列
+        inline = threading.Thread(target=queue.enqueue, args=(_records(1, start=3)[0],))
+        inline.start()
+        for _ in range(200):
+            if queue.get_stats()["sync_fallbacks"]:
+                break
+            time.sleep(0.01)
+        assert queue.get_stats()["sync_fallbacks"] == 1
+        release.set()
+        inline.join(5)
+    finally:
+        release.set()
+        queue.stop()
+
+    written = sorted(record["id"] for batch in writer.batches for record in batch)
+    assert written == ["1", "2", "3"]
+    assert queue.get_stats()["dropped"] == 0
+
+
+def test_failed_flush_is_retried_before_dropping(monkeypatch):
+    """
+    场景：写入暂时失败（例如 database is locked）两次后恢复；另一个队列的写入一直失败
+    预期：第一种情况重试后写入成功、不丢数据；第二种情况用尽重试次数后才计入 dropped
+    """
+    writer = _RecordingWriter(failures=2)
+    monkeypatch.setattr(write_queue, "write_records", writer)
+    queue = RequestWriteQueue(batch_size=10, flush_interval_ms=10, retry_attempts=3, retry_backoff_ms=1)
+    queue.start()
+    for record in _records(5):
+        queue.enqueue(record)
+    queue.stop()
+    stats = queue.get_stats()
+    assert stats["written"] == 5 and stats["dropped"] == 0 and stats["retries"] == 2
+
+    writer = _RecordingWriter(failures=100)
+    monkeypatch.setattr(write_queue, "write_records", writer)
+    queue = RequestWriteQueue(batch_size=10, flush_interval_ms=10, retry_attempts=3, retry_backoff_ms=1)
+    queue.start()
+    for record in _records(5):
+        queue.enqueue(record)
+    queue.stop()
+    stats = queue.get_stats()
+    assert writer.calls == 3
+    assert stats["written"] == 0 and stats["dropped"] == 5 and stats["queue_depth"] == 0